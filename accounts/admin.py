@@ -3,7 +3,8 @@ from __future__ import unicode_literals
 
 from django.contrib import admin
 from django.contrib.gis.db import models
-from .models import Distance, Standard, Instrument, UserInstrument, Profile, Match
+from .models import Distance, Standard, Instrument, UserInstrument, Profile, Match, GeocodedLocation, \
+                    NotificationCounts, MatchJob, RebuiltTile, IndexChange
 from mapwidgets.widgets import GooglePointFieldWidget
 
 # Register your models here.
@@ -19,3 +20,8 @@ admin.site.register(Instrument)
 admin.site.register(UserInstrument)
 admin.site.register(Profile, ProfileAdmin)
 admin.site.register(Match)
+admin.site.register(GeocodedLocation)
+admin.site.register(NotificationCounts)
+admin.site.register(MatchJob)
+admin.site.register(RebuiltTile)
+admin.site.register(IndexChange)
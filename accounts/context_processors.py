@@ -1,13 +1,15 @@
 from django.contrib.auth.models import User
-from .models import Match
+from django.utils.functional import SimpleLazyObject
+from .notifications import get_counts
 
-def unknown_matches(request):
+def notifications(request):
     """
-    Context processor to fetch all new matches for the user
+    Context processor for the numbers of unread messages, new matches and new group invitations
+    which are shown at the bottom of every page. This is lazy, so that the counts are only
+    fetched for pages which actually display them.
     """
     if isinstance(request.user, User):
-        new_matches = Match.objects.filter(requesting_user=request.user, known=False)
-        return({"new_matches": new_matches})
+        return {"notifications": SimpleLazyObject(lambda: get_counts(request.user.pk))}
 
     # make sure no error is returned if the user isn't logged in:
-    return ({"new_matches": None})
+    return {"notifications": None}
@@ -83,11 +83,16 @@ class UserInstrumentForm(forms.ModelForm):
     can click to add or remove instruments
     """
     def __init__(self, *args, **kwargs):
+        # a formset can pass the same (initially empty) dict to each of its forms, so that the
+        # choices are only looked up once rather than once per form
+        shared_choices = kwargs.pop("shared_choices", {})
         super(UserInstrumentForm, self).__init__(*args, **kwargs)
         fields = ["instrument", "standard", "desired_instruments", "accepted_standards"]
         for field in fields:
             self.fields[field].empty_label = None
-            self.fields[field].widget.choices = self.fields[field].choices
+            if field not in shared_choices:
+                shared_choices[field] = list(self.fields[field].choices)
+            self.fields[field].choices = shared_choices[field]
 
 
     class Meta:
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import math
+from django.conf import settings
+from django.utils.module_loading import import_string
+from googlemaps import Client
+
+
+def trim_address(place):
+    """
+    remove first part of address - users will not want their full address to be publicly displayed!
+    in fact, after seeing more results, it is better to remove all but the last 2 parts!
+    """
+    return ",".join(place.split(",")[-2:])
+
+
+class _BaseUrlClient(Client):
+    """
+    A Google Maps client which sends every request to the given base URL instead of Google's own
+    servers. (The retries pass base_url on positionally, so it is replaced whichever way it comes.)
+    """
+    def __init__(self, base_url, **kwargs):
+        super(_BaseUrlClient, self).__init__(**kwargs)
+        self.base_url = base_url.rstrip("/")
+
+    def _request(self, url, params, first_request_time=None, retry_counter=0, base_url=None,
+                 *args, **kwargs):
+        return super(_BaseUrlClient, self)._request(url, params, first_request_time,
+                                                    retry_counter, self.base_url, *args, **kwargs)
+
+
+class GoogleGeocoder(object):
+    """
+    Looks addresses up with the Google Maps reverse geocoding API - or, if
+    settings.GOOGLE_MAPS_BASE_URL is set, with whatever is there (such as the stand-in server in
+    loadtest/fake_services.py)
+    """
+    def client(self):
+        if settings.GOOGLE_MAPS_BASE_URL:
+            return _BaseUrlClient(settings.GOOGLE_MAPS_BASE_URL, key=settings.GOOGLE_MAP_API_KEY)
+        return Client(key=settings.GOOGLE_MAP_API_KEY)
+
+    def reverse_geocode(self, latitude, longitude):
+        results = self.client().reverse_geocode((latitude, longitude))
+        # results is a list of dictionaries - the number is not possible to determine in advance
+        # - representing geographical areas of decreasing specificity around the given point. Some
+        # - but not all - will have a "formatted_address" key, and we will grab this data from the
+        # first case where it actually exists, in order to get the most specific address possible.
+        for item in results:
+            try:
+                return trim_address(item["formatted_address"])
+            except KeyError:
+                continue
+        return None
+
+
+class OfflineGeocoder(object):
+    """
+    Looks addresses up in a local gazetteer, with no network access at all - for use on
+    development, staging and CI machines.
+    The gazetteer is a CSV file with the columns name, region, latitude, longitude (one row per
+    town), and is loaded into a grid of GRID_SIZE-degree cells so that only the places in the
+    cells around a point need to be compared against it.
+    """
+    GRID_SIZE = 0.5
+
+    def __init__(self, path=None):
+        self.cells = {}
+        with open(path or settings.GEOCODER_GAZETTEER, "rb") as gazetteer:
+            for name, region, latitude, longitude in csv.reader(gazetteer):
+                latitude, longitude = float(latitude), float(longitude)
+                place = trim_address("%s, %s" % (name.decode("utf-8"), region.decode("utf-8")))
+                self.cells.setdefault(self._cell(latitude, longitude), []) \
+                          .append((latitude, longitude, place))
+        # the furthest cell from any point is at one of these corners - this bounds the search
+        self.bounds = [(min(cell[0] for cell in self.cells), min(cell[1] for cell in self.cells)),
+                       (max(cell[0] for cell in self.cells), max(cell[1] for cell in self.cells))] \
+                      if self.cells else []
+
+    def _cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.GRID_SIZE)),
+                int(math.floor(longitude / self.GRID_SIZE)))
+
+    def _nearest_in_ring(self, centre, ring, latitude, longitude, scale):
+        """
+        returns the (squared distance, place) of the nearest place in the square ring of cells
+        at distance "ring" around the centre cell
+        """
+        best = None
+        for i in range(centre[0] - ring, centre[0] + ring + 1):
+            for j in range(centre[1] - ring, centre[1] + ring + 1):
+                if max(abs(i - centre[0]), abs(j - centre[1])) != ring:
+                    continue
+                for place_lat, place_lng, place in self.cells.get((i, j), ()):
+                    # an equirectangular approximation is plenty to tell which town is nearest
+                    dist = (place_lat - latitude)**2 + ((place_lng - longitude) * scale)**2
+                    if best is None or dist < best[0]:
+                        best = (dist, place)
+        return best
+
+    def reverse_geocode(self, latitude, longitude):
+        if not self.cells:
+            return None
+        centre = self._cell(latitude, longitude)
+        scale = math.cos(math.radians(latitude))
+        max_ring = max(max(abs(i - centre[0]), abs(j - centre[1])) for i, j in self.bounds)
+        best = None
+        for ring in range(max_ring + 1):
+            found = self._nearest_in_ring(centre, ring, latitude, longitude, scale)
+            if found and (best is None or found[0] < best[0]):
+                best = found
+            # any place in a further ring is at least this far away (measured along one axis, and
+            # allowing for the shorter longitude degrees), so the search can stop once the best
+            # place found is nearer than that
+            if best is not None and best[0] <= (ring * self.GRID_SIZE * scale)**2:
+                break
+        return best[1]
+
+
+_geocoder = None
+
+def get_geocoder():
+    """
+    Returns the geocoding backend chosen by the GEOCODER_BACKEND setting, creating it on
+    first use (which, for the offline geocoder, is when the gazetteer is loaded)
+    """
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = import_string(settings.GEOCODER_BACKEND)()
+    return _geocoder
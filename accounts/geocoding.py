@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from googlemaps.exceptions import ApiError, TransportError, Timeout
+from .models import GeocodedLocation
+from .geocoders import get_geocoder
+
+UNKNOWN_ADDRESS = "Unknown"
+
+
+def quantize(point):
+    """
+    Returns the lookup fields for the cache entry covering the given point. Note that the
+    database stores the longitude first in the "coords" of a Point Field object.
+    """
+    precision = settings.GEOCODE_CACHE_PRECISION
+    longitude, latitude = point.coords
+    return {"precision": precision,
+            "latitude": int(round(latitude * 10**precision)),
+            "longitude": int(round(longitude * 10**precision))}
+
+
+def refresh(entry):
+    """
+    Looks up the address for a cache entry again, from the centre of the area it covers.
+    API failures are left for the next refresh to retry, rather than passed on to the user.
+    """
+    scale = 10.0**entry.precision
+    try:
+        entry.address = get_geocoder().reverse_geocode(entry.latitude / scale,
+                                                       entry.longitude / scale) or UNKNOWN_ADDRESS
+    except (ApiError, TransportError, Timeout):
+        return False
+    entry.updated = timezone.now()
+    entry.save()
+    return True
+
+
+def cache_location(point):
+    """
+    Makes sure the given point has an entry in the cache. This is called when a profile's
+    location is saved - the address itself is looked up later by the refresh_geocodes command,
+    so that saving a profile never has to wait for the API.
+    """
+    entry, created = GeocodedLocation.objects.get_or_create(**quantize(point))
+    return entry
+
+
+def cached_address(point):
+    """
+    Returns the (trimmed) address for the given point from the cache, without ever calling the
+    API. Any point not yet looked up is added to the cache for the refresh_geocodes command to
+    fill in, and shown as unknown until then.
+    """
+    entry, created = GeocodedLocation.objects.get_or_create(**quantize(point))
+    return entry.address or UNKNOWN_ADDRESS
+
+
+def cached_addresses(points):
+    """
+    The same as cached_address, for a list of points at once - with a single query, unless some
+    of them have to be added to the cache
+    """
+    keys = [quantize(point) for point in points]
+    if not keys:
+        return []
+    matching = Q()
+    for key in keys:
+        matching |= Q(**key)
+    addresses = dict(((entry.precision, entry.latitude, entry.longitude), entry.address)
+                     for entry in GeocodedLocation.objects.filter(matching))
+    found = []
+    for point, key in zip(points, keys):
+        lookup = (key["precision"], key["latitude"], key["longitude"])
+        if lookup not in addresses:
+            addresses[lookup] = cached_address(point)
+        found.append(addresses[lookup] or UNKNOWN_ADDRESS)
+    return found
+
+
+def stale_entries():
+    """
+    All cache entries which have never been looked up, or not for longer than allowed
+    """
+    cutoff = timezone.now() - timedelta(days=settings.GEOCODE_CACHE_MAX_AGE)
+    return GeocodedLocation.objects.filter(Q(address__isnull=True) | Q(updated__lt=cutoff))
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+from .models import UserInstrument
+
+
+class InstrumentIndex(object):
+    """
+    An in-memory inverted index of every UserInstrument, for finding the players whose
+    instruments are compatible with a user's before looking at where anyone is - so that the
+    database only has to find the users in range, without joining their instruments. It holds:
+    - players: (instrument id, standard id) -> the UserInstrument ids playing it at that standard
+    - wanting: instrument id -> the UserInstrument ids looking for that instrument
+    - accepting: standard id -> the UserInstrument ids accepting players of that standard
+    along with each UserInstrument's own details, so that it can be taken out again.
+    """
+    def __init__(self):
+        self.entries = {}    # UserInstrument id -> (user, instrument, standard, desired, accepted)
+        self.by_user = {}    # user id -> set of UserInstrument ids
+        self.players = {}
+        self.wanting = {}
+        self.accepting = {}
+
+    def _add(self, pk, user_id, instrument, standard, desired, accepted):
+        self.entries[pk] = (user_id, instrument, standard, desired, accepted)
+        self.by_user.setdefault(user_id, set()).add(pk)
+        self.players.setdefault((instrument, standard), set()).add(pk)
+        for wanted in desired:
+            self.wanting.setdefault(wanted, set()).add(pk)
+        for accepted_standard in accepted:
+            self.accepting.setdefault(accepted_standard, set()).add(pk)
+
+    def _load(self, user_instruments):
+        """
+        Adds the given UserInstrument queryset, with its two ManyToMany fields, in three queries
+        """
+        desired = {}
+        accepted = {}
+        through = UserInstrument.desired_instruments.through
+        for pk, instrument in through.objects.filter(userinstrument__in=user_instruments) \
+                                             .values_list("userinstrument", "instrument"):
+            desired.setdefault(pk, set()).add(instrument)
+        through = UserInstrument.accepted_standards.through
+        for pk, standard in through.objects.filter(userinstrument__in=user_instruments) \
+                                           .values_list("userinstrument", "standard"):
+            accepted.setdefault(pk, set()).add(standard)
+
+        for pk, user_id, instrument, standard in user_instruments.values_list("pk", "user",
+                                                                              "instrument",
+                                                                              "standard"):
+            self._add(pk, user_id, instrument, standard,
+                      frozenset(desired.get(pk, ())), frozenset(accepted.get(pk, ())))
+
+    def build(self):
+        """
+        (Re)loads the whole index from the database
+        """
+        self.entries, self.by_user = {}, {}
+        self.players, self.wanting, self.accepting = {}, {}, {}
+        self._load(UserInstrument.objects.all())
+
+    def update_user(self, user_id):
+        """
+        Replaces the entries belonging to a single user, for use whenever their instruments change
+        """
+        self.update_users([user_id])
+
+    def update_users(self, user_ids):
+        """
+        The same for any number of users at once, as read from the database in three queries
+        """
+        for user_id in user_ids:
+            self.remove_user(user_id)
+        self._load(UserInstrument.objects.filter(user__in=list(user_ids)))
+
+    def remove_user(self, user_id):
+        for pk in self.by_user.pop(user_id, ()):
+            _, instrument, standard, desired, accepted = self.entries.pop(pk)
+            self.players[(instrument, standard)].discard(pk)
+            for wanted in desired:
+                self.wanting[wanted].discard(pk)
+            for accepted_standard in accepted:
+                self.accepting[accepted_standard].discard(pk)
+
+    def wanted_candidates(self, user_id):
+        """
+        Returns a set of (requesting_instrument_id, found_user_id, found_instrument_id) for every
+        instrument another user plays which one of the given user's instruments is looking for,
+        at a standard it accepts - wherever they are
+        """
+        found = set()
+        for my_instr in self.by_user.get(user_id, ()):
+            _, _, _, desired, accepted = self.entries[my_instr]
+            for instrument in desired:
+                for standard in accepted:
+                    for their_instr in self.players.get((instrument, standard), ()):
+                        their_user = self.entries[their_instr][0]
+                        if their_user != user_id:
+                            found.add((my_instr, their_user, their_instr))
+        return found
+
+    def wanting_candidates(self, user_id):
+        """
+        The reverse of the above: (requesting_instrument_id, requesting_user_id,
+        found_instrument_id) for every other user's instrument which is looking for one of the
+        given user's, at its standard
+        """
+        found = set()
+        for my_instr in self.by_user.get(user_id, ()):
+            _, instrument, standard, _, _ = self.entries[my_instr]
+            wanting = self.wanting.get(instrument, set())
+            accepting = self.accepting.get(standard, set())
+            # (set intersection only has to go through the smaller of the two)
+            for their_instr in wanting & accepting:
+                their_user = self.entries[their_instr][0]
+                if their_user != user_id:
+                    found.add((their_instr, their_user, my_instr))
+        return found
+
+
+_index = None
+# held while using the index, which is shared by all the threads of a process (see spatial_index)
+lock = threading.RLock()
+
+def get_index():
+    """
+    Returns the index for this process, building it on first use
+    """
+    global _index
+    with lock:
+        if _index is None:
+            _index = InstrumentIndex()
+            _index.build()
+        return _index
+
+
+def refresh_user(user_id):
+    """
+    Keeps the index up to date after a user's instruments change. As with the other in-memory
+    indexes, nothing needs doing if this process has not built it yet.
+    """
+    with lock:
+        if _index is not None:
+            _index.update_user(user_id)
+
+
+def refresh_users(user_ids):
+    with lock:
+        if _index is not None:
+            _index.update_users(user_ids)
+
+
+def rebuild():
+    """
+    Replaces the index, if this process has built one, with a fresh copy - built while the old
+    one carries on being used
+    """
+    global _index
+    if _index is None:
+        return
+    index = InstrumentIndex()
+    index.build()
+    with lock:
+        _index = index
+
+
+def reset():
+    """
+    Throws the index away, to be built again on next use - for after instruments are changed in
+    bulk, which doesn't send the signals that keep it up to date
+    """
+    global _index
+    with lock:
+        _index = None
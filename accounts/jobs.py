@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import MatchJob, IndexChange
+from .matching import update_matches
+from . import match_index, spatial_index, instrument_index
+
+FLAGS = ("new_location", "new_maxdist", "new_instruments")
+
+
+def enqueue_matches(user, new_location=False, new_maxdist=False, new_instruments=False):
+    """
+    Queues a recalculation of the user's matches, taking the same arguments as update_matches.
+    If a job for the user is already waiting, the changes are added to it rather than a second
+    job being queued. A job that a worker is running is unclaimed at the same time, so that it
+    stays on the queue to be run again, with the new changes, once the worker is done.
+    """
+    flags = {"new_location": new_location, "new_maxdist": new_maxdist,
+             "new_instruments": new_instruments}
+    if not any(flags.values()):
+        return
+    changed = dict((flag, True) for flag, value in flags.items() if value)
+    # the job may be deleted by a worker that has just run it, in which case the update finds
+    # nothing - and a new job is needed after all
+    while not MatchJob.objects.filter(user=user).update(claimed=None, **changed):
+        try:
+            with transaction.atomic():
+                MatchJob.objects.create(user=user, **flags)
+            return
+        except IntegrityError:
+            # another request has just queued one
+            continue
+
+
+class IndexRefresher(object):
+    """
+    Keeps a worker's in-memory indexes (see the MATCH_INDEX, SPATIAL_INDEX and INSTRUMENT_INDEX
+    settings) up to date with the changes saved by other processes. Their signal handlers only
+    update their own process's indexes, but also log the users they change as IndexChange rows:
+    refresh() reloads just those users, and is called before each batch of jobs. Every
+    INDEX_REBUILD_INTERVAL seconds the indexes are instead rebuilt from scratch (alongside the
+    ones in use), to pick up bulk changes which aren't logged, and the old log entries are
+    cleared out.
+    """
+    # the changes are logged inside the transactions that save them, and may only be seen some
+    # time after their timestamp - so each refresh looks back this far before the last one
+    OVERLAP = timedelta(minutes=1)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refreshed = self.rebuilt = timezone.now()
+
+    def refresh(self):
+        if not (settings.MATCH_INDEX or settings.SPATIAL_INDEX or settings.INSTRUMENT_INDEX):
+            return
+        with self.lock:
+            now = timezone.now()
+            if now - self.rebuilt > timedelta(seconds=settings.INDEX_REBUILD_INTERVAL):
+                for index in (match_index, spatial_index, instrument_index):
+                    index.rebuild()
+                IndexChange.objects.filter(changed__lt=self.rebuilt - self.OVERLAP).delete()
+                self.rebuilt = now
+            else:
+                user_ids = set(IndexChange.objects
+                                          .filter(changed__gte=self.refreshed - self.OVERLAP)
+                                          .values_list("user", flat=True))
+                if user_ids:
+                    for index in (match_index, spatial_index, instrument_index):
+                        index.refresh_users(user_ids)
+            self.refreshed = now
+
+
+def claim_jobs(limit):
+    """
+    Claims up to "limit" of the oldest jobs on the queue: those nobody has claimed, and those
+    whose worker has held them for longer than MATCH_JOB_CLAIM_TIMEOUT seconds (it has presumably
+    died). The rows are locked with SKIP LOCKED so that any number of workers can claim jobs at
+    once without waiting on each other. A claimed job stays on the queue until run_job has done
+    it, so no job is lost if the worker is stopped half way through a batch.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.MATCH_JOB_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        jobs = list(MatchJob.objects.select_for_update(skip_locked=True)
+                                    .select_related("user__profile__max_distance")
+                                    .filter(Q(claimed__isnull=True) | Q(claimed__lt=stale))
+                                    .order_by("queued")[:limit])
+        MatchJob.objects.filter(pk__in=[job.pk for job in jobs]).update(claimed=now)
+    for job in jobs:
+        job.claimed = now
+    return jobs
+
+
+def release_job(job):
+    """
+    Hands a claimed job back without running it, for another worker to claim straight away.
+    """
+    MatchJob.objects.filter(pk=job.pk, claimed=job.claimed).update(claimed=None)
+
+
+def run_job(job):
+    """
+    Recalculates the matches for a claimed job, returning how long the job waited in the queue
+    and then took to run, in seconds. The job is deleted once its matches are saved - unless
+    the profile has been saved again meanwhile, which unclaims it to be run again. A job that
+    fails is handed back to the queue before the error is passed on.
+    """
+    started = timezone.now()
+    flags = dict((flag, getattr(job, flag)) for flag in FLAGS)
+    try:
+        update_matches(job.user, **flags)
+    except Exception:
+        release_job(job)
+        raise
+    MatchJob.objects.filter(pk=job.pk, claimed=job.claimed).delete()
+    finished = timezone.now()
+    return (started - job.queued).total_seconds(), (finished - started).total_seconds()
+
+
+def queue_depth():
+    return MatchJob.objects.count()
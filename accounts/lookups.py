@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from ajax_select import LookupChannel
+from . import usernames
+
+
+class UsernameLookup(LookupChannel):
+    """
+    The base for the channels which autocomplete usernames. It isn't registered itself: each
+    channel says which users it can find with get_users, and names that set of users with
+    get_scope for the shared cache of results (see usernames.py).
+    """
+    model = User
+    scope = "all"
+
+    def get_users(self, request):
+        return self.model.objects.all()
+
+    def get_scope(self, request):
+        return self.scope
+
+    def get_query(self, q, request):
+        return usernames.search(self.get_users(request), q, self.get_scope(request))
+
+    def format_match(self, user):
+        return "<span class='autocomplete-option'>%s</span>" % user.username
+
+    def check_auth(self, request):
+        if request.user.is_authenticated() :
+            return True
@@ -0,0 +1,281 @@
+import json
+import time
+from itertools import chain
+from StringIO import StringIO
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, \
+                              teardown_test_environment, override_settings
+from django.utils import timezone
+from accounts.jobs import enqueue_matches, claim_jobs
+from accounts.management.commands.process_match_jobs import Command as ProcessMatchJobs
+from accounts.matching import update_matches
+from accounts.models import Match, Instrument, IndexChange
+from accounts.population import PopulationGenerator, clear_population, PREFIX
+from accounts import spatial_index, instrument_index
+
+MEGABYTE = 1024.0 * 1024
+
+# the two ways of storing matches compared by match_storage below, as the SELECTs which fill
+# them from the current Match table and the indexes Django gave each of them: one row for each
+# pair of users (as now), and one row for each pair of UserInstruments matched (as before the
+# instrument pairs were packed into arrays)
+STORAGE_LAYOUTS = {
+    "per_user_pair": ("""
+        SELECT id, requesting_user_id, found_user_id, instrument_pairs, distance, known,
+               mark_new, generation
+        FROM accounts_match
+    """, [("requesting_user_id",), ("found_user_id",),
+          ("requesting_user_id", "found_user_id")]),
+    "per_instrument_pair": ("""
+        SELECT (ROW_NUMBER() OVER ())::integer AS id, m.requesting_user_id, m.found_user_id,
+               requesting.id AS requesting_instrument_id, found.id AS found_instrument_id,
+               m.distance, m.known, m.mark_new, m.generation
+        FROM accounts_match m
+        CROSS JOIN unnest(m.instrument_pairs) pair
+        JOIN accounts_userinstrument requesting
+            ON requesting.user_id = m.requesting_user_id
+            AND requesting.instrument_id = pair / %(base)d
+        JOIN accounts_userinstrument found
+            ON found.user_id = m.found_user_id AND found.instrument_id = mod(pair, %(base)d)
+    """, [("requesting_user_id",), ("found_user_id",), ("requesting_instrument_id",),
+          ("found_instrument_id",), ("requesting_instrument_id", "found_instrument_id")]),
+}
+
+
+def summarise(samples):
+    """
+    Sums up a list of (seconds, queries) measurements
+    """
+    times = sorted(seconds * 1000 for seconds, queries in samples)
+    queries = sorted(queries for seconds, queries in samples)
+    if not times:
+        return {"samples": 0}
+    return {"samples": len(times),
+            "mean_ms": sum(times) / len(times),
+            "median_ms": times[len(times) // 2],
+            "p95_ms": times[min(int(len(times) * 0.95), len(times) - 1)],
+            "max_ms": times[-1],
+            "median_queries": queries[len(queries) // 2]}
+
+
+class Command(BaseCommand):
+    """
+    Measures how the matching and the pages built from matches and profiles scale with the
+    number of users. Starting from no synthetic users (any there already are removed), the
+    population is grown to each of the given sizes in turn (see accounts/population.py), the
+    matches are rebuilt, and then, for a sample of users:
+    - update_matches is run as if they had moved - with the database finding the users in range,
+    with the in-memory spatial index, and with the instrument index finding the compatible
+    players first (the build times of both indexes are also recorded)
+    - the same three ways, as a job run by the process_match_jobs worker: so including claiming
+    the job and bringing the worker's indexes up to date with the user's change
+    - the number of pairs of instruments examined is counted, both when the users in range are
+    found first and their instruments checked, and when the compatible players are found first
+    and those in range kept
+    - the matches, matches_detail and user_profile pages are fetched, with an empty cache
+    The space taken by the matches is recorded at each size too, against what they would take
+    stored one row per pair of instruments matched, as they used to be.
+    The time taken and queries run for each are written to the --output file as JSON, with one
+    entry per size, after each size is finished.
+    This should only be run against a database set aside for it!
+    """
+    help = "Time the matching and the main pages at increasing numbers of users"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000",
+                            help="The numbers of users to measure at, separated by commas")
+        parser.add_argument("--samples", type=int, default=20,
+                            help="The number of users to take the measurements for at each size")
+        parser.add_argument("--output", default="benchmark.json",
+                            help="The file to write the results to")
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Seed for the population, so that runs can be compared")
+        parser.add_argument("--processes", type=int, default=4,
+                            help="The number of processes to rebuild the matches in")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options["sizes"].split(","))
+        report = {"started": timezone.now().isoformat(), "samples": options["samples"],
+                  "seed": options["seed"], "sizes": []}
+        # lets the test client in, whatever ALLOWED_HOSTS says
+        setup_test_environment()
+        try:
+            clear_population()
+            generator = PopulationGenerator(seed=options["seed"])
+            population = 0
+            for size in sizes:
+                started = time.time()
+                generator.generate(size - population)
+                population = size
+                generated = time.time() - started
+
+                started = time.time()
+                call_command("rebuild_matches", restart=True, processes=options["processes"],
+                             stdout=StringIO())
+                rebuilt = time.time() - started
+
+                started = time.time()
+                spatial_index.get_index()
+                indexed = time.time() - started
+                started = time.time()
+                instrument_index.get_index()
+                inverted = time.time() - started
+                timings, examined = self.measure_sample(options["samples"])
+                result = {"users": size, "matches": Match.objects.count(),
+                          "match_storage": self.match_storage(),
+                          "generate_seconds": generated, "rebuild_seconds": rebuilt,
+                          "spatial_index_seconds": indexed, "instrument_index_seconds": inverted,
+                          "timings": timings, "rows_examined": examined}
+                report["sizes"].append(result)
+                with open(options["output"], "w") as output:
+                    json.dump(report, output, indent=2, sort_keys=True)
+
+                self.stdout.write("%d users, %d matches - rebuilt in %.1fs"
+                                  % (size, result["matches"], result["rebuild_seconds"]))
+                storage = result["match_storage"]
+                self.stdout.write("    matches stored in %.1fMB (%d rows), against %.1fMB (%d rows) "
+                                  "one row per pair of instruments - %.0f%% saved"
+                                  % (storage["per_user_pair"]["total_bytes"] / MEGABYTE,
+                                     storage["per_user_pair"]["rows"],
+                                     storage["per_instrument_pair"]["total_bytes"] / MEGABYTE,
+                                     storage["per_instrument_pair"]["rows"],
+                                     storage["saved_fraction"] * 100))
+                for name, timing in sorted(result["timings"].items()):
+                    if timing["samples"]:
+                        self.stdout.write("    %s: median %.1fms, p95 %.1fms, %d queries"
+                                          % (name, timing["median_ms"], timing["p95_ms"],
+                                             timing["median_queries"]))
+                for name, rows in sorted(examined.items()):
+                    self.stdout.write("    %s: median %d instrument pairs examined" % (name, rows))
+        finally:
+            teardown_test_environment()
+        self.stdout.write("Results written to %s" % options["output"])
+
+    def measure(self, action):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.time()
+            action()
+            took = time.time() - started
+        return took, len(queries)
+
+    def fetch(self, client, url):
+        def get():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError("%s returned status %d" % (url, response.status_code))
+        cache.clear()
+        return self.measure(get)
+
+    def match_storage(self):
+        """
+        Measures the space saved by storing matches as one row per pair of users, rather than
+        one row per pair of UserInstruments matched as they were before. Both layouts are built
+        as temporary tables from the current matches, with the indexes Django gave each, so that
+        neither is counted with the dead rows the rebuild leaves in the Match table itself (whose
+        size is recorded as well). Returns the rows and sizes in bytes of each layout, and the
+        bytes and fraction saved.
+        """
+        storage = {}
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT pg_total_relation_size(%s)", [Match._meta.db_table])
+            storage["match_table_bytes"] = cursor.fetchone()[0]
+            for name, (select, indexes) in STORAGE_LAYOUTS.items():
+                table = "benchmark_%s" % name
+                cursor.execute("CREATE TEMPORARY TABLE %s ON COMMIT DROP AS %s"
+                               % (table, select % {"base": Match.PAIR_BASE}))
+                cursor.execute("ALTER TABLE %s ADD PRIMARY KEY (id)" % table)
+                for columns in indexes:
+                    cursor.execute("CREATE INDEX ON %s (%s)" % (table, ", ".join(columns)))
+                cursor.execute("SELECT (SELECT COUNT(*) FROM {0}), pg_table_size('{0}'), "
+                               "pg_indexes_size('{0}')".format(table))
+                rows, table_bytes, indexes_bytes = cursor.fetchone()
+                storage[name] = {"rows": rows, "table_bytes": table_bytes,
+                                 "indexes_bytes": indexes_bytes,
+                                 "total_bytes": table_bytes + indexes_bytes}
+        before = storage["per_instrument_pair"]["total_bytes"]
+        storage["saved_bytes"] = before - storage["per_user_pair"]["total_bytes"]
+        storage["saved_fraction"] = float(storage["saved_bytes"]) / before if before else 0.0
+        return storage
+
+    def rows_examined(self, user):
+        """
+        The number of pairs of the user's instruments and other players' which the matching has
+        to look at when the users in range (in either direction) are found first, and when the
+        compatible players are - counting only those which are also in range, as the rest are
+        dropped without their distance being measured
+        """
+        instruments = instrument_index.get_index()
+        locations = spatial_index.get_index()
+        profile = user.profile
+        nearby = locations.within(profile.location, profile.max_distance.distance)
+        reaching = locations.reaching(profile.location)
+        others = set(chain(nearby, reaching)) - set([user.pk])
+        mine = len(instruments.by_user.get(user.pk, ()))
+        spatial_first = mine * sum(len(instruments.by_user.get(other, ())) for other in others)
+        instrument_first = len([candidate for candidate
+                                in instruments.wanted_candidates(user.pk)
+                                if candidate[1] in nearby]) \
+                           + len([candidate for candidate
+                                  in instruments.wanting_candidates(user.pk)
+                                  if candidate[1] in reaching])
+        return spatial_first, instrument_first
+
+    def run_job(self, worker, user):
+        """
+        Queues a recalculation of the user's matches, as a web process does when they move (also
+        logging the change for the worker's indexes), and measures the worker running it
+        """
+        IndexChange.objects.create(user=user.pk)
+        enqueue_matches(user, new_location=True)
+        return self.measure(lambda: worker.run_batch(claim_jobs(1)))
+
+    def measure_sample(self, samples):
+        timings = dict((name, []) for name
+                       in ["update_matches", "update_matches_spatial_index",
+                           "update_matches_instrument_index", "worker", "worker_spatial_index",
+                           "worker_instrument_index", "matches", "matches_detail",
+                           "user_profile"])
+        examined = {"spatial_first": [], "instrument_first": []}
+        client = Client()
+        worker = ProcessMatchJobs(stdout=StringIO())
+        for user in User.objects.filter(username__startswith=PREFIX).order_by("?")[:samples]:
+            spatial_first, instrument_first = self.rows_examined(user)
+            examined["spatial_first"].append(spatial_first)
+            examined["instrument_first"].append(instrument_first)
+            timings["update_matches"].append(
+                self.measure(lambda: update_matches(user, new_location=True)))
+            with override_settings(SPATIAL_INDEX=True):
+                timings["update_matches_spatial_index"].append(
+                    self.measure(lambda: update_matches(user, new_location=True)))
+            with override_settings(INSTRUMENT_INDEX=True):
+                timings["update_matches_instrument_index"].append(
+                    self.measure(lambda: update_matches(user, new_location=True)))
+            timings["worker"].append(self.run_job(worker, user))
+            with override_settings(SPATIAL_INDEX=True):
+                timings["worker_spatial_index"].append(self.run_job(worker, user))
+            with override_settings(INSTRUMENT_INDEX=True):
+                timings["worker_instrument_index"].append(self.run_job(worker, user))
+
+            client.force_login(user)
+            timings["matches"].append(self.fetch(client, reverse("matches")))
+            match = Match.objects.filter(requesting_user=user).select_related("found_user") \
+                                 .first()
+            if match is not None:
+                played, want = Match.unpack_pair(match.instrument_pairs[0])
+                names = dict(Instrument.objects.filter(pk__in=[played, want])
+                                               .values_list("pk", "instrument"))
+                detail = reverse("matches_detail", kwargs={"played": names[played],
+                                                           "want": names[want]})
+                timings["matches_detail"].append(self.fetch(client, detail))
+                profile = reverse("user_profile", kwargs={"username": match.found_user.username})
+                timings["user_profile"].append(self.fetch(client, profile))
+            client.logout()
+        return (dict((name, summarise(samples)) for name, samples in timings.items()),
+                dict((name, sorted(rows)[len(rows) // 2]) for name, rows in examined.items()
+                     if rows))
@@ -0,0 +1,50 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from accounts.population import PopulationGenerator, parse_weights, clear_population
+
+
+class Command(BaseCommand):
+    """
+    Fills the database with synthetic users for load testing and benchmarking (see
+    accounts/population.py). The users are called synthetic_0000000 and so on, all with the
+    password "synthetic", and can be removed again with --clear. Once they have been created,
+    their matches are rebuilt unless --skip-matches is given.
+    """
+    help = "Create synthetic users, clustered around the towns of England and Wales"
+
+    def add_arguments(self, parser):
+        parser.add_argument("num_users", type=int, nargs="?", default=0,
+                            help="The number of users to add")
+        parser.add_argument("--instruments",
+                            help='Relative numbers of players of each instrument, as "piano=25,violin=25,..."')
+        parser.add_argument("--standards",
+                            help="Relative numbers of players of each standard (by default, all equal)")
+        parser.add_argument("--distances",
+                            help='Relative numbers of users searching within each distance, as "5=1,10=3,..."')
+        parser.add_argument("--seed", type=int, help="Seed for the random choices, to repeat a population")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="The number of users to create in each transaction")
+        parser.add_argument("--skip-matches", action="store_true",
+                            help="Don't rebuild the matches afterwards")
+        parser.add_argument("--clear", action="store_true",
+                            help="Remove all the synthetic users (before adding any more)")
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            clear_population()
+            self.stdout.write("Removed the synthetic users")
+        if not options["num_users"]:
+            return
+
+        try:
+            generator = PopulationGenerator(
+                seed=options["seed"],
+                instruments=options["instruments"] and parse_weights(options["instruments"]),
+                standards=options["standards"] and parse_weights(options["standards"]),
+                distances=options["distances"] and parse_weights(options["distances"]))
+        except ValueError as error:
+            raise CommandError(error)
+        user_ids = generator.generate(options["num_users"], options["batch_size"])
+        self.stdout.write("Created %d synthetic users" % len(user_ids))
+        if not options["skip_matches"]:
+            call_command("rebuild_matches", restart=True, stdout=self.stdout)
@@ -0,0 +1,90 @@
+import logging
+import signal
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from accounts.jobs import claim_jobs, release_job, run_job, queue_depth, IndexRefresher
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    The worker which recalculates matches queued by profile saves (see accounts/jobs.py).
+    Each of the --concurrency threads claims and runs jobs independently, with its own database
+    connection. After every batch a line is written with the current queue depth and the time
+    the jobs spent waiting in the queue and running.
+    On SIGTERM or Ctrl-C each thread finishes the job it's running and hands the rest of its
+    batch back to the queue; jobs held by a worker which is killed outright are claimed by
+    another after MATCH_JOB_CLAIM_TIMEOUT.
+    Any in-memory indexes are brought up to date with the changes made by the web processes
+    before each batch (see IndexRefresher).
+    """
+    help = "Run the queued recalculations of users' matches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=2,
+                            help="The number of jobs to run at once")
+        parser.add_argument("--batch-size", type=int, default=10,
+                            help="The number of jobs each thread claims at a time")
+        parser.add_argument("--poll", type=float, default=1.0,
+                            help="How long to wait (in seconds) before checking an empty queue again")
+        parser.add_argument("--once", action="store_true",
+                            help="Stop once the queue is empty, rather than waiting for more jobs")
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.indexes = IndexRefresher()
+
+    def handle(self, *args, **options):
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopping.set())
+        threads = [threading.Thread(target=self.work, args=(options,))
+                   for _ in range(options["concurrency"])]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+
+    def work(self, options):
+        try:
+            while not self.stopping.is_set():
+                jobs = claim_jobs(options["batch_size"])
+                if not jobs:
+                    if options["once"]:
+                        return
+                    time.sleep(options["poll"])
+                    continue
+                self.run_batch(jobs)
+        finally:
+            connection.close()
+
+    def run_batch(self, jobs):
+        self.indexes.refresh()
+        waits, runs = [], []
+        for job in jobs:
+            if self.stopping.is_set():
+                release_job(job)
+                continue
+            try:
+                waited, ran = run_job(job)
+            except Exception:
+                logger.exception("Recalculating the matches for %s failed", job.user)
+                continue
+            waits.append(waited)
+            runs.append(ran)
+        if not runs:
+            return
+        with self.lock:
+            self.stdout.write("%d jobs done, %d queued - waited %.2fs on average (longest %.2fs), "
+                              "ran in %.2fs on average"
+                              % (len(runs), queue_depth(), sum(waits) / len(waits), max(waits),
+                                 sum(runs) / len(runs)))
@@ -0,0 +1,81 @@
+import math
+import time
+from multiprocessing import Pool
+from django import db
+from django.core.management.base import BaseCommand
+from accounts.matching import rebuild_matches
+from accounts.models import Profile, RebuiltTile
+
+
+def close_connections():
+    # the worker processes must not share the database connection inherited from the parent
+    db.connections.close_all()
+
+
+def rebuild_tile(args):
+    tile, user_ids = args
+    started = time.time()
+    num_matches = rebuild_matches(user_ids)
+    return tile, len(user_ids), num_matches, time.time() - started
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the whole Match table - for use after changing the Distance or Standard choices,
+    or importing users. Users are divided into square tiles by location, and the tiles are
+    shared out between a pool of processes, each of which rebuilds the matches of a tile's
+    users at once (see accounts.matching.rebuild_matches).
+    Finished tiles are recorded in the database, so if the command is interrupted, running it
+    again carries on from where it stopped.
+    """
+    help = "Recalculate the matches of every user"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=4,
+                            help="The number of processes to rebuild tiles in")
+        parser.add_argument("--tile-size", type=float, default=0.5,
+                            help="The size of each tile, in degrees of latitude and longitude")
+        parser.add_argument("--restart", action="store_true",
+                            help="Start again from the beginning, even if a previous rebuild was interrupted")
+
+    def handle(self, *args, **options):
+        size = options["tile_size"]
+        if options["restart"]:
+            RebuiltTile.objects.all().delete()
+
+        tiles = {}
+        for user_id, location in Profile.objects.values_list("user", "location"):
+            longitude, latitude = location.coords
+            tile = (int(math.floor(latitude / size)), int(math.floor(longitude / size)))
+            tiles.setdefault(tile, []).append(user_id)
+        done = set(RebuiltTile.objects.filter(size=size).values_list("latitude", "longitude"))
+        todo = sorted(tile for tile in tiles if tile not in done)
+        total_users = sum(len(tiles[tile]) for tile in todo)
+        self.stdout.write("Rebuilding matches for %d users in %d tiles (%d tiles already done)"
+                          % (total_users, len(todo), len(done & set(tiles))))
+
+        close_connections()
+        pool = Pool(options["processes"], initializer=close_connections)
+        started = time.time()
+        users_done = matches_found = 0
+        try:
+            for count, (tile, num_users, num_matches, took) in enumerate(
+                    pool.imap_unordered(rebuild_tile, [(tile, tiles[tile]) for tile in todo]), 1):
+                RebuiltTile.objects.create(size=size, latitude=tile[0], longitude=tile[1])
+                users_done += num_users
+                matches_found += num_matches
+                elapsed = time.time() - started
+                self.stdout.write("[%d/%d tiles] %d/%d users, %d matches - %.1f users/s"
+                                  % (count, len(todo), users_done, total_users, matches_found,
+                                     users_done / elapsed if elapsed else 0))
+        except BaseException:
+            # including an interruption with Ctrl-C
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        RebuiltTile.objects.filter(size=size).delete()
+        self.stdout.write("Finished in %.1fs" % (time.time() - started))
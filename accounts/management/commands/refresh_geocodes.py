@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from accounts.geocoding import stale_entries, refresh, cached_address
+from accounts.models import Profile
+
+
+class Command(BaseCommand):
+    """
+    Fills in and refreshes the reverse-geocode cache. Intended to be run regularly as a
+    background job (for example from the Heroku scheduler), so that the cache is kept up to date
+    without any page view having to call the Google Maps API.
+    """
+    help = "Look up the addresses of any new or out-of-date entries in the geocode cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=None,
+                            help="The maximum number of addresses to look up (to respect API quotas)")
+
+    def handle(self, *args, **options):
+        # make sure every profile's location has an entry - this covers profiles saved before
+        # the cache existed
+        for location in Profile.objects.values_list("location", flat=True):
+            cached_address(location)
+
+        entries = stale_entries().order_by("updated")
+        if options["limit"] is not None:
+            entries = entries[:options["limit"]]
+
+        refreshed = failed = 0
+        for entry in entries:
+            if refresh(entry):
+                refreshed += 1
+            else:
+                failed += 1
+        self.stdout.write("Refreshed %d addresses (%d failed)" % (refreshed, failed))
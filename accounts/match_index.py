@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import numpy as np
+from .models import UserInstrument
+
+# the masks are stored as unsigned 64-bit integers, so this is the most instruments (or standards)
+# the index can handle. Both lists are set in the Django admin and are nowhere near this size.
+MAX_CHOICES = 64
+
+
+class CompatibilityIndex(object):
+    """
+    An in-memory copy of every UserInstrument, held as parallel NumPy arrays so that the
+    "do they play what I want, at a standard I accept?" test can be run against every other
+    player at once.
+    Each Instrument and Standard is given a bit position the first time it is seen, and each
+    UserInstrument is then stored as:
+    - pks/users: the UserInstrument and owning User primary keys
+    - instruments/standards: the bit positions of the instrument played and the standard
+    - desired/accepted: bitmasks of the instruments wanted and the standards accepted
+    """
+    FIELDS = ("pks", "users", "instruments", "standards", "desired", "accepted")
+    DTYPES = (np.int64, np.int64, np.uint64, np.uint64, np.uint64, np.uint64)
+
+    def __init__(self):
+        self.instrument_bits = {}
+        self.standard_bits = {}
+        self._set_rows([])
+
+    def _bit(self, bits, pk):
+        """
+        returns the bit position for the given Instrument/Standard pk, allocating one if needed
+        """
+        if pk not in bits:
+            if len(bits) == MAX_CHOICES:
+                raise ValueError("The compatibility index supports at most %d choices" % MAX_CHOICES)
+            bits[pk] = len(bits)
+        return bits[pk]
+
+    def _set_rows(self, rows):
+        columns = list(zip(*rows)) or [()] * len(self.FIELDS)
+        for field, dtype, column in zip(self.FIELDS, self.DTYPES, columns):
+            setattr(self, field, np.array(column, dtype=dtype))
+
+    def _keep(self, selection):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field)[selection])
+
+    def _append(self, rows):
+        current = [getattr(self, field) for field in self.FIELDS]
+        self._set_rows(rows)
+        for field, existing in zip(self.FIELDS, current):
+            setattr(self, field, np.concatenate([existing, getattr(self, field)]))
+
+    def _load(self, user_instruments):
+        """
+        Reads the given UserInstrument queryset, with its two ManyToMany fields, in three
+        queries and returns it as a list of rows in the form stored by the index.
+        """
+        desired = {}
+        accepted = {}
+        through = UserInstrument.desired_instruments.through
+        for instr, wanted in through.objects.filter(userinstrument__in=user_instruments) \
+                                            .values_list("userinstrument", "instrument"):
+            desired[instr] = desired.get(instr, 0) | (1 << self._bit(self.instrument_bits, wanted))
+        through = UserInstrument.accepted_standards.through
+        for instr, standard in through.objects.filter(userinstrument__in=user_instruments) \
+                                              .values_list("userinstrument", "standard"):
+            accepted[instr] = accepted.get(instr, 0) | (1 << self._bit(self.standard_bits, standard))
+
+        return [(pk, user, self._bit(self.instrument_bits, instrument),
+                 self._bit(self.standard_bits, standard), desired.get(pk, 0), accepted.get(pk, 0))
+                for pk, user, instrument, standard
+                in user_instruments.values_list("pk", "user", "instrument", "standard")]
+
+    def _rows(self, selection):
+        return zip(*[getattr(self, field)[selection] for field in self.FIELDS])
+
+    def build(self):
+        """
+        (Re)loads the whole index from the database
+        """
+        self._set_rows(self._load(UserInstrument.objects.all()))
+
+    def update_user(self, user_id):
+        """
+        Replaces the rows belonging to a single user, for use whenever their profile is saved
+        """
+        self.update_users([user_id])
+
+    def update_users(self, user_ids):
+        """
+        The same for any number of users at once, as read from the database in three queries
+        """
+        rows = self._load(UserInstrument.objects.filter(user__in=list(user_ids)))
+        self._keep(~np.isin(self.users, np.array(list(user_ids), dtype=np.int64)))
+        self._append(rows)
+
+    def remove_user(self, user_id):
+        self._keep(self.users != user_id)
+
+    def _candidates(self, user_id, candidate_users):
+        selection = self.users != user_id
+        if candidate_users is not None:
+            selection &= np.isin(self.users, np.fromiter(candidate_users, dtype=np.int64))
+        return selection
+
+    def wanted_matches(self, user_id, candidate_users=None):
+        """
+        Returns the matches where the given user is the one looking, in the same
+        (requesting_user_id, found_user_id, requesting_instrument_id, found_instrument_id) form
+        as accounts.matching. If given, candidate_users restricts the search to those user ids -
+        typically those within the user's max_distance.
+        """
+        candidates = self._candidates(user_id, candidate_users)
+        instrument_masks = np.left_shift(np.uint64(1), self.instruments)
+        standard_masks = np.left_shift(np.uint64(1), self.standards)
+        found = set()
+        for my_instr, _, _, _, desired, accepted in self._rows(self.users == user_id):
+            compatible = candidates & ((instrument_masks & desired) != 0) \
+                                    & ((standard_masks & accepted) != 0)
+            found.update((user_id, int(their_user), int(my_instr), int(their_instr))
+                         for their_instr, their_user
+                         in zip(self.pks[compatible], self.users[compatible]))
+        return found
+
+    def wanted_by_others(self, user_id, candidate_users=None):
+        """
+        The reverse of the above: the matches where the given user is the one found.
+        """
+        candidates = self._candidates(user_id, candidate_users)
+        found = set()
+        for my_instr, _, instrument, standard, _, _ in self._rows(self.users == user_id):
+            compatible = candidates \
+                         & ((self.desired & np.left_shift(np.uint64(1), instrument)) != 0) \
+                         & ((self.accepted & np.left_shift(np.uint64(1), standard)) != 0)
+            found.update((int(their_user), user_id, int(their_instr), int(my_instr))
+                         for their_instr, their_user
+                         in zip(self.pks[compatible], self.users[compatible]))
+        return found
+
+
+_index = None
+# held while using the index, which is shared by all the threads of a process (see spatial_index)
+lock = threading.RLock()
+
+def get_index():
+    """
+    Returns the index for this process, building it on first use
+    """
+    global _index
+    with lock:
+        if _index is None:
+            _index = CompatibilityIndex()
+            _index.build()
+        return _index
+
+
+def refresh_user(user_id):
+    """
+    Keeps the index up to date after a user's instruments change. Nothing needs doing if this
+    process has not built the index yet - it will be built from the current data when it is.
+    """
+    with lock:
+        if _index is not None:
+            _index.update_user(user_id)
+
+
+def refresh_users(user_ids):
+    with lock:
+        if _index is not None:
+            _index.update_users(user_ids)
+
+
+def rebuild():
+    """
+    Replaces the index, if this process has built one, with a fresh copy - built while the old
+    one carries on being used
+    """
+    global _index
+    if _index is None:
+        return
+    index = CompatibilityIndex()
+    index.build()
+    with lock:
+        _index = index
+
+
+def reset():
+    """
+    Throws the index away, to be built again on next use - for after instruments are changed in
+    bulk, which doesn't send the signals that keep it up to date
+    """
+    global _index
+    with lock:
+        _index = None
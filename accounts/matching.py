@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import operator
+from itertools import chain
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.contrib.gis.measure import Distance
+from django.contrib.gis.db.models.functions import Distance as get_distance
+from .models import Profile, UserInstrument, Match
+from . import match_index, spatial_index, instrument_index
+from .reach import reaching, METERS_PER_MILE
+from .signals import matches_changed
+
+# Postgres identifies advisory locks by a pair of numbers: this one, for "the matches of a user",
+# and the user's id
+MATCH_LOCK = 1
+
+UPSERT_BATCH_SIZE = 1000
+# A user pair which gains a pair of instruments (its new instrument_pairs are not all contained
+# in its old ones) becomes unknown and new again, as a brand new match would be
+UPSERT_SQL = """
+    INSERT INTO accounts_match (requesting_user_id, found_user_id, instrument_pairs, distance,
+                                generation, known, mark_new)
+    VALUES {rows}
+    ON CONFLICT (requesting_user_id, found_user_id) DO UPDATE
+    SET instrument_pairs = EXCLUDED.instrument_pairs,
+        distance = EXCLUDED.distance,
+        generation = GREATEST(accounts_match.generation, EXCLUDED.generation),
+        known = accounts_match.known
+                AND EXCLUDED.instrument_pairs <@ accounts_match.instrument_pairs,
+        mark_new = accounts_match.mark_new
+                   OR NOT EXCLUDED.instrument_pairs <@ accounts_match.instrument_pairs
+    RETURNING requesting_user_id, NOT known
+"""
+DELETE_SQL = "DELETE FROM accounts_match WHERE id IN ({matches}) RETURNING requesting_user_id"
+
+
+def _paired(rows):
+    """
+    The queries below join the candidate UserInstrument to the "wanting" UserInstrument twice -
+    once through desired_instruments and once through accepted_standards. The database can only
+    give us each of these joins separately, so each row ends in two UserInstrument ids, and the
+    row describes a genuine match only when they are the same instrument.
+    This generator keeps just those rows, dropping the duplicated id.
+    """
+    for row in rows:
+        if row[-2] == row[-1]:
+            yield row[:-1]
+
+
+def _with_distances(matches, distances, other):
+    """
+    Turns a set of matches found by the compatibility index into the dictionary form returned
+    below, using a mapping of user id -> distance for the other user in each match (found at
+    index "other" of the tuple)
+    """
+    return dict((match, distances[match[other]]) for match in matches)
+
+
+def _nearby(profile):
+    """
+    Returns a dictionary of user id -> distance (in miles) for every user within the given
+    profile's max_distance - from the in-memory spatial index if settings.SPATIAL_INDEX is on,
+    and otherwise from the database
+    """
+    if settings.SPATIAL_INDEX:
+        with spatial_index.lock:
+            return spatial_index.get_index().within(profile.location,
+                                                    profile.max_distance.distance)
+    within_range = (profile.location, Distance(mi=profile.max_distance.distance))
+    return dict(Profile.objects.filter(location__distance_lte=within_range)
+                .annotate(distance=get_distance("location", profile.location)/METERS_PER_MILE)
+                .values_list("user", "distance"))
+
+
+def _reaching(profile):
+    """
+    The same, for every user whose own max_distance covers the given profile's location
+    """
+    if settings.SPATIAL_INDEX:
+        with spatial_index.lock:
+            return spatial_index.get_index().reaching(profile.location)
+    return dict(reaching(profile.location)
+                .annotate(distance=get_distance("location", profile.location)/METERS_PER_MILE)
+                .filter(distance__lte=F("max_distance__distance"))
+                .values_list("user", "distance"))
+
+
+def wanted_matches(user):
+    """
+    Returns the matches the given user should have when they are the one looking. This is a
+    dictionary whose keys are
+    (requesting_user_id, found_user_id, requesting_instrument_id, found_instrument_id) tuples,
+    and whose values are the distance (in miles) between the two users.
+    A single query does the work: every UserInstrument belonging to a user within this user's
+    max_distance, which plays an instrument this user wants at a standard they accept. With
+    either of the in-memory indexes turned on, the users in range are found first, and the
+    instruments are checked against those. With settings.INSTRUMENT_INDEX on it is the other way
+    round: the compatible players are found from the inverted index, wherever they are, and only
+    those among the users in range are kept.
+    """
+    profile = user.profile
+    if settings.INSTRUMENT_INDEX:
+        with instrument_index.lock:
+            candidates = instrument_index.get_index().wanted_candidates(user.pk)
+        nearby = _nearby(profile) if candidates else {}
+        return dict(((user.pk, their_user, my_instr, their_instr), nearby[their_user])
+                    for my_instr, their_user, their_instr in candidates if their_user in nearby)
+
+    if settings.MATCH_INDEX or settings.SPATIAL_INDEX:
+        nearby = _nearby(profile)
+        if settings.MATCH_INDEX:
+            with match_index.lock:
+                matches = match_index.get_index().wanted_matches(user.pk, nearby)
+            return _with_distances(matches, nearby, 1)
+        candidates = UserInstrument.objects.filter(user__in=list(nearby),
+                                                   instrument__user_wanting__user=user,
+                                                   standard__user_wanting__user=user) \
+                                           .exclude(user=user)
+        rows = candidates.values_list("pk", "user", "instrument__user_wanting",
+                                      "standard__user_wanting")
+        return dict(((user.pk, their_user, my_instr, their_instr), nearby[their_user])
+                    for their_instr, their_user, my_instr in _paired(rows))
+
+    # manual conversion from meters to miles, as get_distance does not return a Distance object
+    distance = get_distance("user__profile__location", profile.location)/METERS_PER_MILE
+    within_range = (profile.location, Distance(mi=profile.max_distance.distance))
+    candidates = UserInstrument.objects.filter(user__profile__location__distance_lte=within_range,
+                                               instrument__user_wanting__user=user,
+                                               standard__user_wanting__user=user) \
+                                       .exclude(user=user).annotate(distance=distance)
+    rows = candidates.values_list("pk", "user", "distance", "instrument__user_wanting",
+                                  "standard__user_wanting")
+    return dict(((user.pk, their_user, my_instr, their_instr), dist)
+                for their_instr, their_user, dist, my_instr in _paired(rows))
+
+
+def wanted_by_others(user):
+    """
+    The reverse of the above: the matches in which the given user is the one found.
+    Each other user's own max_distance is used here, so rather than a single radius around this
+    user's location, the candidates are the users whose reach covers it - found through the
+    spatial index on Profile.reach (or the in-memory one, with settings.SPATIAL_INDEX on). The
+    exact distance is then only computed for those, and compared against the joined Distance value.
+    The instrument index reverses this in the same way as above.
+    """
+    profile = user.profile
+    if settings.INSTRUMENT_INDEX:
+        with instrument_index.lock:
+            candidates = instrument_index.get_index().wanting_candidates(user.pk)
+        nearby = _reaching(profile) if candidates else {}
+        return dict(((their_user, user.pk, their_instr, my_instr), nearby[their_user])
+                    for their_instr, their_user, my_instr in candidates if their_user in nearby)
+
+    if settings.MATCH_INDEX or settings.SPATIAL_INDEX:
+        nearby = _reaching(profile)
+        if settings.MATCH_INDEX:
+            with match_index.lock:
+                matches = match_index.get_index().wanted_by_others(user.pk, nearby)
+            return _with_distances(matches, nearby, 0)
+        candidates = UserInstrument.objects.filter(user__in=list(nearby),
+                                                   desired_instruments__user_plays__user=user,
+                                                   accepted_standards__user_plays__user=user) \
+                                           .exclude(user=user)
+        rows = candidates.values_list("pk", "user", "desired_instruments__user_plays",
+                                      "accepted_standards__user_plays")
+        return dict(((their_user, user.pk, their_instr, my_instr), nearby[their_user])
+                    for their_instr, their_user, my_instr in _paired(rows))
+
+    distance = get_distance("user__profile__location", profile.location)/METERS_PER_MILE
+    candidates = UserInstrument.objects.filter(user__profile__reach__intersects=profile.location) \
+        .annotate(distance=distance) \
+        .filter(distance__lte=F("user__profile__max_distance__distance"),
+                desired_instruments__user_plays__user=user,
+                accepted_standards__user_plays__user=user) \
+        .exclude(user=user)
+    rows = candidates.values_list("pk", "user", "distance", "desired_instruments__user_plays",
+                                  "accepted_standards__user_plays")
+    return dict(((their_user, user.pk, their_instr, my_instr), dist)
+                for their_instr, their_user, dist, my_instr in _paired(rows))
+
+
+def lock_matches(user_ids):
+    """
+    Takes the advisory locks on the matches of the given users until the end of the current
+    transaction, waiting for any other process recalculating them to finish first. The locks are
+    taken in order, so that two processes can never each be waiting for a lock the other holds.
+    """
+    with connection.cursor() as cursor:
+        for user_id in sorted(user_ids):
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [MATCH_LOCK, user_id])
+
+
+def pack_matches(wanted):
+    """
+    Collapses matches in the form returned by the functions above into the form they are stored
+    in: a dictionary of (requesting_user_id, found_user_id) -> (instrument_pairs, distance), where
+    instrument_pairs is a sorted list of the pairs of Instruments matched, packed as described on
+    the Match model. The Instrument each UserInstrument plays is looked up in a single query.
+    """
+    user_instruments = set(chain.from_iterable(key[2:] for key in wanted))
+    instruments = dict(UserInstrument.objects.filter(pk__in=list(user_instruments))
+                                             .values_list("pk", "instrument"))
+    packed = {}
+    for (requesting_user, found_user, requesting, found), distance in wanted.items():
+        # (an instrument deleted since the matches were found is no longer matched)
+        if requesting in instruments and found in instruments:
+            pairs, _ = packed.setdefault((requesting_user, found_user), (set(), distance))
+            pairs.add(Match.pack_pair(instruments[requesting], instruments[found]))
+    return dict((users, (sorted(pairs), distance)) for users, (pairs, distance) in packed.items())
+
+
+def apply_matches(existing, wanted):
+    """
+    Replaces the Match rows in the "existing" queryset with the "wanted" dictionary (in the form
+    returned by pack_matches), as a new generation of matches. Every wanted match is upserted
+    with the new generation number - so those which already exist keep their "known" and
+    "mark_new" status, unless they have gained a pair of instruments, and just have their
+    instrument pairs and distance corrected - and then whatever is left in "existing" from
+    earlier generations is deleted. This is run inside a transaction (see below), so other
+    requests see the whole of the old generation until the new one replaces it.
+    The existing rows are locked first, and the wanted ones upserted, in order of requesting and
+    then found user - the same order in every process, so that two recalculations touching the
+    same rows (two users who match each other both saving their profiles, say) wait for one
+    another rather than deadlocking.
+    Returns the ids of the requesting users whose count of unknown matches may have changed.
+    """
+    changed = set()
+    # (only the locks are wanted, not the rows)
+    list(existing.select_for_update().order_by("requesting_user", "found_user").values_list("pk"))
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval('accounts_match_generation')")
+        generation = cursor.fetchone()[0]
+        rows = [users + (pairs, distance, generation)
+                for users, (pairs, distance) in sorted(wanted.items())]
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[start:start + UPSERT_BATCH_SIZE]
+            values = ", ".join(["(%s, %s, %s::integer[], %s, %s, FALSE, TRUE)"] * len(batch))
+            cursor.execute(UPSERT_SQL.format(rows=values),
+                           [value for row in batch for value in row])
+            changed.update(user_id for user_id, unknown in cursor.fetchall() if unknown)
+
+        stale, params = existing.filter(generation__lt=generation).values("pk").query \
+                                .sql_with_params()
+        cursor.execute(DELETE_SQL.format(matches=stale), params)
+        changed.update(user_id for user_id, in cursor.fetchall())
+    return changed
+
+
+def recompute_matches(user, looking=True, found=True):
+    """
+    Recalculates all matches for the given user, in a handful of queries whatever the number of
+    other users nearby. "looking" covers the matches where the user is the requesting user, and
+    "found" those where they are the user found by someone else.
+    Both are swapped in together as one generation, within one transaction holding the lock on
+    the user's matches, so that two recalculations for the same user (a profile saved twice in
+    quick succession, say) happen one after the other rather than interleaved.
+    """
+    if not (looking or found):
+        return
+    existing = []
+    wanted = {}
+    with transaction.atomic():
+        lock_matches([user.pk])
+        if looking:
+            existing.append(Q(requesting_user=user))
+            wanted.update(wanted_matches(user))
+        if found:
+            existing.append(Q(found_user=user))
+            wanted.update(wanted_by_others(user))
+        changed = apply_matches(Match.objects.filter(reduce(operator.or_, existing)),
+                                pack_matches(wanted))
+    if changed:
+        matches_changed.send(sender=Match, user_ids=changed)
+
+
+def rebuild_matches(user_ids):
+    """
+    Recalculates all the matches in which the given users are the ones looking, as a single new
+    generation of their matches. Since every match has a requesting user, running this over all
+    users rebuilds the whole Match table - see the rebuild_matches management command.
+    The users' locks aren't taken here, as there can be thousands of them and Postgres only has
+    room for so many locks at once - the unique constraint still keeps any concurrent
+    recalculation from duplicating matches.
+    Returns the number of matches - pairs of users - the users now have.
+    """
+    with transaction.atomic():
+        wanted = {}
+        for user in User.objects.filter(pk__in=user_ids, profile__isnull=False) \
+                                .select_related("profile__max_distance"):
+            wanted.update(wanted_matches(user))
+        wanted = pack_matches(wanted)
+        changed = apply_matches(Match.objects.filter(requesting_user__in=user_ids), wanted)
+    if changed:
+        matches_changed.send(sender=Match, user_ids=changed)
+    return len(wanted)
+
+
+def update_matches(user, new_location=False, new_maxdist=False, new_instruments=False):
+    """
+    This function is called when a user updates their profile, in order to recalculate
+    all matches which they are involved in.
+    The optional keyword arguments are all booleans which are used to keep track of what
+    information the user has changed, in order to keep database manipulation to a minimum.
+    The actual work is done by the set-based functions above.
+    """
+    # a change to any of these can give the user new matches and/or lose them old ones.
+    # The matches the user has with others do not depend on their own max_distance though,
+    # so that is only recalculated if the location or instruments have changed.
+    recompute_matches(user, looking=new_location or new_maxdist or new_instruments,
+                      found=new_location or new_instruments)
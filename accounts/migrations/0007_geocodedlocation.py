@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_profile_description'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodedLocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precision', models.SmallIntegerField()),
+                ('latitude', models.IntegerField()),
+                ('longitude', models.IntegerField()),
+                ('address', models.CharField(blank=True, max_length=200, null=True)),
+                ('updated', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='geocodedlocation',
+            unique_together=set([('precision', 'latitude', 'longitude')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.contrib.gis.db.models.functions import Distance
+
+METERS_PER_MILE = 1609.344
+
+
+def fill_distances(apps, schema_editor):
+    """
+    Store the distance for existing matches, with one update per pair of users
+    """
+    Match = apps.get_model("accounts", "Match")
+    Profile = apps.get_model("accounts", "Profile")
+    pairs = Match.objects.values_list("requesting_user", "found_user").distinct()
+    for requesting_user, found_user in pairs:
+        location = Profile.objects.get(user=requesting_user).location
+        dist = Profile.objects.filter(user=found_user) \
+                              .annotate(distance=Distance("location", location)/METERS_PER_MILE) \
+                              .values_list("distance", flat=True)[0]
+        Match.objects.filter(requesting_user=requesting_user, found_user=found_user) \
+                     .update(distance=dist)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_geocodedlocation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='distance',
+            field=models.FloatField(null=True),
+        ),
+        migrations.RunPython(fill_distances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_matchjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RebuiltTile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.FloatField()),
+                ('latitude', models.IntegerField()),
+                ('longitude', models.IntegerField()),
+                ('completed', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='rebuilttile',
+            unique_together=set([('size', 'latitude', 'longitude')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+# username__istartswith becomes UPPER("username"::text) LIKE UPPER('abc%'), which can only use an
+# index on that same expression - and text_pattern_ops makes it usable for LIKE whatever the
+# database's collation is
+USERNAME_INDEX = """
+    CREATE INDEX accounts_auth_user_username_upper
+    ON auth_user (UPPER(username::text) text_pattern_ops)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0011_rebuilttile'),
+    ]
+
+    operations = [
+        migrations.RunSQL(USERNAME_INDEX, "DROP INDEX accounts_auth_user_username_upper"),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+# the same calculation as accounts.reach.update_reaches, for every existing profile
+FILL_REACHES = """
+    UPDATE accounts_profile
+    SET reach = ST_Buffer(accounts_profile.location::geography,
+                          accounts_distance.distance * 1609.344 * 1.01)::geometry
+    FROM accounts_distance
+    WHERE accounts_distance.id = accounts_profile.max_distance_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_username_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='reach',
+            field=django.contrib.gis.db.models.fields.PolygonField(editable=False, null=True, srid=4326),
+        ),
+        migrations.RunSQL(FILL_REACHES, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# matches saved twice by overlapping recalculations - only the oldest of each is kept, as that has
+# the status the user has seen
+DELETE_DUPLICATES = """
+    DELETE FROM accounts_match duplicate
+    USING accounts_match original
+    WHERE duplicate.requesting_instrument_id = original.requesting_instrument_id
+    AND duplicate.found_instrument_id = original.found_instrument_id
+    AND duplicate.id > original.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_profile_reach'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATES, migrations.RunSQL.noop),
+        migrations.AddField(
+            model_name='match',
+            name='generation',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterUniqueTogether(
+            name='match',
+            unique_together=set([('requesting_instrument', 'found_instrument')]),
+        ),
+        migrations.RunSQL("CREATE SEQUENCE accounts_match_generation START 1",
+                          "DROP SEQUENCE accounts_match_generation"),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+# the matches of each pair of users are collapsed onto the oldest of them, with the pairs of
+# instruments packed as in Match.pack_pair (whose PAIR_BASE of 2**15 is written out here, as the
+# rows were packed at this point in time). The pair is only known if all its matches were, and new
+# if any of them was.
+COLLAPSE_MATCHES = """
+    UPDATE accounts_match kept
+    SET instrument_pairs = collapsed.instrument_pairs, known = collapsed.known,
+        mark_new = collapsed.mark_new, generation = collapsed.generation
+    FROM (
+        SELECT MIN(m.id) AS id,
+               array_agg(DISTINCT requesting.instrument_id * 32768 + found.instrument_id)
+                   AS instrument_pairs,
+               bool_and(m.known) AS known, bool_or(m.mark_new) AS mark_new,
+               MAX(m.generation) AS generation
+        FROM accounts_match m
+        JOIN accounts_userinstrument requesting ON requesting.id = m.requesting_instrument_id
+        JOIN accounts_userinstrument found ON found.id = m.found_instrument_id
+        GROUP BY m.requesting_user_id, m.found_user_id
+    ) collapsed
+    WHERE kept.id = collapsed.id
+"""
+DELETE_COLLAPSED = "DELETE FROM accounts_match WHERE cardinality(instrument_pairs) = 0"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_match_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='instrument_pairs',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None),
+        ),
+        # (there is no going back from here, as the UserInstruments matched aren't kept)
+        migrations.RunSQL(COLLAPSE_MATCHES),
+        migrations.RunSQL(DELETE_COLLAPSED),
+        migrations.AlterUniqueTogether(
+            name='match',
+            unique_together=set([('requesting_user', 'found_user')]),
+        ),
+        migrations.RemoveField(
+            model_name='match',
+            name='found_instrument',
+        ),
+        migrations.RemoveField(
+            model_name='match',
+            name='requesting_instrument',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_match_instrument_pairs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchjob',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+# Replaces the index from migration 0012. A text_pattern_ops index answers LIKE 'ABC%', but can
+# only return the rows in order for ORDER BY ... USING ~<~, which Django can't write - so every
+# username with the prefix had to be fetched and sorted. An index in the "C" collation answers
+# the LIKE just as well (Postgres allows that whatever the database's collation), and returns the
+# rows in order for ORDER BY UPPER(username) COLLATE "C", so a search stops at its LIMIT.
+USERNAME_INDEX = """
+    CREATE INDEX accounts_auth_user_username_upper_c
+    ON auth_user ((UPPER(username::text) COLLATE "C"))
+"""
+PATTERN_INDEX = """
+    CREATE INDEX accounts_auth_user_username_upper
+    ON auth_user (UPPER(username::text) text_pattern_ops)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0017_indexchange'),
+    ]
+
+    operations = [
+        migrations.RunSQL(USERNAME_INDEX, "DROP INDEX accounts_auth_user_username_upper_c"),
+        migrations.RunSQL("DROP INDEX accounts_auth_user_username_upper", PATTERN_INDEX),
+    ]
@@ -2,7 +2,9 @@
 from __future__ import unicode_literals
 
 from django.contrib.gis.db import models
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Create your models here.
 class Distance(models.Model):
@@ -27,12 +29,16 @@ class Profile(models.Model):
     - max_distance: An integer denoting the maximum distance (in miles) from their location
     that a user wishes to go to make contact with another user. Uses one of the values in
     the Distances model.
+    - reach: the area within max_distance of the location, kept up to date by signals (see
+    accounts/reach.py) so that the users who would travel to a given point can be found with
+    the spatial index on it
     We also of course use a OneToOneField to link it to a specific user!
     """
     user = models.OneToOneField(User)
     description = models.CharField(max_length=500, null=True, blank=True)
     location = models.PointField()
     max_distance = models.ForeignKey(Distance)
+    reach = models.PolygonField(null=True, editable=False)
 
     def __unicode__(self):
         return self.user.username
@@ -78,23 +84,145 @@ class UserInstrument(models.Model):
 
 class Match(models.Model):
     """
-    This model is used to keep track of all matches between users
+    This model is used to keep track of all matches between users - one row for each pair of
+    users, however many of their instruments match. Each pair of instruments, that is the
+    Instrument the requesting user plays and the one the found user plays, is packed into a single
+    number in instrument_pairs (see pack_pair below), so that even multi-instrumentalists only
+    take up one small row for each user they match.
     """
     requesting_user = models.ForeignKey(User, related_name="match_looked_for")
     found_user = models.ForeignKey(User, related_name="match_found")
-    requesting_instrument = models.ForeignKey(UserInstrument, related_name="match_looked_for")
-    found_instrument = models.ForeignKey(UserInstrument, related_name="match_found")
+    instrument_pairs = ArrayField(models.IntegerField(), default=list)
+    # the distance in miles between the two users. This is calculated by the database when the
+    # match is created, and updated whenever either user moves (see matching.py)
+    distance = models.FloatField(null=True)
     # 2 boolean fields to control the "status" of a match. "Known" is used to determine whether
     # to inform the user whether there are any new matches, while "mark_new" is used to display
     # the new matches in a more eye-catching way in the matches template.
     # 2 separate fields are needed because, when the matches page is viewed, any "unknown" matches
     # need to be marked as known, but without affecting their display as "new" matches.
+    # A match which gains a pair of instruments becomes unknown and new again.
     known = models.BooleanField(default=False)
     mark_new = models.BooleanField(default=True)
+    # the number of the recalculation which last found this match. Each recalculation upserts the
+    # matches it finds with a new number, then deletes the ones left with an older one.
+    generation = models.BigIntegerField(default=0)
+
+    # Instrument ids must be below this to be packed into instrument_pairs, which then stay within
+    # the integer range. The instruments are set in the Django admin, and are nowhere near this many.
+    PAIR_BASE = 1 << 15
 
     class Meta:
         verbose_name_plural = "matches"
+        unique_together = ("requesting_user", "found_user")
+
+    @classmethod
+    def pack_pair(cls, requesting_instrument_id, found_instrument_id):
+        for instrument_id in (requesting_instrument_id, found_instrument_id):
+            if not 0 <= instrument_id < cls.PAIR_BASE:
+                raise ValueError("Instrument id %d can't be packed into instrument_pairs"
+                                 % instrument_id)
+        return requesting_instrument_id * cls.PAIR_BASE + found_instrument_id
+
+    @classmethod
+    def unpack_pair(cls, pair):
+        """
+        returns the (requesting, found) Instrument ids packed into one of the instrument_pairs
+        """
+        return divmod(pair, cls.PAIR_BASE)
+
+    def __unicode__(self):
+        return "%s for %s" %(self.found_user.username, self.requesting_user.username)
+
+
+class GeocodedLocation(models.Model):
+    """
+    A cache of the address strings obtained by reverse geocoding users' locations, so that pages
+    showing a user's location don't need to wait on the Google Maps API.
+    The coordinates are stored "quantized" - as integers, after multiplying by 10 to the power of
+    the precision - so that nearby points share an entry. "address" is null until the location
+    has been looked up, and "updated" records when that last happened.
+    """
+    precision = models.SmallIntegerField()
+    latitude = models.IntegerField()
+    longitude = models.IntegerField()
+    address = models.CharField(max_length=200, null=True, blank=True)
+    updated = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (("precision", "latitude", "longitude"),)
+
+    def __unicode__(self):
+        return self.address or "Not yet looked up"
+
+
+class NotificationCounts(models.Model):
+    """
+    Holds the numbers shown in the notification bar at the bottom of every page - unread
+    messages, matches the user hasn't seen yet, and group invitations waiting for an answer.
+    These are kept up to date by the signal handlers in signals.py, so that rendering a page
+    only needs to read this one row (see notifications.py).
+    """
+    user = models.OneToOneField(User, related_name="notification_counts")
+    unread_messages = models.IntegerField(default=0)
+    unknown_matches = models.IntegerField(default=0)
+    pending_invites = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "notification counts"
+
+    def __unicode__(self):
+        return self.user.username
+
+
+class MatchJob(models.Model):
+    """
+    A queue of users whose matches need recalculating, after they have saved their profile.
+    There is at most one job waiting for each user: if they save their profile again before it
+    has run, the "new_..." flags (which say what has changed - see matching.py) are combined
+    with those already queued. The jobs are run by the process_match_jobs management command;
+    "claimed" is when a worker took the job, which is only deleted once it has run (see jobs.py).
+    """
+    user = models.OneToOneField(User, related_name="match_job")
+    new_location = models.BooleanField(default=False)
+    new_maxdist = models.BooleanField(default=False)
+    new_instruments = models.BooleanField(default=False)
+    queued = models.DateTimeField(default=timezone.now, db_index=True)
+    claimed = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return self.user.username
+
+
+class RebuiltTile(models.Model):
+    """
+    Records the progress of the rebuild_matches management command, which rebuilds the matches
+    of all users one geographical tile at a time. A tile is a square of "size" degrees, and its
+    position is given by the whole number of tiles from the origin. The rows are deleted when a
+    rebuild finishes, so that an interrupted rebuild can carry on from where it stopped.
+    """
+    size = models.FloatField()
+    latitude = models.IntegerField()
+    longitude = models.IntegerField()
+    completed = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = (("size", "latitude", "longitude"),)
+
+    def __unicode__(self):
+        return "%s, %s" % (self.latitude * self.size, self.longitude * self.size)
+
+
+class IndexChange(models.Model):
+    """
+    A log of the users whose profile or instruments have changed, written by the signal handlers
+    when any of the in-memory indexes are in use (see jobs.IndexRefresher). Each process's own
+    indexes are kept up to date by those handlers directly, so this is how the process_match_jobs
+    worker hears of the changes made by the web processes. "user" is a plain number rather than a
+    foreign key so that the entry outlives a deleted user, who must be taken out of the indexes.
+    """
+    user = models.IntegerField()
+    changed = models.DateTimeField(default=timezone.now, db_index=True)
 
     def __unicode__(self):
-        return "%s-%s for %s-%s" %(self.found_user.username, self.found_instrument.instrument,
-                                   self.requesting_user.username, self.requesting_instrument.instrument)
+        return "%s at %s" % (self.user, self.changed)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from groups.models import Invitation
+from user_messages.models import Message
+from .models import Match, NotificationCounts
+
+# how to count each of the fields of NotificationCounts, for a given user id. There is one Match
+# for each other user, so unknown_matches is the number of players, however many of their
+# instruments match.
+COUNTERS = {
+    "unread_messages": lambda user_id: Message.objects.filter(user_to=user_id, seen=False,
+                                                              receiver_deleted=False).count(),
+    "unknown_matches": lambda user_id: Match.objects.filter(requesting_user=user_id,
+                                                            known=False).count(),
+    "pending_invites": lambda user_id: Invitation.objects.filter(invited_user=user_id).count(),
+}
+
+
+def cache_key(user_id):
+    return "notification_counts:%d" % user_id
+
+
+def refresh(user_id, *fields):
+    """
+    Recounts the given fields (or all of them) for one user, after something has changed.
+    Counting again, rather than adding or subtracting one, means the stored numbers can't drift
+    away from the truth - and each count is a single query on an indexed column.
+    """
+    counts = dict((field, COUNTERS[field](user_id)) for field in fields or COUNTERS)
+    if not NotificationCounts.objects.filter(user=user_id).update(**counts):
+        counts.update((field, counter(user_id)) for field, counter in COUNTERS.items()
+                      if field not in counts)
+        try:
+            with transaction.atomic():
+                NotificationCounts.objects.create(user_id=user_id, **counts)
+        except IntegrityError:
+            # another request has just created it
+            NotificationCounts.objects.filter(user=user_id).update(**counts)
+    cache.delete(cache_key(user_id))
+
+
+def get_counts(user_id):
+    """
+    Returns the NotificationCounts for the given user - from the cache if possible, and otherwise
+    from the database (creating the row the first time it is needed).
+    """
+    counts = cache.get(cache_key(user_id))
+    if counts is None:
+        try:
+            counts = NotificationCounts.objects.get(user=user_id)
+        except NotificationCounts.DoesNotExist:
+            refresh(user_id)
+            counts = NotificationCounts.objects.get(user=user_id)
+        cache.set(cache_key(user_id), counts, settings.NOTIFICATION_CACHE_TIMEOUT)
+    return counts
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import random
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from groups.membership import sync_groups
+from groups.models import Group, Membership, GroupThread, GroupMessage, Invitation
+from user_messages.models import Message
+from .models import Profile, Distance, Instrument, Standard, UserInstrument, Match, \
+                    NotificationCounts, MatchJob
+from .reach import update_reaches
+from . import match_index, spatial_index, instrument_index
+
+# every generated user's username starts with this, so that they can be told apart from real
+# users - and removed again
+PREFIX = "synthetic_"
+PASSWORD = "synthetic"
+
+# relative numbers of players of each instrument, and of users willing to travel each distance
+DEFAULT_INSTRUMENTS = {"piano": 25, "violin": 25, "viola": 8, "cello": 14, "flute": 8,
+                       "oboe": 4, "clarinet": 7, "bassoon": 3, "horn": 3}
+DEFAULT_DISTANCES = {5: 1, 10: 3, 20: 4, 30: 3, 50: 2}
+
+# the towns in the gazetteer are the centres of the clusters of users, with the biggest cities
+# drawing more of them. Most users are scattered closely around their town, and the rest
+# further out into the countryside.
+CITY_WEIGHTS = {"London": 12, "Birmingham": 4, "Manchester": 4, "Leeds": 3, "Bristol": 3,
+                "Liverpool": 2, "Sheffield": 2, "Newcastle upon Tyne": 2, "Nottingham": 2,
+                "Cardiff": 2}
+TOWN_SPREAD = 0.05
+RURAL_SPREAD = 0.3
+RURAL_FRACTION = 0.2
+
+
+def parse_weights(text):
+    """
+    Reads relative weights given on the command line as "name=weight,name=weight"
+    """
+    weights = {}
+    for item in text.split(","):
+        name, weight = item.rsplit("=", 1)
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def weighted_choice(rng, weights):
+    """
+    Picks one key of the dict at random, in proportion to its value
+    """
+    target = rng.uniform(0, sum(weights.values()))
+    for key, weight in sorted(weights.items()):
+        target -= weight
+        if target <= 0:
+            return key
+    return key
+
+
+def weighted_sample(rng, weights, count):
+    weights = dict(weights)
+    chosen = []
+    while weights and len(chosen) < count:
+        chosen.append(weighted_choice(rng, weights))
+        del weights[chosen[-1]]
+    return chosen
+
+
+class PopulationGenerator(object):
+    """
+    Creates synthetic users for load testing and benchmarking, with everything the site shows
+    about them: profiles with clustered locations, instruments with the instruments and
+    standards they look for, groups of nearby users, threads and messages in those groups, and
+    private messages. The instrument, standard and distance weights default to
+    DEFAULT_INSTRUMENTS, equal weights for every standard, and DEFAULT_DISTANCES.
+    Everything is inserted in bulk, so no signals are sent: the matches should be rebuilt
+    afterwards (see the rebuild_matches command), and the addresses looked up with
+    refresh_geocodes. This process's in-memory indexes are thrown away, to be rebuilt when next
+    used.
+    """
+    def __init__(self, seed=None, instruments=None, standards=None, distances=None,
+                 group_size=4, threads_per_group=3, posts_per_thread=5, messages_per_user=2):
+        self.rng = random.Random(seed)
+        self.instruments = dict((Instrument.objects.get_or_create(instrument=name)[0].pk, weight)
+                                for name, weight in (instruments or DEFAULT_INSTRUMENTS).items())
+        if standards:
+            self.standards = dict((Standard.objects.get_or_create(standard=name)[0].pk, weight)
+                                  for name, weight in standards.items())
+        else:
+            self.standards = dict((pk, 1) for pk in Standard.objects.values_list("pk", flat=True))
+        self.distances = dict((Distance.objects.get_or_create(distance=int(miles))[0].pk, weight)
+                              for miles, weight in (distances or DEFAULT_DISTANCES).items())
+        self.group_size = group_size
+        self.threads_per_group = threads_per_group
+        self.posts_per_thread = posts_per_thread
+        self.messages_per_user = messages_per_user
+        if not self.standards:
+            raise ValueError("There are no standards for the users to choose from")
+        self.password = make_password(PASSWORD)
+        self.towns = self._load_towns()
+
+    def _load_towns(self):
+        # each town appears once for each unit of its weight, so that rng.choice favours the
+        # bigger cities
+        towns = []
+        with open(settings.GEOCODER_GAZETTEER, "rb") as gazetteer:
+            for name, region, latitude, longitude in csv.reader(gazetteer):
+                name = name.decode("utf-8")
+                towns += [(name, float(latitude), float(longitude))] * CITY_WEIGHTS.get(name, 1)
+        return towns
+
+    def _location(self):
+        # the longitude is spread further, as a degree of it is only about 0.6 of a degree of
+        # latitude in England and Wales
+        name, latitude, longitude = self.rng.choice(self.towns)
+        spread = RURAL_SPREAD if self.rng.random() < RURAL_FRACTION else TOWN_SPREAD
+        return name, Point(self.rng.gauss(longitude, spread * 1.6),
+                           self.rng.gauss(latitude, spread))
+
+    def generate(self, num_users, batch_size=1000):
+        """
+        Adds num_users more synthetic users, in transactions of batch_size users at a time,
+        and returns their ids
+        """
+        start = User.objects.filter(username__startswith=PREFIX).count()
+        user_ids = []
+        for offset in range(0, num_users, batch_size):
+            with transaction.atomic():
+                user_ids += self._generate_batch(start + offset,
+                                                 min(batch_size, num_users - offset))
+        match_index.reset()
+        spatial_index.reset()
+        instrument_index.reset()
+        return user_ids
+
+    def _generate_batch(self, start, count):
+        now = timezone.now()
+        users = User.objects.bulk_create([
+            User(username="%s%07d" % (PREFIX, start + num),
+                 email="%s%07d@example.com" % (PREFIX, start + num),
+                 password=self.password, date_joined=now)
+            for num in range(count)])
+
+        towns = {}
+        profiles = []
+        for user in users:
+            town, location = self._location()
+            towns.setdefault(town, []).append(user)
+            profiles.append(Profile(user=user, location=location,
+                                    description="A synthetic musician from near %s" % town,
+                                    max_distance_id=weighted_choice(self.rng, self.distances)))
+        Profile.objects.bulk_create(profiles)
+        update_reaches(Profile.objects.filter(user__in=[user.pk for user in users]))
+
+        instruments = self._create_instruments(users)
+        players = dict((user.pk, []) for user in users)
+        for instr in instruments:
+            players[instr.user_id].append(instr)
+        for town_users in towns.values():
+            self._create_groups(town_users, players, now)
+            self._create_messages(town_users, now)
+        return [user.pk for user in users]
+
+    def _create_instruments(self, users):
+        standards = sorted(self.standards)
+        instruments, wanted = [], []
+        for user in users:
+            # most people play one instrument, some two or three
+            for instrument in weighted_sample(self.rng, self.instruments,
+                                              weighted_choice(self.rng, {1: 6, 2: 3, 3: 1})):
+                standard = weighted_choice(self.rng, self.standards)
+                instruments.append(UserInstrument(user=user, instrument_id=instrument,
+                                                  standard_id=standard))
+                others = dict((pk, weight) for pk, weight in self.instruments.items()
+                              if pk != instrument)
+                # players look for others of about their own standard
+                position = standards.index(standard)
+                wanted.append((weighted_sample(self.rng, others, self.rng.randint(1, 4)),
+                               standards[max(position - 1, 0):position + 2]))
+        instruments = UserInstrument.objects.bulk_create(instruments)
+
+        UserInstrument.desired_instruments.through.objects.bulk_create([
+            UserInstrument.desired_instruments.through(userinstrument_id=instr.pk,
+                                                       instrument_id=desired)
+            for instr, (desired_list, accepted) in zip(instruments, wanted)
+            for desired in desired_list])
+        UserInstrument.accepted_standards.through.objects.bulk_create([
+            UserInstrument.accepted_standards.through(userinstrument_id=instr.pk,
+                                                      standard_id=standard)
+            for instr, (desired, accepted) in zip(instruments, wanted)
+            for standard in accepted])
+        return instruments
+
+    def _create_groups(self, town_users, players, now):
+        # about one in five users is put in a group, with others from the same town
+        town_users = list(town_users)
+        self.rng.shuffle(town_users)
+        members = [town_users[num:num + self.group_size]
+                   for num in range(0, len(town_users) - 1, self.group_size * 5)]
+        members = [group for group in members if len(group) > 1]
+        if not members:
+            return
+        groups = Group.objects.bulk_create([
+            Group(name="%sgroup_%s" % (PREFIX, group[0].username[len(PREFIX):]),
+                  description="A synthetic group") for group in members])
+        Group.members.through.objects.bulk_create([
+            Group.members.through(group_id=group.pk,
+                                  userinstrument_id=self.rng.choice(players[user.pk]).pk)
+            for group, group_members in zip(groups, members) for user in group_members])
+        sync_groups([group.pk for group in groups])
+
+        threads, posts = [], []
+        for group, group_members in zip(groups, members):
+            for num in range(self.threads_per_group):
+                dates = sorted(now - timedelta(minutes=self.rng.randint(0, 60 * 24 * 90))
+                               for _ in range(self.posts_per_thread))
+                authors = [self.rng.choice(group_members) for _ in dates]
+                threads.append(GroupThread(group=group, name="Rehearsal %d" % (num + 1),
+                                           started_by=authors[0], last_post=dates[-1],
+                                           last_post_author=authors[-1],
+                                           reply_count=len(dates) - 1))
+                posts.append(list(zip(dates, authors)))
+        threads = GroupThread.objects.bulk_create(threads)
+        GroupMessage.objects.bulk_create([
+            GroupMessage(thread=thread, author=author, posted_date=date,
+                         message="A synthetic post about rehearsals")
+            for thread, thread_posts in zip(threads, posts) for date, author in thread_posts])
+
+    def _create_messages(self, town_users, now):
+        if len(town_users) < 2:
+            return
+        messages = []
+        for user in town_users:
+            for _ in range(self.messages_per_user):
+                other = self.rng.choice(town_users)
+                if other != user:
+                    messages.append(Message(user_from=user, user_to=other,
+                                            title="Hello from a synthetic user",
+                                            message="Shall we play together?",
+                                            sent_date=now - timedelta(
+                                                minutes=self.rng.randint(0, 60 * 24 * 90))))
+        Message.objects.bulk_create(messages)
+
+
+def _delete(queryset):
+    """
+    Deletes the rows a queryset selects with a single DELETE statement - without fetching them,
+    or sending any signals
+    """
+    meta = queryset.model._meta
+    rows, params = queryset.values("pk").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (meta.db_table, meta.pk.column, rows),
+                       params)
+
+
+def clear_population():
+    """
+    Removes all the synthetic users, and everything belonging to them - including anything they
+    have done in real users' groups. The rows are deleted table by table, rather than by deleting
+    the users, which would send signals for every one of the related objects collected on the way.
+    """
+    users = User.objects.filter(username__startswith=PREFIX).values("pk")
+    groups = Group.objects.filter(name__startswith=PREFIX).values("pk")
+    threads = GroupThread.objects.filter(Q(group__in=groups) | Q(started_by__in=users)) \
+                                 .values("pk")
+    instruments = UserInstrument.objects.filter(user__in=users).values("pk")
+    querysets = [
+        Match.objects.filter(Q(requesting_user__in=users) | Q(found_user__in=users)),
+        MatchJob.objects.filter(user__in=users),
+        NotificationCounts.objects.filter(user__in=users),
+        Message.objects.filter(Q(user_from__in=users) | Q(user_to__in=users)),
+        # (a subquery rather than a join, as each DELETE can only refer to one table)
+        GroupMessage.objects.filter(Q(thread__in=threads) | Q(author__in=users)),
+        GroupThread.objects.filter(pk__in=threads),
+        Invitation.objects.filter(Q(group__in=groups) | Q(invited_user__in=users)
+                                  | Q(inviting_user__in=users)),
+        Membership.objects.filter(Q(group__in=groups) | Q(user__in=users)),
+        Group.members.through.objects.filter(Q(group__in=groups)
+                                             | Q(userinstrument__in=instruments)),
+        Group.desired_instruments.through.objects.filter(group__in=groups),
+        Group.objects.filter(pk__in=groups),
+        UserInstrument.desired_instruments.through.objects.filter(userinstrument__in=instruments),
+        UserInstrument.accepted_standards.through.objects.filter(userinstrument__in=instruments),
+        UserInstrument.objects.filter(user__in=users),
+        Profile.objects.filter(user__in=users),
+        User.objects.filter(username__startswith=PREFIX),
+    ]
+    with transaction.atomic():
+        # as the database would do for the ForeignKey's on_delete=SET_NULL
+        GroupThread.objects.filter(last_post_author__in=users).update(last_post_author=None)
+        for queryset in querysets:
+            _delete(queryset)
+    match_index.reset()
+    spatial_index.reset()
+    instrument_index.reset()
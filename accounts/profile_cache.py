@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.cache import cache
+from groups.models import Group
+from .geocoding import cached_address, UNKNOWN_ADDRESS
+from .models import Profile, UserInstrument
+
+# how long to keep a snapshot whose address hasn't been looked up yet - refresh_geocodes fills
+# the address in without the profile itself changing
+UNKNOWN_ADDRESS_TIMEOUT = 60
+
+
+def cache_key(user_id):
+    return "profile_snapshot:%d" % user_id
+
+
+def build_snapshot(user_id):
+    """
+    Gathers everything shown on a user's profile page which doesn't depend on who is viewing it,
+    as a dict of plain values:
+    {"description": "...", "max_distance": 30, "location": "Durham, UK", "coords": (lng, lat),
+     "instruments": [{"pk": 1, "instrument": "violin", "standard": "good",
+                      "desired_instruments": ["cello"], "accepted_standards": ["good"]}],
+     "groups": [{"pk": 1, "name": "Quartet"}]}
+    Raises Profile.DoesNotExist if the user hasn't filled in their profile yet.
+    """
+    profile = Profile.objects.select_related("max_distance").get(user=user_id)
+    instruments = UserInstrument.objects.filter(user=user_id) \
+                                        .select_related("instrument", "standard") \
+                                        .prefetch_related("desired_instruments",
+                                                          "accepted_standards")
+    return {
+        "description": profile.description,
+        "max_distance": profile.max_distance.distance,
+        "location": cached_address(profile.location),
+        "coords": profile.location.coords,
+        "instruments": [{"pk": instr.instrument_id, "instrument": instr.instrument.instrument,
+                         "standard": instr.standard.standard,
+                         "desired_instruments": [desired.instrument for desired
+                                                 in instr.desired_instruments.all()],
+                         "accepted_standards": [standard.standard for standard
+                                                in instr.accepted_standards.all()]}
+                        for instr in instruments],
+        "groups": list(Group.objects.filter(membership__user=user_id).order_by("name")
+                                    .values("pk", "name")),
+    }
+
+
+def get_snapshot(user_id):
+    """
+    Returns the profile snapshot for the given user, from the cache if possible. Snapshots are
+    thrown away by the signal handlers whenever the profile, instruments or groups change.
+    """
+    snapshot = cache.get(cache_key(user_id))
+    if snapshot is None:
+        snapshot = build_snapshot(user_id)
+        timeout = settings.PROFILE_CACHE_TIMEOUT
+        if snapshot["location"] == UNKNOWN_ADDRESS:
+            timeout = min(timeout, UNKNOWN_ADDRESS_TIMEOUT)
+        cache.set(cache_key(user_id), snapshot, timeout)
+    return snapshot
+
+
+def forget(user_ids):
+    cache.delete_many([cache_key(user_id) for user_id in user_ids])
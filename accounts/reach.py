@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import connection
+from .models import Profile
+
+METERS_PER_MILE = 1609.344
+# the buffer around a point is a polygon drawn inside the true circle, so it is made this much
+# larger to be sure of covering everything within the distance. The exact distance is still checked
+# for the profiles found inside it (see accounts.matching.wanted_by_others).
+REACH_MARGIN = 1.01
+
+REACH_SQL = """
+    UPDATE accounts_profile
+    SET reach = ST_Buffer(accounts_profile.location::geography,
+                          accounts_distance.distance * %s)::geometry
+    FROM accounts_distance
+    WHERE accounts_distance.id = accounts_profile.max_distance_id
+    AND accounts_profile.id IN ({profiles})
+"""
+
+
+def update_reaches(profiles):
+    """
+    Recalculates the "reach" of each profile in the given queryset - the area covered by its
+    max_distance around its location - in a single UPDATE. This has to be done whenever either
+    of those changes, including when the distance of one of the Distance choices is edited.
+    """
+    subquery, params = profiles.values("pk").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(REACH_SQL.format(profiles=subquery),
+                       [METERS_PER_MILE * REACH_MARGIN] + list(params))
+
+
+def reaching(point):
+    """
+    The profiles whose reach covers the given point - found through the spatial index on the
+    reach, rather than by working out the distance from every profile in the database
+    """
+    return Profile.objects.filter(reach__intersects=point)
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver, Signal
+from groups.models import Invitation
+from user_messages.models import Message
+from .models import Profile, Distance, UserInstrument, Match, IndexChange
+from . import match_index, spatial_index, instrument_index, geocoding, notifications, \
+              profile_cache, reach
+
+# sent whenever matches are created, deleted or updated in bulk (which doesn't send the model
+# signals), with the ids of the requesting users whose matches have changed
+matches_changed = Signal(providing_args=["user_ids"])
+
+
+def _log_index_change(user_id):
+    """
+    Tells the in-memory indexes of other processes (the process_match_jobs worker's) that the
+    user has changed - see jobs.IndexRefresher
+    """
+    if settings.MATCH_INDEX or settings.SPATIAL_INDEX or settings.INSTRUMENT_INDEX:
+        IndexChange.objects.create(user=user_id)
+
+
+@receiver(post_save, sender=UserInstrument)
+@receiver(post_delete, sender=UserInstrument)
+def user_instrument_changed(sender, instance, **kwargs):
+    """
+    Keeps the in-memory compatibility and instrument indexes and the user's cached profile in
+    step with any change to their instruments
+    """
+    match_index.refresh_user(instance.user_id)
+    instrument_index.refresh_user(instance.user_id)
+    _log_index_change(instance.user_id)
+    profile_cache.forget([instance.user_id])
+
+
+@receiver(m2m_changed, sender=UserInstrument.desired_instruments.through)
+@receiver(m2m_changed, sender=UserInstrument.accepted_standards.through)
+def user_instrument_choices_changed(sender, instance, action, reverse, **kwargs):
+    """
+    The same, for changes to the instruments and standards a user is looking for
+    """
+    if action.startswith("post_") and not reverse:
+        match_index.refresh_user(instance.user_id)
+        instrument_index.refresh_user(instance.user_id)
+        _log_index_change(instance.user_id)
+        profile_cache.forget([instance.user_id])
+
+
+@receiver(post_save, sender=Profile)
+def profile_saved(sender, instance, **kwargs):
+    """
+    Makes sure a newly saved location is queued to have its address looked up, and that the
+    profile's reach (and its place in the in-memory spatial index) covers its new
+    location and distance
+    """
+    geocoding.cache_location(instance.location)
+    profile_cache.forget([instance.user_id])
+    reach.update_reaches(Profile.objects.filter(pk=instance.pk))
+    spatial_index.refresh_profile(instance)
+    _log_index_change(instance.user_id)
+
+
+@receiver(post_delete, sender=Profile)
+def profile_deleted(sender, instance, **kwargs):
+    spatial_index.remove_user(instance.user_id)
+    _log_index_change(instance.user_id)
+
+
+@receiver(post_save, sender=Distance)
+def distance_saved(sender, instance, created, **kwargs):
+    """
+    Editing one of the distance choices changes the reach of everyone who chose it, and the
+    distance shown on their profiles
+    """
+    if not created:
+        profiles = Profile.objects.filter(max_distance=instance)
+        reach.update_reaches(profiles)
+        profile_cache.forget(profiles.values_list("user", flat=True))
+    spatial_index.refresh_distance(instance)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_changed(sender, instance, **kwargs):
+    notifications.refresh(instance.user_to_id, "unread_messages")
+
+
+@receiver(post_save, sender=Invitation)
+@receiver(post_delete, sender=Invitation)
+def invitation_changed(sender, instance, **kwargs):
+    notifications.refresh(instance.invited_user_id, "pending_invites")
+
+
+@receiver(post_save, sender=Match)
+def match_saved(sender, instance, **kwargs):
+    notifications.refresh(instance.requesting_user_id, "unknown_matches")
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    """
+    Matches are otherwise only deleted in bulk by apply_matches, which sends matches_changed. But
+    deleting a user deletes the matches others have with them too, so those users are noted here
+    - to have their counts refreshed once each afterwards, rather than once for every match.
+    """
+    instance._matched_by = set(Match.objects.filter(found_user=instance)
+                                            .values_list("requesting_user", flat=True))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    user_ids = getattr(instance, "_matched_by", set()) - set([instance.pk])
+    if user_ids:
+        matches_changed.send(sender=Match, user_ids=user_ids)
+
+
+@receiver(matches_changed)
+def matches_changed_in_bulk(sender, user_ids, **kwargs):
+    for user_id in user_ids:
+        notifications.refresh(user_id, "unknown_matches")
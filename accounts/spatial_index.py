@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import math
+import threading
+import numpy as np
+from .models import Profile, Distance
+
+# the radius of the sphere PostGIS measures distances on (6370986m), so that the distances found
+# here agree with the database's
+EARTH_RADIUS_MILES = 3958.76
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * math.pi / 180
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """
+    The great-circle distances, in miles, from one point to each of an array of points - all
+    given in radians
+    """
+    a = np.sin((latitudes - latitude) / 2)**2 \
+        + math.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2)**2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+class SpatialIndex(object):
+    """
+    An in-memory copy of every profile's location and max_distance, for finding the users near a
+    point without going to the database. The profiles are divided into a grid of GRID_SIZE-degree
+    cells, and each search only measures the distance to the profiles in the cells which could
+    be in range - all of a cell's at once, from NumPy arrays built the first time it is searched
+    after a change.
+    The grid does not wrap around at 180 degrees of longitude, which is nowhere near any users.
+    """
+    GRID_SIZE = 0.5
+
+    def __init__(self):
+        self.profiles = {}   # user id -> (latitude, longitude, distance id)
+        self.distances = {}  # distance id -> miles
+        self.members = {}    # cell -> set of user ids
+        self.arrays = {}     # cell -> (users, latitudes, longitudes, max distances) arrays
+
+    def _cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.GRID_SIZE)),
+                int(math.floor(longitude / self.GRID_SIZE)))
+
+    def _add(self, user_id, location, distance_id):
+        longitude, latitude = location.coords
+        self.profiles[user_id] = (latitude, longitude, distance_id)
+        cell = self._cell(latitude, longitude)
+        self.members.setdefault(cell, set()).add(user_id)
+        self.arrays.pop(cell, None)
+
+    def build(self):
+        """
+        (Re)loads the whole index from the database
+        """
+        self.profiles, self.members, self.arrays = {}, {}, {}
+        self.distances = dict(Distance.objects.values_list("pk", "distance"))
+        self._load(Profile.objects.all())
+
+    def _load(self, profiles):
+        for user_id, location, distance_id in profiles.values_list("user", "location",
+                                                                   "max_distance"):
+            self._add(user_id, location, distance_id)
+
+    def update_users(self, user_ids):
+        """
+        Reloads the given users' profiles, and the Distance choices, from the database - for
+        picking up changes saved by other processes. Users who no longer have a profile are
+        taken out.
+        """
+        distances = dict(Distance.objects.values_list("pk", "distance"))
+        if distances != self.distances:
+            self.distances = distances
+            self.arrays.clear()
+        for user_id in user_ids:
+            self.remove_user(user_id)
+        self._load(Profile.objects.filter(user__in=list(user_ids)))
+
+    def update_profile(self, profile):
+        """
+        Moves a user to their profile's current location and max_distance, for use whenever
+        their profile is saved
+        """
+        self.remove_user(profile.user_id)
+        if profile.max_distance_id not in self.distances:
+            self.distances[profile.max_distance_id] = profile.max_distance.distance
+        self._add(profile.user_id, profile.location, profile.max_distance_id)
+
+    def remove_user(self, user_id):
+        if user_id in self.profiles:
+            latitude, longitude, distance_id = self.profiles.pop(user_id)
+            cell = self._cell(latitude, longitude)
+            self.members[cell].discard(user_id)
+            self.arrays.pop(cell, None)
+
+    def update_distance(self, distance_id, miles):
+        """
+        Changes the number of miles one of the Distance choices stands for
+        """
+        self.distances[distance_id] = miles
+        self.arrays.clear()
+
+    def _cell_arrays(self, cell):
+        if cell not in self.arrays:
+            users = sorted(self.members.get(cell, ()))
+            rows = [self.profiles[user_id] for user_id in users]
+            self.arrays[cell] = (np.array(users, dtype=np.int64),
+                                 np.radians([row[0] for row in rows]),
+                                 np.radians([row[1] for row in rows]),
+                                 np.array([self.distances[row[2]] for row in rows], dtype=float))
+        return self.arrays[cell]
+
+    def _search(self, location, miles):
+        """
+        Yields the arrays of each cell which could hold a point within the given distance of the
+        location, along with the distances from the location to each of that cell's points
+        """
+        longitude, latitude = location.coords
+        latitude_span = miles / MILES_PER_DEGREE
+        # a degree of longitude is shortest on the side of the search area nearest the pole
+        nearest_pole = min(abs(latitude) + latitude_span, 89.0)
+        longitude_span = latitude_span / math.cos(math.radians(nearest_pole))
+        bottom_left = self._cell(latitude - latitude_span, longitude - longitude_span)
+        top_right = self._cell(latitude + latitude_span, longitude + longitude_span)
+        for i in range(bottom_left[0], top_right[0] + 1):
+            for j in range(bottom_left[1], top_right[1] + 1):
+                if not self.members.get((i, j)):
+                    continue
+                arrays = self._cell_arrays((i, j))
+                yield arrays, haversine(math.radians(latitude), math.radians(longitude),
+                                        arrays[1], arrays[2])
+
+    def within(self, location, miles):
+        """
+        Returns a dictionary of user id -> distance (in miles) for every user within the given
+        distance of the location - the users someone there would travel to
+        """
+        found = {}
+        for (users, _, _, _), distances in self._search(location, miles):
+            selection = distances <= miles
+            found.update(zip(users[selection].tolist(), distances[selection].tolist()))
+        return found
+
+    def reaching(self, location):
+        """
+        The reverse of the above: the users whose own max_distance covers the location - the
+        users who would travel there - in the same form
+        """
+        if not self.distances:
+            return {}
+        found = {}
+        for (users, _, _, max_distances), distances in self._search(location,
+                                                                    max(self.distances.values())):
+            selection = distances <= max_distances
+            found.update(zip(users[selection].tolist(), distances[selection].tolist()))
+        return found
+
+
+_index = None
+# the index is shared by all the threads of a process (such as process_match_jobs --concurrency),
+# and must not be searched while it's being changed - so this is held while using it
+lock = threading.RLock()
+
+def get_index():
+    """
+    Returns the index for this process, building it on first use
+    """
+    global _index
+    with lock:
+        if _index is None:
+            _index = SpatialIndex()
+            _index.build()
+        return _index
+
+
+def refresh_profile(profile):
+    """
+    Keeps the index up to date after a profile is saved. As with the compatibility index, nothing
+    needs doing if this process has not built the index yet.
+    """
+    with lock:
+        if _index is not None:
+            _index.update_profile(profile)
+
+
+def refresh_users(user_ids):
+    with lock:
+        if _index is not None:
+            _index.update_users(user_ids)
+
+
+def remove_user(user_id):
+    with lock:
+        if _index is not None:
+            _index.remove_user(user_id)
+
+
+def refresh_distance(distance):
+    with lock:
+        if _index is not None:
+            _index.update_distance(distance.pk, distance.distance)
+
+
+def rebuild():
+    """
+    Replaces the index, if this process has built one, with a fresh copy - which is built while
+    the old one carries on being used, and swapped in once it's ready
+    """
+    global _index
+    if _index is None:
+        return
+    index = SpatialIndex()
+    index.build()
+    with lock:
+        _index = index
+
+
+def reset():
+    """
+    Throws the index away, to be built again on next use - for after profiles are changed in
+    bulk, which doesn't send the signals that keep it up to date
+    """
+    global _index
+    with lock:
+        _index = None
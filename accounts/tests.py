@@ -1,13 +1,38 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from StringIO import StringIO
+from datetime import timedelta
+from django.core.cache import cache
 from django.test import TestCase
+from django.db import IntegrityError, transaction
 from django.contrib.auth.models import User
 from django.contrib.gis.geos import Point
 from django.forms import modelformset_factory
-from models import Profile, Distance, Instrument, Standard, UserInstrument, Match
+from django.utils import timezone
+from models import Profile, Distance, Instrument, Standard, UserInstrument, Match, GeocodedLocation, \
+                   MatchJob, IndexChange
 from forms import UserInstrumentForm
-from views import update_matches
+from views import update_matches, summarise_matches
+from matching import wanted_matches, wanted_by_others, rebuild_matches
+from match_index import CompatibilityIndex
+import match_index
+from spatial_index import SpatialIndex
+import spatial_index
+from instrument_index import InstrumentIndex
+import instrument_index
+from geocoding import cached_address, quantize, stale_entries
+from geocoders import OfflineGeocoder
+from notifications import get_counts
+from profile_cache import get_snapshot
+from population import PopulationGenerator, clear_population
+from reach import reaching
+import usernames
+from jobs import enqueue_matches, claim_jobs, run_job
+from management.commands.process_match_jobs import Command as ProcessMatchJobs
+from chamber_mates.query_budget import QueryBudgetMixin
+from groups.models import Group, Membership, GroupThread, GroupMessage
+from user_messages.models import Message
 
 
 # Create your tests here.
@@ -95,6 +120,44 @@ class AccountRedirectTests(TestCase):
         self.assertTemplateUsed(with_profile, "accounts/dashboard.html")
 
 
+class EditProfileTest(TestCase):
+    """
+    Tests of the recalculation queued when a profile is edited
+    """
+    def test_max_distance_change_queued(self):
+        """
+        Checks that changing only the max_distance queues a recalculation for just that change
+        """
+        user = User.objects.create_user(username="alice", email="alice@example.com",
+                                        password="secretpwd")
+        thirty_miles = Distance.objects.create(distance=30)
+        twenty_miles = Distance.objects.create(distance=20)
+        Profile.objects.create(user=user, location=Point(-1.6, 54.8), max_distance=thirty_miles)
+        violin = Instrument.objects.create(instrument="violin")
+        good_standard = Standard.objects.create(standard="good")
+        alice_violin = UserInstrument.objects.create(user=user, instrument=violin,
+                                                     standard=good_standard)
+        alice_violin.desired_instruments.add(violin)
+        alice_violin.accepted_standards.add(good_standard)
+        self.client.login(username="alice", password="secretpwd")
+
+        with self.settings(MATCH_JOBS_ASYNC=True):
+            resp = self.client.post("/profile/edit/", {
+                "email": "alice@example.com", "description": "",
+                "location": "SRID=4326;POINT (-1.6 54.8)", "max_distance": twenty_miles.pk,
+                "form-TOTAL_FORMS": 1, "form-INITIAL_FORMS": 1,
+                "form-MIN_NUM_FORMS": 0, "form-MAX_NUM_FORMS": 1000,
+                "form-0-id": alice_violin.pk, "form-0-instrument": violin.pk,
+                "form-0-standard": good_standard.pk, "form-0-desired_instruments": [violin.pk],
+                "form-0-accepted_standards": [good_standard.pk]})
+        self.assertRedirects(resp, "/dashboard/", fetch_redirect_response=False)
+        self.assertEqual(Profile.objects.get(user=user).max_distance, twenty_miles)
+        job = MatchJob.objects.get(user=user)
+        self.assertTrue(job.new_maxdist)
+        self.assertFalse(job.new_location)
+        self.assertFalse(job.new_instruments)
+
+
 # the following tests does not work, and has therefore been commented out. Despite numerous attempts,
 # I have been unable to correctly pass in the "id" values of the individual forms in the instrument
 # FormSet - this is required for all POST submission to the edit_profile page, even if I am not specifically
@@ -179,7 +242,7 @@ class AccountRedirectTests(TestCase):
     #     self.assertFormError(wrong_pwd, "form", "current_password", "Please enter your correct current password")
 
 
-class MatchesTest(TestCase):
+class MatchesTest(QueryBudgetMixin, TestCase):
     """
     Tests that matches between users are created - and not created! - as would be expected.
     The tests are of the "update_matches" function which is called whenever any user alters
@@ -233,6 +296,25 @@ class MatchesTest(TestCase):
         self.assertEqual(Match.objects.filter(found_user=self.user_1).count(), 1)
 
 
+    def test_reach_follows_distance(self):
+        """
+        Checks that each profile's reach covers the users within its max_distance, and is
+        redrawn (and the cached profile forgotten) when the distance itself is edited
+        """
+        self.make_data()
+        self.assertItemsEqual(reaching(self.profile_1.location).values_list("user", flat=True),
+                              [self.user_1.pk, self.user_2.pk])
+        self.assertEqual(get_snapshot(self.user_1.pk)["max_distance"], 30)
+        thirty_miles = self.profile_1.max_distance
+        thirty_miles.distance = 20
+        thirty_miles.save()
+        self.assertItemsEqual(reaching(self.profile_1.location).values_list("user", flat=True),
+                              [self.user_1.pk])
+        self.assertEqual(get_snapshot(self.user_1.pk)["max_distance"], 20)
+        update_matches(self.user_1, new_location=True)
+        self.assertEqual(Match.objects.count(), 0)
+
+
     def test_instrument_matters(self):
         """
         Checks that changing the instrument desired makes the match go away for that user
@@ -257,4 +339,528 @@ class MatchesTest(TestCase):
         update_matches(self.user_1, new_instruments=True)
         self.assertEqual(Match.objects.filter(requesting_user=self.user_1).count(), 1)
         self.assertEqual(Match.objects.filter(found_user=self.user_1).count(), 0)
- 
\ No newline at end of file
+ 
+
+    def test_recalculation_keeps_existing_matches(self):
+        """
+        Checks that recalculating matches which still hold neither duplicates them nor resets
+        their status
+        """
+        self.make_data()
+        Match.objects.update(known=True)
+        update_matches(self.user_1, new_location=True)
+        self.assertEqual(Match.objects.all().count(), 2)
+        self.assertEqual(Match.objects.filter(known=False).count(), 0)
+
+
+    def test_matches_swapped_as_a_generation(self):
+        """
+        Checks that each recalculation replaces the user's matches with a new generation of the
+        same rows, rather than adding to them, and that the same match can't be stored twice
+        """
+        self.make_data()
+        before = dict(Match.objects.values_list("pk", "generation"))
+        update_matches(self.user_1, new_location=True)
+        after = dict(Match.objects.values_list("pk", "generation"))
+        self.assertItemsEqual(after, before)
+        for pk, generation in after.items():
+            self.assertGreater(generation, before[pk])
+
+        match = Match.objects.first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Match.objects.create(requesting_user_id=match.requesting_user_id,
+                                 found_user_id=match.found_user_id,
+                                 instrument_pairs=match.instrument_pairs)
+
+
+    def test_one_match_per_pair_of_users(self):
+        """
+        Checks that a second pair of instruments matched between the same two users is added to
+        their existing Match, making it unknown and new again, and is shown on the matches page
+        """
+        self.make_data()
+        Match.objects.update(known=True, mark_new=False)
+        cello = Instrument.objects.create(instrument="cello")
+        self.alice_violin.desired_instruments.add(cello)
+        bob_cello = UserInstrument.objects.create(user=self.user_2, instrument=cello,
+                                                  standard=self.bob_piano.standard)
+        bob_cello.desired_instruments.add(self.alice_violin.instrument)
+        bob_cello.accepted_standards.add(self.bob_piano.standard)
+        update_matches(self.user_2, new_instruments=True)
+
+        self.assertEqual(Match.objects.all().count(), 2)
+        match = Match.objects.get(requesting_user=self.user_1)
+        self.assertEqual([Match.unpack_pair(pair) for pair in match.instrument_pairs],
+                         sorted([(self.alice_violin.instrument_id, self.bob_piano.instrument_id),
+                                 (self.alice_violin.instrument_id, cello.pk)]))
+        self.assertFalse(match.known)
+        self.assertTrue(match.mark_new)
+        self.assertEqual(get_counts(self.user_1.pk).unknown_matches, 1)
+
+        self.client.login(username="alice", password="secretpwd")
+        summary = self.client.get("/matches/").context["matches"]
+        self.assertEqual(sorted(summary["violin"]), ["cello", "piano"])
+        self.assertEqual(summary["violin"]["cello"]["matches"], [{"username": "bob", "new": True}])
+        detail = self.client.get("/matches/violin/cello/")
+        self.assertEqual([match["user"] for match in detail.context["matches"]], [self.user_2])
+
+
+    def test_instrument_pair_packing(self):
+        """
+        Checks that pairs of instrument ids are packed and unpacked again, and that ids too large
+        to be packed are refused rather than stored wrongly
+        """
+        largest = Match.PAIR_BASE - 1
+        self.assertEqual(Match.unpack_pair(Match.pack_pair(largest, largest)), (largest, largest))
+        self.assertLess(Match.pack_pair(largest, largest), 2**31)
+        self.assertRaises(ValueError, Match.pack_pair, 1, Match.PAIR_BASE)
+        self.assertRaises(ValueError, Match.pack_pair, Match.PAIR_BASE, 1)
+
+
+    def test_distance_stored_and_updated(self):
+        """
+        Checks that matches store the distance between the users, and that it is corrected
+        when one of them moves
+        """
+        self.make_data()
+        for match in Match.objects.all():
+            self.assertAlmostEqual(match.distance, 20.7, places=0)
+        self.profile_2.location = Point(-1.6, 54.6)
+        self.profile_2.save()
+        update_matches(self.user_2, new_location=True)
+        self.assertEqual(Match.objects.all().count(), 2)
+        for match in Match.objects.all():
+            self.assertAlmostEqual(match.distance, 13.8, places=0)
+
+
+    def test_matches_page(self):
+        """
+        Checks the summary shown on the matches page, and that viewing it updates the status
+        of the matches
+        """
+        self.make_data()
+        self.client.login(username="alice", password="secretpwd")
+        first_view = self.client.get("/matches/")
+        self.assertEqual(first_view.context["matches"],
+                         {"violin": {"piano": {"matches": [{"username": "bob", "new": True}],
+                                               "count": 1, "num_new": 1}}})
+        self.assertEqual(Match.objects.filter(requesting_user=self.user_1, known=False).count(), 0)
+        second_view = self.client.get("/matches/")
+        self.assertEqual(second_view.context["matches"]["violin"]["piano"]["num_new"], 0)
+
+
+    def test_matches_summary_limited(self):
+        """
+        Checks that the summary only includes the first matches for each pair of instruments,
+        even when they are all new, while still counting the rest
+        """
+        self.make_data()
+        carol = User.objects.create_user(username="carol", password="secretpwd")
+        Profile.objects.create(user=carol, location=Point(-1.6, 54.7),
+                               max_distance=self.profile_2.max_distance)
+        carol_piano = UserInstrument.objects.create(user=carol, instrument=self.bob_piano.instrument,
+                                                    standard=self.bob_piano.standard)
+        carol_piano.desired_instruments.add(self.alice_violin.instrument)
+        carol_piano.accepted_standards.add(self.bob_piano.standard)
+        update_matches(carol, new_location=True)
+        summary = summarise_matches(self.user_1, 1)
+        self.assertEqual(summary["violin"]["piano"],
+                         {"matches": [{"username": "carol", "new": True}],
+                          "count": 2, "num_new": 2})
+
+
+    def test_notification_counts(self):
+        """
+        Checks that the notification counts follow the matches, messages and invitations
+        """
+        self.make_data()
+        self.assertEqual(get_counts(self.user_1.pk).unknown_matches, 1)
+        self.client.login(username="alice", password="secretpwd")
+        self.client.get("/matches/")
+        self.assertEqual(get_counts(self.user_1.pk).unknown_matches, 0)
+        Message.objects.create(user_from=self.user_2, user_to=self.user_1, title="Hi", message="Hi")
+        self.assertEqual(get_counts(self.user_1.pk).unread_messages, 1)
+        self.assertEqual(get_counts(self.user_1.pk).pending_invites, 0)
+
+
+    def test_notification_counts_after_user_deleted(self):
+        """
+        Checks that deleting a user takes the matches others had with them off those users' counts
+        """
+        self.make_data()
+        self.assertEqual(get_counts(self.user_2.pk).unknown_matches, 1)
+        self.user_1.delete()
+        self.assertEqual(get_counts(self.user_2.pk).unknown_matches, 0)
+
+
+    def test_queued_recalculation(self):
+        """
+        Checks that recalculations queued by profile saves are combined, and give the same
+        result when run
+        """
+        self.make_data()
+        twenty_miles = Distance.objects.create(distance=20)
+        self.profile_1.max_distance = twenty_miles
+        self.profile_1.save()
+        enqueue_matches(self.user_1, new_maxdist=True)
+        enqueue_matches(self.user_1, new_instruments=True)
+        self.assertEqual(MatchJob.objects.count(), 1)
+        jobs = claim_jobs(10)
+        self.assertEqual(len(jobs), 1)
+        self.assertTrue(jobs[0].new_maxdist and jobs[0].new_instruments)
+        self.assertEqual(claim_jobs(10), [])
+        self.assertEqual(MatchJob.objects.count(), 1)
+        run_job(jobs[0])
+        self.assertEqual(MatchJob.objects.count(), 0)
+        self.assertEqual(Match.objects.filter(requesting_user=self.user_1).count(), 0)
+        self.assertEqual(Match.objects.filter(found_user=self.user_1).count(), 1)
+
+
+    def test_claimed_jobs_kept(self):
+        """
+        Checks that a claimed job stays queued until it has run: it is claimed again once the
+        worker holding it has been gone too long, and run again if the profile is saved while
+        it's running
+        """
+        self.make_data()
+        enqueue_matches(self.user_1, new_location=True)
+        MatchJob.objects.update(claimed=timezone.now() - timedelta(hours=1))
+        jobs = claim_jobs(10)
+        self.assertEqual(len(jobs), 1)
+        enqueue_matches(self.user_1, new_instruments=True)
+        run_job(jobs[0])
+        job = MatchJob.objects.get()
+        self.assertIsNone(job.claimed)
+        self.assertTrue(job.new_location and job.new_instruments)
+        run_job(claim_jobs(10)[0])
+        self.assertEqual(MatchJob.objects.count(), 0)
+
+
+    def test_rebuild(self):
+        """
+        Checks that rebuilding the matches of all users recreates them, keeping the status of
+        those which already existed
+        """
+        self.make_data()
+        Match.objects.filter(requesting_user=self.user_1).update(known=True)
+        Match.objects.filter(requesting_user=self.user_2).delete()
+        self.assertEqual(rebuild_matches([self.user_1.pk, self.user_2.pk]), 2)
+        self.assertEqual(Match.objects.all().count(), 2)
+        self.assertTrue(Match.objects.get(requesting_user=self.user_1).known)
+
+
+    def test_index_agrees_with_database(self):
+        """
+        Checks that the in-memory compatibility index finds the same matches as the database
+        """
+        self.make_data()
+        index = CompatibilityIndex()
+        index.build()
+        self.assertEqual(index.wanted_matches(self.user_1.pk), set(wanted_matches(self.user_1)))
+        self.assertEqual(index.wanted_by_others(self.user_1.pk),
+                         set(wanted_by_others(self.user_1)))
+        self.assertEqual(index.wanted_matches(self.user_1.pk, candidate_users=[]), set())
+
+
+    def test_spatial_index_agrees_with_database(self):
+        """
+        Checks that the in-memory spatial index finds the same users in range as the database,
+        and follows a profile as it moves
+        """
+        self.make_data()
+        index = SpatialIndex()
+        index.build()
+        nearby = index.within(self.profile_1.location, 30)
+        self.assertItemsEqual(nearby, [self.user_1.pk, self.user_2.pk])
+        self.assertAlmostEqual(nearby[self.user_2.pk], 20.7, places=0)
+        self.assertItemsEqual(index.reaching(self.profile_1.location),
+                              [self.user_1.pk, self.user_2.pk])
+        expected = (wanted_matches(self.user_1), wanted_by_others(self.user_1))
+        with self.settings(SPATIAL_INDEX=True):
+            found = (wanted_matches(self.user_1), wanted_by_others(self.user_1))
+        spatial_index.reset()
+        for matches, expected_matches in zip(found, expected):
+            self.assertItemsEqual(matches, expected_matches)
+            for key, distance in matches.items():
+                self.assertAlmostEqual(distance, expected_matches[key], places=2)
+
+        self.profile_2.location = Point(-1.6, 54.0)
+        index.update_profile(self.profile_2)
+        self.assertItemsEqual(index.within(self.profile_1.location, 30), [self.user_1.pk])
+        self.assertItemsEqual(index.reaching(self.profile_1.location), [self.user_1.pk])
+
+
+    def test_worker_spatial_index_sees_other_processes(self):
+        """
+        Checks that the worker's spatial index picks up a move saved by another (web) process,
+        whose signals only update that process's own copy, before running the queued job - by
+        reloading just that user
+        """
+        spatial_index.reset()
+        self.addCleanup(spatial_index.reset)
+        with self.settings(SPATIAL_INDEX=True):
+            self.make_data()
+            worker = ProcessMatchJobs(stdout=StringIO())
+            # the worker's copy, built before the move
+            index = spatial_index._index
+            self.assertIsNotNone(index)
+            # the move, as saved by another process: its signals log the change, but don't reach
+            # this process's index
+            Profile.objects.filter(pk=self.profile_1.pk).update(location=Point(-1.6, 53.5,
+                                                                               srid=4326))
+            IndexChange.objects.create(user=self.user_1.pk)
+            enqueue_matches(self.user_1, new_location=True)
+            worker.run_batch(claim_jobs(10))
+            self.assertIs(spatial_index._index, index)
+        self.assertEqual(Match.objects.count(), 0)
+
+
+    def test_worker_rebuilds_indexes(self):
+        """
+        Checks that the worker rebuilds its indexes from scratch once INDEX_REBUILD_INTERVAL has
+        passed, picking up unlogged changes, and clears out the old log entries
+        """
+        spatial_index.reset()
+        self.addCleanup(spatial_index.reset)
+        with self.settings(SPATIAL_INDEX=True):
+            self.make_data()
+            worker = ProcessMatchJobs(stdout=StringIO())
+            index = spatial_index._index
+            Profile.objects.filter(pk=self.profile_1.pk).update(location=Point(-1.6, 53.5,
+                                                                               srid=4326))
+            IndexChange.objects.update(changed=timezone.now() - timedelta(days=2))
+            worker.indexes.rebuilt -= timedelta(days=1)
+            enqueue_matches(self.user_1, new_location=True)
+            worker.run_batch(claim_jobs(10))
+            self.assertIsNot(spatial_index._index, index)
+        self.assertEqual(Match.objects.count(), 0)
+        self.assertEqual(IndexChange.objects.count(), 0)
+
+
+    def check_worker_sees_instrument_change(self, index_setting, index):
+        """
+        Checks that the worker's copy of the given in-memory index picks up a change of
+        instruments saved by another (web) process before running the queued job
+        """
+        index.reset()
+        self.addCleanup(index.reset)
+        with self.settings(**{index_setting: True}):
+            self.make_data()
+            worker = ProcessMatchJobs(stdout=StringIO())
+            self.assertIsNotNone(index._index)
+            # deleting the through rows directly sends no m2m_changed, as if this happened in
+            # another process - which logs the change
+            UserInstrument.desired_instruments.through.objects \
+                          .filter(userinstrument=self.alice_violin).delete()
+            IndexChange.objects.create(user=self.user_1.pk)
+            enqueue_matches(self.user_1, new_instruments=True)
+            worker.run_batch(claim_jobs(10))
+        self.assertEqual(Match.objects.filter(requesting_user=self.user_1).count(), 0)
+        self.assertEqual(Match.objects.filter(found_user=self.user_1).count(), 1)
+
+
+    def test_worker_instrument_index_sees_other_processes(self):
+        self.check_worker_sees_instrument_change("INSTRUMENT_INDEX", instrument_index)
+
+
+    def test_worker_match_index_sees_other_processes(self):
+        self.check_worker_sees_instrument_change("MATCH_INDEX", match_index)
+
+
+    def test_instrument_index_agrees_with_database(self):
+        """
+        Checks that finding the compatible players first, from the inverted index, gives the same
+        matches as finding the users in range first
+        """
+        self.make_data()
+        index = InstrumentIndex()
+        index.build()
+        self.assertEqual(index.wanted_candidates(self.user_1.pk),
+                         set([(self.alice_violin.pk, self.user_2.pk, self.bob_piano.pk)]))
+        self.assertEqual(index.wanting_candidates(self.user_1.pk),
+                         set([(self.bob_piano.pk, self.user_2.pk, self.alice_violin.pk)]))
+        expected = (wanted_matches(self.user_1), wanted_by_others(self.user_1))
+        with self.settings(INSTRUMENT_INDEX=True):
+            found = (wanted_matches(self.user_1), wanted_by_others(self.user_1))
+        instrument_index.reset()
+        for matches, expected_matches in zip(found, expected):
+            self.assertItemsEqual(matches, expected_matches)
+
+        self.bob_piano.accepted_standards.clear()
+        index.update_user(self.user_2.pk)
+        self.assertEqual(len(index.wanted_candidates(self.user_1.pk)), 1)
+        self.assertEqual(index.wanting_candidates(self.user_1.pk), set())
+
+
+    def test_profile_snapshot(self):
+        """
+        Checks that the cached profile snapshot is thrown away when the profile, instruments or
+        groups change, and that the profile page offers the right groups to invite to
+        """
+        self.make_data()
+        self.assertEqual(get_snapshot(self.user_1.pk)["instruments"][0]["desired_instruments"],
+                         ["piano"])
+        self.alice_violin.desired_instruments.add(Instrument.objects.create(instrument="cello"))
+        self.assertEqual(sorted(get_snapshot(self.user_1.pk)["instruments"][0]["desired_instruments"]),
+                         ["cello", "piano"])
+        self.profile_1.description = "Keen violinist"
+        self.profile_1.save()
+        self.assertEqual(get_snapshot(self.user_1.pk)["description"], "Keen violinist")
+
+        duo = Group.objects.create(name="Duo")
+        duo.members.add(self.bob_piano)
+        duo.desired_instruments.add(self.alice_violin.instrument)
+        self.assertEqual(get_snapshot(self.user_2.pk)["groups"], [{"pk": duo.pk, "name": "Duo"}])
+        self.client.login(username="bob", password="secretpwd")
+        response = self.client.get("/profile/alice/")
+        self.assertEqual(list(response.context["groups_to_invite"]), [duo])
+        duo.members.add(self.alice_violin)
+        response = self.client.get("/profile/alice/")
+        self.assertEqual(list(response.context["groups_to_invite"]), [])
+        self.assertEqual(response.context["groups"], [{"pk": duo.pk, "name": "Duo"}])
+
+
+    def visit_budgeted_pages(self):
+        """
+        Fetches each page with a query budget, with an empty cache, checking it stays within the
+        budget - and returns the number of queries each ran
+        """
+        counts = {}
+        for username, budget, url in [("alice", "matches", "/matches/"),
+                                      ("alice", "edit_profile", "/profile/edit/"),
+                                      ("bob", "user_profile", "/profile/alice/")]:
+            self.client.login(username=username, password="secretpwd")
+            cache.clear()
+            with self.assertQueryBudget(budget) as queries:
+                self.client.get(url)
+            counts[budget] = len(queries)
+        return counts
+
+
+    def test_query_budgets(self):
+        """
+        Checks that the pages showing matches and profiles run a fixed number of queries,
+        however many instruments the users play: the same number with five as with one, and
+        within their budgets
+        """
+        self.make_data()
+        counts = self.visit_budgeted_pages()
+        good_standard = Standard.objects.get(standard="good")
+        for name in ["viola", "cello", "flute", "oboe"]:
+            instrument = Instrument.objects.create(instrument=name)
+            alice_instrument = UserInstrument.objects.create(user=self.user_1, instrument=instrument,
+                                                             standard=good_standard)
+            alice_instrument.desired_instruments.add(self.bob_piano.instrument)
+            alice_instrument.accepted_standards.add(good_standard)
+        update_matches(self.user_1, new_instruments=True)
+        self.assertEqual(self.visit_budgeted_pages(), counts)
+
+
+class GeocodeCacheTest(TestCase):
+    """
+    Tests of the reverse-geocode cache used to display users' locations
+    """
+    def test_nearby_points_share_address(self):
+        """
+        Checks that points rounding to the same cache entry get the cached address
+        """
+        GeocodedLocation.objects.create(address=" Durham, UK", updated=timezone.now(),
+                                        **quantize(Point(-1.5752, 54.7761)))
+        self.assertEqual(cached_address(Point(-1.57521, 54.77612)), " Durham, UK")
+        self.assertEqual(GeocodedLocation.objects.count(), 1)
+
+
+    def test_unknown_location_left_for_refresh(self):
+        """
+        Checks that a point not yet in the cache is displayed as unknown, and queued for lookup
+        """
+        self.assertEqual(cached_address(Point(-1, 53)), "Unknown")
+        self.assertEqual(stale_entries().count(), 1)
+
+
+    def test_profile_save_leaves_lookup_for_refresh(self):
+        """
+        Checks that saving a profile adds its location to the cache without looking it up
+        """
+        user = User.objects.create_user(username="alice", password="secretpwd")
+        Profile.objects.create(user=user, location=Point(-1.6, 54.8),
+                               max_distance=Distance.objects.create(distance=30))
+        entry = GeocodedLocation.objects.get(**quantize(Point(-1.6, 54.8)))
+        self.assertIsNone(entry.address)
+        self.assertEqual(stale_entries().count(), 1)
+
+
+    def test_offline_geocoder(self):
+        """
+        Checks that the offline geocoder finds the nearest town in its gazetteer
+        """
+        geocoder = OfflineGeocoder()
+        self.assertEqual(geocoder.reverse_geocode(54.78, -1.57), "Durham, UK")
+        self.assertEqual(geocoder.reverse_geocode(51.48, -3.18), "Cardiff, UK")
+
+
+class UsernameSearchTest(TestCase):
+    """
+    Tests the search for usernames used for autocompletion
+    """
+    def setUp(self):
+        usernames.cache.clear()
+        for username in ["Annabel", "ann", "anna", "bob", "annie"]:
+            User.objects.create_user(username=username, password="secretpwd")
+
+
+    def test_ranking(self):
+        """
+        Checks that the search takes the first usernames alphabetically, up to the limit, and
+        shows an exact match first and then the shortest
+        """
+        with self.settings(USERNAME_SEARCH_LIMIT=3):
+            found = usernames.search(User.objects.all(), "ANN", "all")
+        self.assertEqual([user.username for user in found], ["ann", "anna", "Annabel"])
+
+
+    def test_longer_prefix_from_cache(self):
+        """
+        Checks that a longer search is answered from the complete results of a shorter one
+        """
+        usernames.search(User.objects.all(), "an", "all")
+        User.objects.create_user(username="annabelle", password="secretpwd")
+        with self.assertNumQueries(0):
+            found = usernames.search(User.objects.all(), "anna", "all")
+        self.assertEqual([user.username for user in found], ["anna", "Annabel"])
+
+
+class PopulationTest(TestCase):
+    """
+    Tests the generator of synthetic users for benchmarking
+    """
+    def test_generate_and_clear(self):
+        """
+        Checks that the synthetic users get complete profiles, and are removed again by
+        clear_population without touching anyone else
+        """
+        real_user = User.objects.create_user(username="alice", password="secretpwd")
+        Standard.objects.create(standard="good")
+        Standard.objects.create(standard="professional")
+        user_ids = PopulationGenerator(seed=1).generate(50, batch_size=20)
+        self.assertEqual(len(user_ids), 50)
+        self.assertEqual(Profile.objects.filter(user__in=user_ids).count(), 50)
+        self.assertEqual(UserInstrument.objects.filter(user__in=user_ids)
+                                               .values("user").distinct().count(), 50)
+        self.assertFalse(UserInstrument.objects.filter(desired_instruments=None).exists())
+
+        # a synthetic user who has joined, and posted in, a real user's group
+        synthetic = UserInstrument.objects.filter(user__in=user_ids).first()
+        real_group = Group.objects.create(name="Real group")
+        real_group.members.add(synthetic)
+        thread = GroupThread.objects.create(group=real_group, name="Hello",
+                                            started_by=real_user)
+        GroupMessage.objects.create(thread=thread, author=synthetic.user, message="Hi")
+
+        clear_population()
+        self.assertEqual(list(User.objects.all()), [real_user])
+        self.assertFalse(UserInstrument.objects.exists())
+        self.assertEqual(list(Group.objects.all()), [real_group])
+        self.assertFalse(Membership.objects.exists())
+        self.assertFalse(GroupMessage.objects.exists())
+        self.assertIsNone(GroupThread.objects.get(pk=thread.pk).last_post_author)
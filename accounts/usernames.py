@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+from django.conf import settings
+from django.db.models import Func
+from django.db.models.functions import Upper
+
+# the most prefixes remembered at once, before the cache is cleared out
+MAX_CACHED_PREFIXES = 10000
+
+
+class PrefixCache(object):
+    """
+    Remembers the users found for recent searches, for each scope (a name for the set of users
+    being searched). As well as answering repeats of a search, this can answer a longer search
+    from the results of a shorter one, as long as those were complete - that is, fewer than the
+    result limit. So once someone has typed a few letters of a username, the rest of their
+    typing usually doesn't reach the database at all.
+    The results are kept for settings.USERNAME_SEARCH_CACHE_TIMEOUT seconds, so new users (and
+    new usernames) are only missed for a short while.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, scope, prefix):
+        now = time.time()
+        for length in range(len(prefix), 0, -1):
+            entry = self.entries.get((scope, prefix[:length]))
+            if entry is None or entry[0] < now:
+                continue
+            expires, users, complete = entry
+            if length == len(prefix):
+                return users
+            if complete:
+                return [user for user in users if user.username.upper().startswith(prefix)]
+        return None
+
+    def set(self, scope, prefix, users, complete):
+        with self.lock:
+            if len(self.entries) >= MAX_CACHED_PREFIXES:
+                now = time.time()
+                self.entries = dict((key, entry) for key, entry in self.entries.items()
+                                    if entry[0] >= now)
+                if len(self.entries) >= MAX_CACHED_PREFIXES:
+                    self.entries = {}
+            self.entries[(scope, prefix)] = (time.time() + settings.USERNAME_SEARCH_CACHE_TIMEOUT,
+                                             users, complete)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+
+# shared by all the autocomplete channels in this process
+cache = PrefixCache()
+
+
+class ByteOrder(Func):
+    """
+    Compares text in the "C" collation - by character code, rather than the database's locale
+    """
+    template = '%(expressions)s COLLATE "C"'
+
+
+def search(queryset, prefix, scope):
+    """
+    Returns up to settings.USERNAME_SEARCH_LIMIT of the users in the queryset whose usernames
+    start with the given prefix (ignoring case): the first of them in order of character code,
+    which puts an exact match first, shown shortest first. Both the filter and the order are
+    answered by the index on UPPER(username) (see migration 0018), so the database stops after
+    the limit however many usernames share the prefix. The results are cached under the given
+    scope, which must name the users in the queryset.
+    """
+    prefix = prefix.upper()
+    users = cache.get(scope, prefix)
+    if users is None:
+        limit = settings.USERNAME_SEARCH_LIMIT
+        users = list(queryset.filter(username__istartswith=prefix)
+                             .only("pk", "username")
+                             .order_by(ByteOrder(Upper("username")))[:limit])
+        users.sort(key=lambda user: (len(user.username), user.username.upper()))
+        cache.set(scope, prefix, users, len(users) < limit)
+    return users
@@ -9,57 +9,62 @@ from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.forms import modelformset_factory
+from django.forms.models import model_to_dict
 from django.template.context_processors import csrf
-from django.db import IntegrityError
-from django.db.models import F
+from django.db import IntegrityError, connection
 from django.conf import settings
-from django.contrib.gis.measure import Distance
-from django.contrib.gis.db.models.functions import Distance as get_distance
 from django.http import Http404
-from googlemaps import Client
 from geopy.distance import distance
-from groups.models import Group, Invitation
+from groups.models import Group
+from groups.membership import member_group_ids
 from .forms import UserRegistrationForm, UserUpdateForm, ProfileForm, UserInstrumentForm
-from .models import Profile, UserInstrument, Match, Standard
+from .models import Profile, UserInstrument, Match, Standard, Instrument
+from .matching import update_matches
+from .jobs import enqueue_matches
+from .geocoding import cached_addresses
+from .profile_cache import get_snapshot
+from .signals import matches_changed
 
 MATCHES_DISPLAY_LIMIT = 5  # can be lowered for testing purposes
 
+# used by summarise_matches below. Each Match holds all the pairs of instruments matched between
+# two users, packed into one number each (see the Match model), so these are unnested and split up
+# again before the window functions rank and count the matches for each pair of instruments -
+# none of which the Django ORM has any way of expressing.
+MATCH_SUMMARY_SQL = """
+    SELECT matched.instrument, played.instrument, found_user.username, ranked.mark_new,
+           ranked.total, ranked.num_new
+    FROM (
+        SELECT m.found_user_id, m.mark_new,
+               pair / %(base)d AS matched_id, mod(pair, %(base)d) AS played_id,
+               ROW_NUMBER() OVER instruments AS position, COUNT(*) OVER instruments AS total,
+               SUM(CASE WHEN m.mark_new THEN 1 ELSE 0 END) OVER instruments AS num_new
+        FROM %(match)s m, unnest(m.instrument_pairs) pair
+        WHERE m.requesting_user_id = %%s
+        WINDOW instruments AS (PARTITION BY pair
+                               ORDER BY m.mark_new DESC, m.distance, m.id
+                               ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+    ) ranked
+    JOIN %(instrument)s matched ON matched.id = ranked.matched_id
+    JOIN %(instrument)s played ON played.id = ranked.played_id
+    JOIN %(user)s found_user ON found_user.id = ranked.found_user_id
+    WHERE ranked.position <= %%s
+    ORDER BY ranked.position
+"""
+
 def get_profile_details(user):
     """
     helper function to look up a user's profile details. Used on both the "dashboard" page
     (where it applies to the logged-in user) and the generic "profiles" pages where users can
-    browse the profiles of other users:
+    browse the profiles of other users. The details come from the cached snapshot of the
+    profile (see profile_cache.py).
     """
     try:
-        profile = get_object_or_404(User, pk=user.pk).profile
+        snapshot = get_snapshot(user.pk)
     except Profile.DoesNotExist:
         raise Http404
-    instruments = UserInstrument.objects.filter(user=user.pk)
-    
-    # use google maps API to get a nicely formatted address string:
-    point = profile.location
-    # the database stores the latitude and longitude in the "co-ords" field of the Point Field object
-    # - but in reverse order (longitute, then latitude). Since Google Maps expects the latitute to
-    # be first, we reverse the tuple with ::-1
-    results = Client(key=settings.GOOGLE_MAP_API_KEY).reverse_geocode(point.coords[::-1])
-    # results is a list of dictionaries - the number is not possible to determine in advance
-    # - representing geographical areas of decreasing specificity around the given point. Some
-    # - but not all - will have a "formatted_address" key, and we will grab this data from the
-    # first case where it actually exists, in order to get the most specific address possible.
-    for item in results:
-        try:
-            place = item["formatted_address"]
-            break
-        except KeyError:
-            continue
-    # handle the possible case where no address can be found:
-    if place is None:
-        address_string = "Unknown"
-    else:
-        # remove first part of address - users will not want their full address to be publicly displayed!
-        # in fact, after seeing more results, it is better to remove all but the last 2 parts!
-        address_string = ",".join(place.split(",")[-2:])
-    return {"id": user, "location": address_string, "profile": profile, "instruments": instruments}
+    return {"id": user, "location": snapshot["location"], "profile": snapshot,
+            "instruments": snapshot["instruments"]}
 
 
 def match_details(match, viewing=False):
@@ -69,15 +74,10 @@ def match_details(match, viewing=False):
     This dictionary has the following keys:
     - user: a reference to the object corresponding to the user matching the one
     making the query, from which all details can of course be obtained
-    - distance: the distance in miles between the locations
-    - played_instr: the instrument the "found" user plays
-    - matched_instr: the instrument that the "requesting plays which was matched against
+    - distance: the distance in miles between the locations (stored on the match itself)
+    - instrument_pairs: the (requesting, found) Instrument ids of each pair of instruments
+    matched between the two users
     """
-
-    location_1 = match.requesting_user.profile.location.coords[::-1]
-    location_2 = match.found_user.profile.location.coords[::-1]
-    dist = distance(location_1, location_2).miles
-
     if viewing:
         # update the "known" and "mark_new" status of the match. This controls whether the user
         # is notified of it as a new match, and how it is displayed on the matches page.
@@ -87,105 +87,38 @@ def match_details(match, viewing=False):
             match.known = True
         match.save()
 
-    return {"user": match.found_user, "distance": dist,
-            "played_instr": match.found_instrument, "matched_instr": match.requesting_instrument,
+    return {"user": match.found_user, "distance": match.distance,
+            "instrument_pairs": [Match.unpack_pair(pair) for pair in match.instrument_pairs],
             "new": match.mark_new}
 
 
-def update_matches(user, new_location=False, new_maxdist=False, new_instruments=False):
+def summarise_matches(user, limit):
     """
-    This function is called when a user updates their profile, in order to recalculate
-    all matches which they are involved in.
-    The optional keyword arguments are all booleans which are used to keep track of what
-    information the user has changed, in order to keep database manipulation to a minimum.
+    Builds the data for the matches overview page in a single query, as a nested dict of the
+    following form:
+    {"instrument_matched": {"instrument_played": {"matches": [{username: "user1", "new": False},
+                                                              {username: "user2": "new": True}],
+                                                  "count": 2, "num_new": 1}}},
+    - here the boolean value "new" indicates whether the match is "new" or not, "count" is the
+    total number of matches and "num_new" the number of those which are indeed new (both of which
+    are needed for the template).
+    The database ranks the matches for each pair of instruments - new matches first, then the
+    nearest - and only sends back those the page will actually show: the first "limit" of them,
+    new or not, with the rest left for the matches_detail page. The cost of the page therefore
+    doesn't grow with the number of matches, even when a move brings in many new ones at once.
     """
-    my_matches = Match.objects.filter(requesting_user=user)
-    matched_to_others = Match.objects.filter(found_user=user)
-
-    if new_location or new_maxdist or new_instruments:
-        # in any of these cases (which will almost certainly cover all times this
-        # function is actually called!) the user will potentially find new matches
-        # and/or lose old ones. So we recalculate the matches.
-        # First find all users who are close enough
-        close_enough = User.objects.filter(profile__location__distance_lte=(user.profile.location,
-                                           Distance(mi=user.profile.max_distance.distance)))
-        # then find all the matches of instrument and standard
-        my_instruments = UserInstrument.objects.filter(user=user)
-
-        for candidate in close_enough.all():
-            if candidate == user:
-                continue
-            their_instruments = UserInstrument.objects.filter(user=candidate)
-            for their_instr in their_instruments.all():
-                their_standard = their_instr.standard
-                for my_instr in my_instruments.all():
-                    standards_to_accept = my_instr.accepted_standards
-                    if standards_to_accept.filter(standard=their_standard.standard).exists() \
-                    and my_instr.desired_instruments.filter(instrument=their_instr.instrument).exists():
-                        # see if the match previously existed, and only save the new one if it didn't
-                        if not my_matches.filter(requesting_user=user, found_user=candidate,
-                                                 requesting_instrument=my_instr,
-                                                 found_instrument=their_instr).exists():
-                            match = Match(requesting_user=user, found_user=candidate,
-                                          requesting_instrument=my_instr, found_instrument=their_instr)
-                            match.save()
-
-        # finally, delete all previous matches which no longer fit:
-        for match in my_matches.all():
-            if match.found_user not in close_enough \
-            or match.requesting_instrument not in my_instruments.all():
-                match.delete()
-            for my_instr in my_instruments.all():
-                standards_to_accept = my_instr.accepted_standards
-                if match.requesting_instrument == my_instr:
-                    if match.found_instrument.instrument not in my_instr.desired_instruments.all() \
-                    or match.found_instrument.standard not in standards_to_accept.all():
-                        match.delete()
-
-    if new_location or new_instruments:
-        # similar calculations to update the matches the relevant user has with others.
-        # We do not run this if only the max_distance has changed, because that has
-        # no effect on other users looking for a match
-
-        # first we need a more complicated definition for "close_enough", because we are measure
-        # not to the "fixed" max_distance of the requesting user, but relative to each other user's
-        # own max_distance value
-        distances = User.objects.annotate(distance=get_distance("profile__location",
-                                                                user.profile.location)/1609.344)
-        # using manual conversion from meters to miles, because get_distance does NOT return a Distance
-        # object with methods to easily convert between units
-        close_enough = distances.filter(distance__lte=F("profile__max_distance__distance"))
-        my_instruments = UserInstrument.objects.filter(user=user)
-        
-        for candidate in close_enough.all():
-            if candidate == user:
-                continue
-            their_instruments = UserInstrument.objects.filter(user=candidate)
-            for my_instr in my_instruments.all():
-                my_standard = my_instr.standard
-                for their_instr in their_instruments.all():
-                    standards_to_accept = their_instr.accepted_standards
-                    if standards_to_accept.filter(standard=my_standard.standard).exists() \
-                    and their_instr.desired_instruments.filter(instrument=my_instr.instrument).exists():
-                        if not matched_to_others.filter(requesting_user=candidate,
-                                                        found_user=user,
-                                                        requesting_instrument=their_instr,
-                                                        found_instrument=my_instr).exists():
-                            match = Match(requesting_user=candidate, found_user=user,
-                                          requesting_instrument=their_instr, found_instrument=my_instr)
-                            match.save()
- 
-        for match in matched_to_others.all():
-            their_instruments = UserInstrument.objects.filter(user=match.requesting_user)
-            if match.requesting_user not in close_enough \
-            or match.found_instrument not in my_instruments.all():
-                match.delete()
-            for their_instr in their_instruments.all():
-                standards_to_accept = their_instr.accepted_standards.all()
-                if match.requesting_instrument == their_instr:
-                    if match.found_instrument.instrument not in their_instr.desired_instruments.all() \
-                    or match.found_instrument.standard not in standards_to_accept.all():
-                        match.delete()
+    tables = {"match": Match._meta.db_table, "user": User._meta.db_table,
+              "instrument": Instrument._meta.db_table, "base": Match.PAIR_BASE}
+    with connection.cursor() as cursor:
+        cursor.execute(MATCH_SUMMARY_SQL % tables, [user.pk, limit])
+        rows = cursor.fetchall()
+
+    matches_dict = {}
+    for matched, played, username, new, count, num_new in rows:
+        instrument_matches = matches_dict.setdefault(matched, {}).setdefault(
+            played, {"matches": [], "count": count, "num_new": num_new})
+        instrument_matches["matches"].append({"username": username, "new": new})
+    return matches_dict
 
 
 # Create your views here.
@@ -255,6 +188,7 @@ def edit_profile(request):
         complete = user_profile.location and user_profile.max_distance and num_instruments > 0
         blank_forms = 1 if num_instruments==0 else 0
     except Profile.DoesNotExist:
+        user_profile = None
         complete = False
         blank_forms = 1
 
@@ -263,8 +197,11 @@ def edit_profile(request):
     
     if request.method=="POST":
         baseform = UserUpdateForm(request.POST, user=request.user)
-        profile_form = ProfileForm(request.POST)
-        instrument_forms = instrument_FormSet(request.POST)
+        # the saved details are given as the initial values, so that changed_data below holds
+        # only the fields the user actually changed
+        profile_form = ProfileForm(request.POST, initial=model_to_dict(user_profile)
+                                                         if user_profile else None)
+        instrument_forms = instrument_FormSet(request.POST, form_kwargs={"shared_choices": {}})
         if baseform.is_valid() and profile_form.is_valid() and instrument_forms.is_valid():
             # save the new email and/or password - but only if the user tried to change it!
             data = baseform.cleaned_data
@@ -296,9 +233,14 @@ def edit_profile(request):
 
             # now update the matches. For this we need to know which information was changed
             new_location = "location" in profile_form.changed_data
-            new_maxdist = "max_dist" in profile_form.changed_data
+            new_maxdist = "max_distance" in profile_form.changed_data
             new_instruments = instrument_forms.has_changed()
-            update_matches(request.user, new_location, new_maxdist, new_instruments)
+            # the recalculation is normally left to the process_match_jobs worker, so that saving
+            # the profile doesn't have to wait for it
+            if settings.MATCH_JOBS_ASYNC:
+                enqueue_matches(request.user, new_location, new_maxdist, new_instruments)
+            else:
+                update_matches(request.user, new_location, new_maxdist, new_instruments)
 
             verb = "updated" if complete else "completed"
             messages.success(request, "You have successfully "+verb+" your profile.")
@@ -311,10 +253,14 @@ def edit_profile(request):
         try:
             user_profile = Profile.objects.get(user=user_id)
             profile_form = ProfileForm(instance=user_profile)
-            instrument_forms = instrument_FormSet(queryset=UserInstrument.objects.filter(user=user_id))
+            instrument_forms = instrument_FormSet(queryset=UserInstrument.objects.filter(user=user_id)
+                                                  .prefetch_related("desired_instruments",
+                                                                    "accepted_standards"),
+                                                  form_kwargs={"shared_choices": {}})
         except Profile.DoesNotExist:
             profile_form = ProfileForm()
-            instrument_forms = instrument_FormSet(queryset=UserInstrument.objects.none())
+            instrument_forms = instrument_FormSet(queryset=UserInstrument.objects.none(),
+                                                  form_kwargs={"shared_choices": {}})
         baseform = UserUpdateForm(initial={"email": request.user.email})
 
     if not complete:
@@ -357,44 +303,18 @@ def login(request):
 def matches(request):
     """
     A view to handle displaying a list of all users matching the given user's search criteria
-    in their profile. Most of the work is delegated to the "match_details" function defined
+    in their profile. Most of the work is delegated to the "summarise_matches" function defined
     above.
     """
-    # form array of all match details, organised by user
-    matches = Match.objects.filter(requesting_user=request.user)
-    match_info = []
-    for match in matches.all():
-        match_info.append(match_details(match, viewing=True))
-    # order by distance, but putting new matches first:
-    def sort_func(match):
-        return (match["distance"]-10000) if match["new"] else match["distance"]
-    match_info.sort(key=sort_func)
-
-    # restructure this into a nested dict, of the following form:
-    # {"instrument_matched": {"instrument_played": {"matches": [{username: "user1", "new": False}, 
-    #                                                           {username: "user2": "new": True}],
-    #                                               "num_new": 1}}},
-    # - here the boolean value "new" indicates whether the match is "new" or not, and
-    # "num_new" just counts the number of matches that are indeed new (which is
-    # needed for the template)
-    matches_dict = {}
-    for match in match_info:
-        matched = match["matched_instr"].instrument.instrument
-        played = match["played_instr"].instrument.instrument
-        if matched in matches_dict.keys():
-            if played in matches_dict[matched].keys():
-                matches_dict[matched][played]["matches"].append({"username": match["user"].username,
-                                                                 "new": match["new"]})
-            else:
-                matches_dict[matched][played] = {"matches": [{"username": match["user"].username,
-                                                             "new": match["new"]}],
-                                                 "num_new": 1 if match["new"] else 0}
-            if match["new"]:
-                matches_dict[matched][played]["num_new"] += 1
-        else:
-            matches_dict[matched] = {played: {"matches": [{"username": match["user"].username,
-                                                           "new": match["new"]}],
-                                              "num_new": 1 if match["new"] else 0}}
+    # viewing the page updates the "known" and "mark_new" status of all the matches, as described
+    # in match_details above - but with two UPDATEs rather than one per match. The order matters,
+    # as matches which have only just become known are still displayed as new.
+    my_matches = Match.objects.filter(requesting_user=request.user)
+    my_matches.filter(known=True, mark_new=True).update(mark_new=False)
+    if my_matches.filter(known=False).update(known=True):
+        matches_changed.send(sender=Match, user_ids=[request.user.pk])
+
+    matches_dict = summarise_matches(request.user, MATCHES_DISPLAY_LIMIT)
     
     return render(request, "accounts/matches.html", {"active": "dashboard",
                                                      "matches": matches_dict,
@@ -406,16 +326,22 @@ def matches_detail(request, played, want):
     """
     Simply fetches a list of all users matching a particular instrument preference
     """
-    # form array of all match details, organised by user
-    my_matches = Match.objects.filter(requesting_user=request.user,
-                                      requesting_instrument__instrument__instrument=played,
-                                      found_instrument__instrument__instrument=want)
-    match_info = [match_details(match) for match in my_matches.all()]
-    
-    for match in match_info:
-        match["location"] = get_profile_details(match["user"])["location"]
-
-    match_info.sort(key=lambda match: match["distance"])
+    # form array of all match details, organised by user. The instruments are only stored as
+    # (packed) ids on the matches, so are looked up first
+    names = dict(Instrument.objects.filter(instrument__in=[played, want])
+                                   .values_list("instrument", "pk"))
+    if played in names and want in names:
+        pair = Match.pack_pair(names[played], names[want])
+        my_matches = Match.objects.filter(requesting_user=request.user,
+                                          instrument_pairs__contains=[pair]) \
+                                  .select_related("found_user__profile") \
+                                  .order_by("distance")
+    else:
+        my_matches = Match.objects.none()
+    match_info = [match_details(match) for match in my_matches]
+    locations = cached_addresses([match["user"].profile.location for match in match_info])
+    for match, location in zip(match_info, locations):
+        match["location"] = location
 
     return render(request, "accounts/matches_detail.html", {"active": "dashboard", "played": played,
                                                             "want": want, "matches": match_info})
@@ -427,13 +353,17 @@ def profiles(request, username):
     A view to allow a specific user's public profile to be seen
     """
     user = get_object_or_404(User, username=username)
-    details = get_profile_details(user)
-    
     if user == request.user:
         return redirect(reverse("dashboard"))
-    
-    their_instruments = details["instruments"].all()
-    groups = Group.objects.filter(members__in=their_instruments)
+    details = get_profile_details(user)
+    snapshot = details["profile"]
+    try:
+        my_snapshot = get_snapshot(request.user.pk)
+    except Profile.DoesNotExist:
+        messages.error(request, "Oops, something went wrong! Try completing your profile first!")
+        return redirect(reverse("edit_profile"))
+
+    groups = snapshot["groups"]
     # get all groups that the user can be invited to. These are those that
     # meet the following conditions:
     # 1. the requesting user is a member of them
@@ -441,15 +371,19 @@ def profiles(request, username):
     # is desired by the group
     # 3. the above user is not already a member!
     # 4. they have not been invited yet either
-    my_instruments = get_profile_details(request.user)["instruments"].all()
-    their_invites = Invitation.objects.filter(invited_user=user)
-    
-    groups_to_invite = Group.objects.filter(members__in=my_instruments,
-                                            desired_instruments__user_plays__in=their_instruments) \
-                                    .exclude(members__in=their_instruments) \
-                                    .exclude(invitation__in=their_invites).distinct()
-    dist = distance(request.user.profile.location.coords[::-1],
-                    user.profile.location.coords[::-1]).miles
+    # The first and third come straight from the two users' group memberships, so only the
+    # remaining groups (if any) need checking in the database.
+    candidates = member_group_ids(request.user) - set(group["pk"] for group in groups)
+    if candidates:
+        desiring = Group.desired_instruments.through.objects.filter(
+            instrument__in=[instr["pk"] for instr in snapshot["instruments"]])
+        groups_to_invite = Group.objects.filter(pk__in=candidates) \
+                                        .filter(pk__in=desiring.values("group")) \
+                                        .exclude(invitation__invited_user=user) \
+                                        .order_by("name")
+    else:
+        groups_to_invite = Group.objects.none()
+    dist = distance(my_snapshot["coords"][::-1], snapshot["coords"][::-1]).miles
 
     args = {"active": "dashboard", "editable": False, "groups": groups,
             "groups_to_invite": groups_to_invite, "distance": dist}
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import calendar
+from datetime import datetime
+from django.db.models import Q
+from django.http import Http404
+from django.utils import timezone
+
+
+def to_cursor(date, pk):
+    """
+    Encodes a position in a list ordered by a date (and then the primary key, to separate
+    items with the same date) as a string which can be used in a URL
+    """
+    micros = calendar.timegm(date.utctimetuple()) * 1000000 + date.microsecond
+    return "%d_%d" % (micros, pk)
+
+
+def from_cursor(cursor):
+    """
+    The reverse of the above. Raises Http404 for anything which isn't a valid cursor - these
+    should only ever come from links on the site, so anything else is a mangled URL.
+    """
+    try:
+        micros, pk = [int(part) for part in cursor.split("_")]
+        date = datetime.utcfromtimestamp(micros // 1000000).replace(microsecond=micros % 1000000,
+                                                                    tzinfo=timezone.utc)
+    except (ValueError, OverflowError):
+        raise Http404("Page not found")
+    return date, pk
+
+
+class KeysetPage(object):
+    """
+    One page of results from a KeysetPaginator. "next_cursor" and "previous_cursor" are None
+    when there is no next or previous page.
+    """
+    def __init__(self, items, next_cursor, previous_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class KeysetPaginator(object):
+    """
+    Splits a queryset ordered by a date field into pages, where each page is found from the
+    position of the item at the edge of the page before (or after) it, rather than by counting
+    rows from the start with OFFSET. Each page is therefore a single query which can be answered
+    straight from an index on the date field (and primary key), however far through the list it
+    is - and adding new items doesn't shift the pages which have already been displayed.
+    """
+    def __init__(self, queryset, field, per_page, descending=False):
+        self.queryset = queryset
+        self.field = field
+        self.per_page = per_page
+        self.descending = descending
+
+    def _ordered(self, backwards):
+        descending = self.descending != backwards
+        prefix = "-" if descending else ""
+        return self.queryset.order_by(prefix + self.field, prefix + "pk"), descending
+
+    def _beyond(self, cursor, descending):
+        date, pk = from_cursor(cursor)
+        comparison = "lt" if descending else "gt"
+        return Q(**{self.field + "__" + comparison: date}) \
+             | Q(**{self.field: date, "pk__" + comparison: pk})
+
+    def _cursor(self, item):
+        return to_cursor(getattr(item, self.field), item.pk)
+
+    def page(self, after=None, before=None, last=False):
+        """
+        Returns the page of items following the "after" cursor, or preceding the "before" cursor,
+        or the last page if "last" is True - and otherwise the first page.
+        """
+        backwards = before is not None or last
+        queryset, descending = self._ordered(backwards)
+        cursor = before if backwards else after
+        if cursor is not None:
+            queryset = queryset.filter(self._beyond(cursor, descending))
+        items = list(queryset[:self.per_page + 1])
+        more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if backwards:
+            items.reverse()
+            has_previous, has_next = more, before is not None
+        else:
+            has_previous, has_next = after is not None, more
+
+        return KeysetPage(items,
+                          self._cursor(items[-1]) if has_next and items else None,
+                          self._cursor(items[0]) if has_previous and items else None)
+
+    def page_for_request(self, request):
+        """
+        Returns the page asked for by the "after", "before" or "last" GET parameters
+        """
+        return self.page(after=request.GET.get("after"), before=request.GET.get("before"),
+                         last="last" in request.GET)
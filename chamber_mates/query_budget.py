@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import re
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger(__name__)
+
+# how many of the most repeated statements to report
+TOP_STATEMENTS = 3
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LISTS = re.compile(r"IN \((?:\?, )*\?\)")
+
+
+def normalise(sql):
+    """
+    Replaces the values in a statement with "?", so that the statements run for each of a list
+    of objects (the sign of an N+1 problem) all look the same
+    """
+    return IN_LISTS.sub("IN (...)", LITERALS.sub("?", sql))
+
+
+class QuerySummary(object):
+    """
+    The number of queries run while it was recording, the total time they took (in
+    milliseconds), and the statements run more than once, most repeated first
+    """
+    def __init__(self, queries):
+        self.count = len(queries)
+        self.time = sum(float(query["time"]) for query in queries) * 1000
+        self.repeated = [(sql, times) for sql, times
+                         in Counter(normalise(query["sql"]) for query in queries)
+                                    .most_common(TOP_STATEMENTS)
+                         if times > 1]
+
+    def __unicode__(self):
+        text = "%d queries in %.1fms" % (self.count, self.time)
+        for sql, times in self.repeated:
+            text += "\n    %dx %s" % (times, sql)
+        return text
+
+    def __str__(self):
+        return unicode(self).encode("utf-8")
+
+
+class QueryBudgetMiddleware(object):
+    """
+    When settings.QUERY_LOGGING is on, logs a summary of the queries run for each request, by
+    the name of the url (see QuerySummary). Views with an entry in settings.QUERY_BUDGETS are
+    logged as warnings when they go over it.
+    Recording the queries costs a little time for each one, so this is normally left off in
+    production.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_LOGGING:
+            return self.get_response(request)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_response(request)
+        summary = QuerySummary(queries.captured_queries)
+        match = getattr(request, "resolver_match", None)
+        url_name = match.url_name if match else request.path_info
+        budget = settings.QUERY_BUDGETS.get(url_name)
+        if budget is not None and summary.count > budget:
+            logger.warning("%s: over its budget of %d queries - %s", url_name, budget, summary)
+        else:
+            logger.info("%s: %s", url_name, summary)
+        return response
+
+
+class QueryBudgetMixin(object):
+    """
+    For TestCases: adds assertQueryBudget, to check that a view doesn't run more queries than
+    its entry in settings.QUERY_BUDGETS (or a given number):
+
+        with self.assertQueryBudget("inbox"):
+            self.client.get(reverse("inbox"))
+    """
+    def assertQueryBudget(self, budget):
+        return _AssertQueryBudgetContext(self, budget)
+
+
+class _AssertQueryBudgetContext(CaptureQueriesContext):
+    def __init__(self, test_case, budget):
+        self.test_case = test_case
+        self.name = budget
+        self.budget = settings.QUERY_BUDGETS[budget] if isinstance(budget, basestring) else budget
+        super(_AssertQueryBudgetContext, self).__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super(_AssertQueryBudgetContext, self).__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        summary = QuerySummary(self.captured_queries)
+        self.test_case.assertLessEqual(summary.count, self.budget,
+                                       "%s ran over its budget of %d queries: %s"
+                                       % (self.name, self.budget, summary))
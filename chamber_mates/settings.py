@@ -12,6 +12,11 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 
 import os
 
+# manage.py still defaults to this module, so the tests, the management commands and the
+# process_match_jobs worker all run with it, while the deployed site uses the settings package
+# (see wsgi.py). Every setting the code reads must therefore be defined both here and in
+# settings/base.py.
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -50,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "chamber_mates.query_budget.QueryBudgetMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,9 +78,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
-                "user_messages.context_processors.messages",
-                "accounts.context_processors.unknown_matches",
-                "groups.context_processors.new_invites"
+                "accounts.context_processors.notifications",
             ],
         },
     },
@@ -153,3 +157,89 @@ MAP_WIDGETS = {
 # Stripe environment variables
 STRIPE_PUBLISHABLE = os.getenv("STRIPE_PUBLISHABLE", "pk_test_AjjVRbuE0roWmK3bOFkTXrWl")
 STRIPE_SECRET = os.getenv("STRIPE_SECRET", "sk_test_hSOzgeTqJC6jlTq12c3L9Gdq")
+
+# Where the Google Maps and Stripe APIs are called. These are left unset to use the real services,
+# and pointed at the stand-in servers in loadtest/fake_services.py for load testing
+GOOGLE_MAPS_BASE_URL = os.getenv("GOOGLE_MAPS_BASE_URL")
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")
+
+# Matching: when True, instrument/standard compatibility is checked against an in-memory
+# NumPy index (accounts/match_index.py) rather than in the database query
+MATCH_INDEX = os.getenv("MATCH_INDEX") == "True"
+# and when True, the users within range are found from an in-memory grid of every profile's
+# location (accounts/spatial_index.py) rather than with a distance query. Like the index above,
+# each process has its own copy, which only sees the profile changes made in that process - so
+# the changed users are logged for the process_match_jobs worker to reload before each batch of
+# jobs (see accounts.jobs.IndexRefresher).
+SPATIAL_INDEX = os.getenv("SPATIAL_INDEX") == "True"
+# when True, the players with compatible instruments are found first, from an in-memory inverted
+# index (accounts/instrument_index.py), and only those among the users in range are kept - with
+# the same one-copy-per-process caveat, and the same refreshing by the worker, as the other two
+INSTRUMENT_INDEX = os.getenv("INSTRUMENT_INDEX") == "True"
+# how often (in seconds) the worker rebuilds its copies of the indexes from scratch, to pick up
+# bulk changes which don't send signals (such as generate_population)
+INDEX_REBUILD_INTERVAL = int(os.getenv("INDEX_REBUILD_INTERVAL", 3600))
+
+# Reverse-geocode cache (accounts.models.GeocodedLocation): locations are rounded to this many
+# decimal places (3 is roughly 100m), and addresses are looked up again after this many days
+# by the refresh_geocodes management command
+GEOCODE_CACHE_PRECISION = 3
+GEOCODE_CACHE_MAX_AGE = 90
+
+# The backend used to look up addresses for the cache above. The offline geocoder needs no network
+# access (for staging and CI), and uses the gazetteer file given below - a CSV of town name,
+# region, latitude and longitude
+GEOCODER_BACKEND = os.getenv("GEOCODER_BACKEND", "accounts.geocoders.GoogleGeocoder")
+GEOCODER_GAZETTEER = os.getenv("GEOCODER_GAZETTEER",
+                               os.path.join(BASE_DIR, "accounts", "data", "gazetteer.csv"))
+
+# how long (in seconds) each user's notification counts may be cached for. The cache is cleared
+# whenever the counts change, but with the default per-process cache other processes only see the
+# change once this has expired - so a shared cache should be configured if it is made much longer
+NOTIFICATION_CACHE_TIMEOUT = 30
+
+# when True, saving a profile queues the recalculation of the user's matches for the
+# process_match_jobs worker, instead of doing it before responding
+MATCH_JOBS_ASYNC = os.getenv("MATCH_JOBS_ASYNC", "True") == "True"
+
+# how long (in seconds) a worker may hold a match job before it's assumed to have died, and the
+# job is given to another - this must be longer than any one batch of jobs takes to run
+MATCH_JOB_CLAIM_TIMEOUT = int(os.getenv("MATCH_JOB_CLAIM_TIMEOUT", 600))
+
+# username autocompletion: the most usernames offered for one search, and how long (in seconds)
+# each process remembers the results for a prefix
+USERNAME_SEARCH_LIMIT = 10
+USERNAME_SEARCH_CACHE_TIMEOUT = 60
+
+# how long (in seconds) a snapshot of a user's public profile may be cached for. As with the
+# notification counts, other processes only see a change once this has expired unless a shared
+# cache is configured
+PROFILE_CACHE_TIMEOUT = 300
+
+# when True, the number of queries (and time spent on them) for each request is logged by url
+# name, with any statements repeated in it - see chamber_mates/query_budget.py. Views which
+# run more queries than their budget here are logged as warnings, and fail their tests.
+QUERY_LOGGING = os.getenv("QUERY_LOGGING", "False") == "True"
+QUERY_BUDGETS = {
+    "matches": 12,
+    "group_detail": 15,
+    "inbox": 10,
+    "user_profile": 20,
+    "edit_profile": 18,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'chamber_mates': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
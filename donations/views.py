@@ -11,6 +11,8 @@ import stripe
 from .forms import DonationForm
 
 stripe.api_key = settings.STRIPE_SECRET
+if settings.STRIPE_API_BASE:
+    stripe.api_base = settings.STRIPE_API_BASE
 
 # Create your views here.
 @login_required(login_url=reverse_lazy("login"))
@@ -36,6 +38,11 @@ def donate(request):
                                                Please check your card details and try again.""")
             except stripe.error.CardError:
                 messages.error(request, "Sorry, your card was declined.")
+            except stripe.error.StripeError:
+                # Stripe being unavailable, or limiting our requests: the card hasn't been charged,
+                # so the user can simply try again
+                messages.error(request, """Sorry, we couldn't take your payment just now.
+                                           Please try again in a few minutes.""")
     else:
         form = DonationForm(initial={"amount":5})
 
@@ -6,3 +6,6 @@ from django.apps import AppConfig
 
 class GroupsConfig(AppConfig):
     name = 'groups'
+
+    def ready(self):
+        from . import signals
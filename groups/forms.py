@@ -1,5 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.utils.http import urlencode
 from ajax_select.helpers import make_ajax_field
 from ajax_select.fields import AutoCompleteField
 from accounts.models import UserInstrument, Instrument
@@ -61,11 +63,15 @@ class InvitationForm(forms.ModelForm):
         self.fields["group"].widget.choices = self.fields["group"].choices
         self.fields["invited_instrument"].empty_label = None
         self.fields["invited_instrument"].widget.choices = self.fields["invited_instrument"].choices
-        # need to add the invited_user field separately as an AutoCompleteField
+        # need to add the invited_user field separately as an AutoCompleteField, which only
+        # finds players of the instrument (passed on to the lookup channel in its url)
         if instr:
-            self.fields["invited_user"] = AutoCompleteField("user_playing_"+instr,
+            source = "%s?%s" % (reverse("ajax_lookup", kwargs={"channel": "user_playing"}),
+                                urlencode({"instrument": instr}))
+            self.fields["invited_user"] = AutoCompleteField("user_playing",
                                                             label="User to invite",
-                                                            help_text=None)
+                                                            help_text=None,
+                                                            plugin_options={"source": source})
         for field_name in exclude:
             try:
                 del self.fields[field_name]
@@ -1,54 +1,25 @@
-import os
-from django.contrib.auth.models import User
 from ajax_select import register, LookupChannel
-from accounts.models import UserInstrument, Instrument
+from accounts.lookups import UsernameLookup
+from accounts.models import UserInstrument
 
 @register("user_to_invite")
-class UserLookup(LookupChannel):
-    model = User
-
-    def get_query(self, q, request):
-        return self.model.objects.filter(username__istartswith=q)
-
-    def format_match(self, user):
-        return "<span class='autocomplete-option'>%s</span>" % user.username
-
-    def check_auth(self, request):
-        if request.user.is_authenticated() :
-            return True
-
-
-# register a separate LookupChannel for each instrument. Required for the form
-# where users are only invited who play the pre-selected instrument.
-# I eventually found the right way to do this thanks to zondo's reply on the
-# following StackOverflow thread:
-# https://stackoverflow.com/questions/36159455/create-multiple-classes-from-list-of-strings
-instrument_lookups = {}
-# the following code caused some issues in deployment, because the code in this file is run
-# when the application starts up, and therefore causes an error if the Instrument table does
-# not currently exist (for example when first deployed). This can be solved by commenting out
-# the loop before deploying, then running migrations and uncommenting - but in order to avoid
-# repeate commits it is easiest to control this by setting the value of an evironment variable
-if not os.getenv("DISABLE_INSTRUMENT_LOOKUP"):
-    for instr in Instrument.objects.all():
-        # need to do the (manual) Python equivalent of a Javascript IIFE, to make sure that
-        # the get_query method uses the correct value of instr each time through the loop.
-        # (Otherwise all classes end up using whatever the last value in the loop is.)
-        def make_lookup_class(instr_obj):
-            @register("user_playing_"+instr_obj.instrument)
-            class UserLookupWithInstrument(UserLookup):
-                model = User
-
-                def get_query(self, q, request):
-                    user_instrs = UserInstrument.objects.filter(instrument__instrument=instr_obj.instrument)
-                    users_playing = self.model.objects.filter(userinstrument__pk__in=user_instrs)
-                    return users_playing.filter(username__istartswith=q)
-            
-            name = "UserLookupWith"+instr_obj.instrument
-            UserLookupWithInstrument.__name__ = str(name)
-            instrument_lookups[name] = UserLookupWithInstrument
-
-        make_lookup_class(instr)
+class UserLookup(UsernameLookup):
+    pass
+
+
+@register("user_playing")
+class UserPlayingLookup(UsernameLookup):
+    """
+    Finds the users who play a particular instrument - for the form where users are only
+    invited who play the pre-selected instrument. The instrument's name is passed as the
+    "instrument" parameter of the lookup url (see InvitationForm).
+    """
+    def get_users(self, request):
+        players = UserInstrument.objects.filter(instrument__instrument=request.GET.get("instrument"))
+        return self.model.objects.filter(pk__in=players.values("user"))
+
+    def get_scope(self, request):
+        return "playing " + request.GET.get("instrument", "")
 
 
 @register("instrument")
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from .models import Group, Membership
+
+
+def sync_groups(group_ids):
+    """
+    Brings the Membership rows for the given groups into line with their members, returning the
+    set of ids of the users who have joined or left any of them
+    """
+    wanted = set(Group.members.through.objects.filter(group__in=group_ids)
+                 .values_list("userinstrument__user", "group"))
+    existing = dict(((user, group), pk) for pk, user, group
+                    in Membership.objects.filter(group__in=group_ids)
+                                         .values_list("pk", "user", "group"))
+    stale = [key for key in existing if key not in wanted]
+    new = [key for key in wanted if key not in existing]
+    Membership.objects.filter(pk__in=[existing[key] for key in stale]).delete()
+    Membership.objects.bulk_create([Membership(user_id=user, group_id=group)
+                                    for user, group in new])
+    return set(user for user, group in stale + new)
+
+
+def member_group_ids(user):
+    """
+    Returns the set of ids of the groups the user is a member of. This is remembered on the
+    user object, so for request.user it is only looked up once per request.
+    """
+    if not hasattr(user, "_member_group_ids"):
+        user._member_group_ids = set(Membership.objects.filter(user=user)
+                                     .values_list("group", flat=True))
+    return user._member_group_ids
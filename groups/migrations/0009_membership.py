@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_memberships(apps, schema_editor):
+    Group = apps.get_model("groups", "Group")
+    Membership = apps.get_model("groups", "Membership")
+    pairs = Group.members.through.objects.values_list("userinstrument__user", "group").distinct()
+    Membership.objects.bulk_create([Membership(user_id=user, group_id=group) for user, group in pairs])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('groups', '0008_group_description'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Membership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='groups.Group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='membership',
+            unique_together=set([('user', 'group')]),
+        ),
+        migrations.RunPython(fill_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_statistics(apps, schema_editor):
+    GroupThread = apps.get_model("groups", "GroupThread")
+    GroupMessage = apps.get_model("groups", "GroupMessage")
+    for thread in GroupThread.objects.all():
+        messages = GroupMessage.objects.filter(thread=thread)
+        latest = messages.order_by("-posted_date", "-id").first()
+        thread.reply_count = max(messages.count() - 1, 0)
+        if latest is not None:
+            thread.last_post = latest.posted_date
+            thread.last_post_author_id = latest.author_id
+        thread.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('groups', '0009_membership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupthread',
+            name='last_post_author',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='last_post_in', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='groupthread',
+            name='reply_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='groupthread',
+            index_together=set([('group', 'last_post', 'id')]),
+        ),
+        migrations.RunPython(fill_statistics, migrations.RunPython.noop),
+    ]
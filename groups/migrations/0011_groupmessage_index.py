@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0010_thread_statistics'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='groupmessage',
+            index_together=set([('thread', 'posted_date', 'id')]),
+        ),
+    ]
@@ -21,6 +21,23 @@ class Group(models.Model):
         return self.name
 
 
+class Membership(models.Model):
+    """
+    The users who are members of each group. This duplicates what can be worked out from
+    Group.members, which is kept in terms of UserInstruments, but allows membership of a group
+    to be checked with a single lookup on an index. It is kept up to date with Group.members by
+    the signal handlers in signals.py.
+    """
+    user = models.ForeignKey(User)
+    group = models.ForeignKey(Group)
+
+    class Meta:
+        unique_together = (("user", "group"),)
+
+    def __unicode__(self):
+        return "%s in %s" % (self.user, self.group)
+
+
 class Invitation(models.Model):
     """
     A model to hold the information about invitations which are made for users to join
@@ -40,12 +57,22 @@ class Invitation(models.Model):
 
 class GroupThread(models.Model):
     """
-    A model to describe a thread on a group's private forum
+    A model to describe a thread on a group's private forum.
+    The last_post, last_post_author and reply_count fields are worked out from the thread's
+    messages, and kept up to date by the signal handlers in signals.py, so that the list of
+    threads can be displayed without looking at the messages at all.
     """
     group = models.ForeignKey(Group)
     name = models.CharField(max_length=200)
     started_by = models.ForeignKey(User)
     last_post = models.DateTimeField(default=timezone.now)
+    last_post_author = models.ForeignKey(User, null=True, on_delete=models.SET_NULL,
+                                         related_name="last_post_in")
+    reply_count = models.IntegerField(default=0)
+
+    class Meta:
+        # for the (keyset) pagination of each group's threads, newest first
+        index_together = (("group", "last_post", "id"),)
 
     def __unicode__(self):
         return self.name
@@ -60,5 +87,9 @@ class GroupMessage(models.Model):
     message = models.TextField()
     posted_date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # for the (keyset) pagination of the messages in each thread, oldest first
+        index_together = (("thread", "posted_date", "id"),)
+
     def __unicode__(self):
         return self.message[:30]
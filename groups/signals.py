@@ -0,0 +1,61 @@
+from django.db.models.signals import m2m_changed, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from accounts import profile_cache
+from accounts.models import UserInstrument
+from .models import Group, Membership, GroupThread, GroupMessage
+from .membership import sync_groups
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps the Membership table up to date whenever the members of a group change (along with
+    the cached profiles, which list each user's groups). When the change is made from the
+    UserInstrument side, the groups affected are those in pk_set - except when they are cleared,
+    when they have to be found before the clear happens.
+    """
+    if not reverse:
+        if action.startswith("post_"):
+            profile_cache.forget(sync_groups([instance.pk]))
+    elif action == "pre_clear":
+        instance._cleared_groups = list(instance.group_set.values_list("pk", flat=True))
+    elif action == "post_clear":
+        profile_cache.forget(sync_groups(instance._cleared_groups))
+    elif action.startswith("post_"):
+        profile_cache.forget(sync_groups(pk_set))
+
+
+@receiver(post_delete, sender=UserInstrument)
+def instrument_deleted(sender, instance, **kwargs):
+    """
+    Deleting a UserInstrument removes it from its groups without sending m2m_changed
+    """
+    profile_cache.forget(sync_groups(list(Membership.objects.filter(user=instance.user_id)
+                                          .values_list("group", flat=True))))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    """
+    The name of a group is shown on its members' profiles
+    """
+    profile_cache.forget(Membership.objects.filter(group=instance).values_list("user", flat=True))
+
+
+def update_thread_statistics(thread_id):
+    """
+    Works out the reply count and details of the last post for a thread from its messages
+    """
+    messages = GroupMessage.objects.filter(thread=thread_id)
+    statistics = {"reply_count": max(messages.count() - 1, 0)}
+    latest = messages.order_by("-posted_date", "-id").first()
+    if latest is not None:
+        statistics.update(last_post=latest.posted_date, last_post_author=latest.author_id)
+    GroupThread.objects.filter(pk=thread_id).update(**statistics)
+
+
+@receiver(post_save, sender=GroupMessage)
+@receiver(post_delete, sender=GroupMessage)
+def group_message_changed(sender, instance, **kwargs):
+    update_thread_statistics(instance.thread_id)
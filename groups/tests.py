@@ -1,6 +1,131 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import json
+from datetime import timedelta
 from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from accounts import usernames
+from accounts.models import Instrument, Standard, UserInstrument
+from chamber_mates.pagination import KeysetPaginator
+from chamber_mates.query_budget import QueryBudgetMixin
+from models import Group, Membership, GroupThread, GroupMessage
+from views import is_member, MESSAGES_PER_PAGE
 
 # Create your tests here.
+class MembershipTest(TestCase):
+    """
+    Tests that the Membership table follows the members of each group
+    """
+    def test_membership_follows_members(self):
+        user = User.objects.create_user(username="alice", password="secretpwd")
+        violin = UserInstrument.objects.create(user=user,
+                                               instrument=Instrument.objects.create(instrument="violin"),
+                                               standard=Standard.objects.create(standard="good"))
+        group = Group.objects.create(name="Quartet")
+        self.assertFalse(is_member(User.objects.get(pk=user.pk), group))
+        group.members.add(violin)
+        self.assertTrue(is_member(User.objects.get(pk=user.pk), group))
+        violin.delete()
+        self.assertFalse(is_member(User.objects.get(pk=user.pk), group))
+        self.assertEqual(Membership.objects.count(), 0)
+
+
+class ThreadTest(QueryBudgetMixin, TestCase):
+    """
+    Tests the statistics stored on each thread, and the paging of a group's threads
+    """
+    def test_thread_statistics(self):
+        alice = User.objects.create_user(username="alice", password="secretpwd")
+        bob = User.objects.create_user(username="bob", password="secretpwd")
+        thread = GroupThread.objects.create(group=Group.objects.create(name="Quartet"),
+                                            name="Rehearsals", started_by=alice)
+        GroupMessage.objects.create(thread=thread, author=alice, message="When?")
+        reply = GroupMessage.objects.create(thread=thread, author=bob, message="Tuesday")
+        thread.refresh_from_db()
+        self.assertEqual(thread.reply_count, 1)
+        self.assertEqual(thread.last_post, reply.posted_date)
+        self.assertEqual(thread.last_post_author, bob)
+        reply.delete()
+        thread.refresh_from_db()
+        self.assertEqual(thread.reply_count, 0)
+        self.assertEqual(thread.last_post_author, alice)
+
+    def test_thread_pages(self):
+        alice = User.objects.create_user(username="alice", password="secretpwd")
+        group = Group.objects.create(name="Quartet")
+        now = timezone.now()
+        for num in range(5):
+            GroupThread.objects.create(group=group, name="Thread %d" % num, started_by=alice,
+                                       last_post=now - timedelta(days=num))
+        paginator = KeysetPaginator(GroupThread.objects.filter(group=group), "last_post", 2,
+                                    descending=True)
+        first = paginator.page()
+        self.assertEqual([thread.name for thread in first], ["Thread 0", "Thread 1"])
+        self.assertIsNone(first.previous_cursor)
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual([thread.name for thread in second], ["Thread 2", "Thread 3"])
+        last = paginator.page(after=second.next_cursor)
+        self.assertEqual([thread.name for thread in last], ["Thread 4"])
+        self.assertIsNone(last.next_cursor)
+        self.assertEqual([thread.name for thread in paginator.page(before=last.previous_cursor)],
+                         ["Thread 2", "Thread 3"])
+
+    def test_reply_goes_to_latest_page(self):
+        alice = User.objects.create_user(username="alice", password="secretpwd")
+        violin = UserInstrument.objects.create(user=alice,
+                                               instrument=Instrument.objects.create(instrument="violin"),
+                                               standard=Standard.objects.create(standard="good"))
+        group = Group.objects.create(name="Quartet")
+        group.members.add(violin)
+        thread = GroupThread.objects.create(group=group, name="Rehearsals", started_by=alice)
+        for num in range(MESSAGES_PER_PAGE + 5):
+            GroupMessage.objects.create(thread=thread, author=alice, message="Message %d" % num)
+        url = reverse("view_thread", kwargs={"group_id": group.pk, "thread_id": thread.pk})
+        self.client.login(username="alice", password="secretpwd")
+
+        response = self.client.post(url, {"message": "The newest message"})
+        new_message = GroupMessage.objects.get(message="The newest message")
+        self.assertRedirects(response, url + "?last#msg-%d" % new_message.pk,
+                             fetch_redirect_response=False)
+        self.assertNotContains(self.client.get(url), "The newest message")
+        latest = self.client.get(url + "?last")
+        self.assertContains(latest, "The newest message")
+        self.assertEqual(len(latest.context["thread_messages"]), MESSAGES_PER_PAGE)
+
+    def test_group_page_query_budget(self):
+        good = Standard.objects.create(standard="good")
+        violin = Instrument.objects.create(instrument="violin")
+        group = Group.objects.create(name="Orchestra")
+        group.desired_instruments.add(Instrument.objects.create(instrument="cello"))
+        for num in range(6):
+            player = User.objects.create_user(username="player%d" % num, password="secretpwd")
+            group.members.add(UserInstrument.objects.create(user=player, instrument=violin,
+                                                            standard=good))
+            GroupThread.objects.create(group=group, name="Thread %d" % num, started_by=player,
+                                       last_post_author=player)
+        self.client.login(username="player0", password="secretpwd")
+        with self.assertQueryBudget("group_detail"):
+            self.client.get(reverse("group", kwargs={"id": group.pk}))
+
+
+class LookupTest(TestCase):
+    """
+    Tests the autocompletion of players of a given instrument
+    """
+    def test_user_playing_lookup(self):
+        usernames.cache.clear()
+        good = Standard.objects.create(standard="good")
+        violin = Instrument.objects.create(instrument="violin")
+        for username, instrument in [("alice", violin), ("alan", violin),
+                                     ("albert", Instrument.objects.create(instrument="cello"))]:
+            UserInstrument.objects.create(user=User.objects.create_user(username=username,
+                                                                        password="secretpwd"),
+                                          instrument=instrument, standard=good)
+        self.client.login(username="alice", password="secretpwd")
+        response = self.client.get(reverse("ajax_lookup", kwargs={"channel": "user_playing"}),
+                                   {"term": "al", "instrument": "violin"})
+        self.assertEqual([result["value"] for result in json.loads(response.content)],
+                         ["alan", "alice"])
@@ -10,24 +10,24 @@ from django.contrib.auth.models import User
 from django.template.context_processors import csrf
 from django.db import IntegrityError
 from django.http import Http404
-from django.utils import timezone
 from accounts.models import UserInstrument, Instrument
+from chamber_mates.pagination import KeysetPaginator
 from .models import Group, Invitation, GroupThread, GroupMessage
+from .membership import member_group_ids
 from .forms import GroupSetupForm, InvitationForm, DecideOnInvitation, GroupUpdateForm, GroupMessageForm
 
+THREADS_PER_PAGE = 10
+MESSAGES_PER_PAGE = 20
+
 
 def is_member(user, group):
     """
     In a couple of view functions below, it is required to check whether a given user
     is a member of a particular group. Since the group object defines its members field
-    via the UserInstrument model rather than the User model, this takes a number of lines
-    of code and so has been factored out to a separate function to avoid repetition.
+    via the UserInstrument model rather than the User model, this is looked up in the
+    Membership table instead (once per request - see membership.py).
     """
-    instruments_played = UserInstrument.objects.filter(user=user)
-    for instr in instruments_played:
-        if group in Group.objects.filter(members__in=[instr]):
-            return True
-    return False
+    return group.pk in member_group_ids(user)
 
 
 # Create your views here.
@@ -36,10 +36,7 @@ def my_groups(request):
     """
     A view to fetch all groups which the requesting user is part of
     """
-    instruments = UserInstrument.objects.filter(user=request.user)
-    groups = []
-    for instr in instruments:
-        groups.extend(Group.objects.filter(members__in=[instr]))
+    groups = Group.objects.filter(membership__user=request.user)
     invited_groups = Group.objects.filter(invitation__invited_user__in=[request.user]).distinct()
     return render(request, "groups/my-groups.html", {"active": "dashboard", "groups": groups,
                                                      "invited": invited_groups})
@@ -158,7 +155,7 @@ def specific_invite(request, group_id, instr_name=None, user_id=None):
             else:
                 invitation.invited_user = form.cleaned_data["invited_user"]
             # display an error message if you are trying to invite someone already in the group
-            if group in Group.objects.filter(members__user__in=[invitation.invited_user]):
+            if is_member(invitation.invited_user, group):
                 form.add_error("invited_user", "%s is already in this group!" \
                                %invitation.invited_user.username)                
             else:
@@ -204,12 +201,15 @@ def group_detail(request, id):
     depending on if the current user is a member of that group or not.
     It also can include a "mini-form" for users invited to that group to select if they
     accept the invitation or not.
+    The group's threads are shown a page at a time, most recently active first.
     """
     group = get_object_or_404(Group, pk=id)
     invites = Invitation.objects.filter(group=group)
     my_invites = invites.filter(invited_user=request.user)
     other_invites = invites.exclude(invited_user=request.user)
-    threads = GroupThread.objects.filter(group=group).order_by("-last_post")
+    threads = KeysetPaginator(GroupThread.objects.filter(group=group)
+                                             .select_related("started_by", "last_post_author"),
+                              "last_post", THREADS_PER_PAGE, descending=True).page_for_request(request)
 
     if request.method == "POST":
         mini_form = DecideOnInvitation(request.POST)
@@ -238,8 +238,14 @@ def group_detail(request, id):
     else:
         mini_form = DecideOnInvitation()
 
+    # everything the template lists is fetched here, with the related objects it displays,
+    # rather than looked up again for each row
+    members = group.members.select_related("user", "instrument")
+    all_invites = invites.select_related("invited_user", "invited_instrument")
     args = {"active": "dashboard", "group": group, "member": is_member(request.user, group),
-            "my_invites": my_invites, "other_invites": other_invites,
+            "members": members, "desired_instruments": list(group.desired_instruments.all()),
+            "my_invites": [invite for invite in all_invites if invite.invited_user_id == request.user.pk],
+            "other_invites": [invite for invite in all_invites if invite.invited_user_id != request.user.pk],
             "threads": threads, "mini_form": mini_form}
     args.update(csrf(request))
     return render(request, "groups/detail.html", args)
@@ -310,15 +316,15 @@ def new_thread(request, group_id):
 @login_required(login_url=reverse_lazy("login"))
 def view_thread(request, group_id, thread_id):
     """
-    A view to display the messages in a given group thread
+    A view to display the messages in a given group thread, a page at a time. Adding "?last"
+    to the url shows the latest page - which is where a new post is found after it is made.
     """
     group = get_object_or_404(Group, pk=group_id)
     if not is_member(request.user, group):
         raise PermissionDenied
     thread = get_object_or_404(GroupThread, pk=thread_id)
-    if thread.group != group:
+    if thread.group_id != group.pk:
         raise Http404("That thread doesn't belong to this group!")
-    thread_messages = thread.groupmessage_set.order_by("posted_date")
 
     if request.method == "POST":
         form = GroupMessageForm(request.POST, new_thread=False)
@@ -326,19 +332,20 @@ def view_thread(request, group_id, thread_id):
             new_message = form.save(commit=False)
             new_message.thread = thread
             new_message.author = request.user
+            # saving the message updates the thread's "last post" details (see signals.py)
             new_message.save()
-            # update "last post" property of thread!
-            thread.last_post = timezone.now()
-            thread.save()
-            # no need to redirect, as want to view the new message as part of the thread
-            # but do want to empty the contents of the form!
-            form = GroupMessageForm(new_thread=False)
+            # the new message is the latest one, so is always on the last page
+            return redirect(reverse("view_thread", kwargs={"group_id": group_id,
+                                                           "thread_id": thread_id})
+                            + "?last#msg-%d" % new_message.pk)
         else:
             messages.error(request, "Please correct the indicated errors and try again")
     else:
         form = GroupMessageForm(new_thread=False)
-    
-    args = {"active": "dashboard", "thread": thread,
+
+    thread_messages = KeysetPaginator(thread.groupmessage_set.select_related("author"),
+                                      "posted_date", MESSAGES_PER_PAGE).page_for_request(request)
+    args = {"active": "dashboard", "group": group, "thread": thread,
             "thread_messages": thread_messages, "form": form}
     args.update(csrf(request))
     return render(request, "groups/thread.html", args)
@@ -0,0 +1,195 @@
+"""
+Stand-in servers for the two external APIs the site calls - Stripe's charges (on the donations
+page) and Google's reverse geocoding - so that the site can be load tested without touching the
+real services. Page requests never wait on Google: saving a profile only adds its location to
+the geocode cache, and the addresses are looked up by the refresh_geocodes management command
+(see accounts/geocoding.py). So the maps stand-in is only called when that command is run against
+it, alongside the load test. Each server runs on its own port:
+
+    python loadtest/fake_services.py maps --port 8001 --latency 150
+    python loadtest/fake_services.py stripe --port 8002 --latency 400 --decline-rate 0.05
+
+and the site is pointed at them with the GOOGLE_MAPS_BASE_URL and STRIPE_API_BASE settings
+(environment variables), e.g. GOOGLE_MAPS_BASE_URL=http://localhost:8001 and
+STRIPE_API_BASE=http://localhost:8002.
+
+Every response is delayed by a random time around --latency, --error-rate of them fail as a
+server error would, and beyond --rate-limit requests a second they are refused in the way the
+real service refuses them (OVER_QUERY_LIMIT for Google, 429 for Stripe).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class RateLimiter(object):
+    """
+    A token bucket: allows "rate" requests a second on average, in bursts of up to "rate" at once.
+    A rate of 0 means no limit.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """
+    Shared by both services: delays each response, and decides whether it is to be rate limited
+    or fail, before handing over to the service's own handle_* method
+    """
+    protocol_version = "HTTP/1.1"
+
+    def respond(self, status, body):
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def dispatch(self, method):
+        options = self.server.options
+        time.sleep(max(0, random.gauss(options.latency, options.jitter)) / 1000.0)
+        url = urlparse.urlparse(self.path)
+        if method == "POST":
+            length = int(self.headers.getheader("Content-Length") or 0)
+            params = urlparse.parse_qs(self.rfile.read(length))
+        else:
+            params = urlparse.parse_qs(url.query)
+        params = dict((name, values[0]) for name, values in params.items())
+
+        if not self.server.limiter.allow():
+            self.rate_limited()
+        elif random.random() < options.error_rate:
+            self.server_error()
+        else:
+            self.handle_request(method, url.path, params)
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def log_message(self, format, *args):
+        if not self.server.options.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MapsHandler(FakeServiceHandler):
+    """
+    The reverse geocoding endpoint of the Google Maps API. The addresses are made up from the
+    coordinates, in the same shape as Google's (the site only keeps the last two parts).
+    """
+    def rate_limited(self):
+        self.respond(200, {"status": "OVER_QUERY_LIMIT", "results": [],
+                           "error_message": "You have exceeded your rate-limit for this API."})
+
+    def server_error(self):
+        self.respond(500, {"status": "UNKNOWN_ERROR", "results": []})
+
+    def handle_request(self, method, path, params):
+        if path != "/maps/api/geocode/json" or "latlng" not in params:
+            self.respond(200, {"status": "INVALID_REQUEST", "results": []})
+            return
+        try:
+            latitude, longitude = [float(coord) for coord in params["latlng"].split(",")]
+        except ValueError:
+            self.respond(200, {"status": "INVALID_REQUEST", "results": []})
+            return
+        place = "Testville %d-%d" % (int(latitude * 10), int(longitude * 10))
+        self.respond(200, {"status": "OK", "results": [
+            {"formatted_address": "1 High Street, %s, UK" % place, "types": ["street_address"]},
+            {"formatted_address": "%s, UK" % place, "types": ["locality"]},
+            {"types": ["country"]},
+        ]})
+
+
+class StripeHandler(FakeServiceHandler):
+    """
+    The charges endpoint of the Stripe API. --decline-rate of the cards are declined.
+    """
+    def error(self, status, error_type, message, **details):
+        details.update({"type": error_type, "message": message})
+        self.respond(status, {"error": details})
+
+    def rate_limited(self):
+        self.error(429, "rate_limit_error", "Too many requests hit the API too quickly.")
+
+    def server_error(self):
+        self.error(500, "api_error", "An unexpected error occurred.")
+
+    def handle_request(self, method, path, params):
+        if method != "POST" or path != "/v1/charges":
+            self.error(404, "invalid_request_error", "Unrecognized request URL.")
+        elif "amount" not in params or not params.get("card", params.get("source")):
+            self.error(400, "invalid_request_error", "Missing required param.")
+        elif random.random() < self.server.options.decline_rate:
+            self.error(402, "card_error", "Your card was declined.", code="card_declined")
+        else:
+            self.respond(200, {"id": "ch_fake%016x" % random.getrandbits(64), "object": "charge",
+                               "amount": int(params["amount"]),
+                               "currency": params.get("currency", "usd").lower(),
+                               "description": params.get("description"),
+                               "created": int(time.time()), "livemode": False,
+                               "paid": True, "status": "succeeded"})
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, options, handler):
+        HTTPServer.__init__(self, ("", options.port), handler)
+        self.options = options
+        self.limiter = RateLimiter(options.rate_limit)
+
+
+HANDLERS = {"maps": MapsHandler, "stripe": StripeHandler}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a stand-in for Google Maps or Stripe")
+    parser.add_argument("service", choices=sorted(HANDLERS))
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=100,
+                        help="The average time each response is delayed by, in milliseconds")
+    parser.add_argument("--jitter", type=float, default=30,
+                        help="The standard deviation of the delay, in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="The fraction of requests which fail with a server error")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="The most requests a second before they are refused (0 for no limit)")
+    parser.add_argument("--decline-rate", type=float, default=0,
+                        help="For Stripe, the fraction of charges where the card is declined")
+    parser.add_argument("--quiet", action="store_true", help="Don't log each request")
+    options = parser.parse_args()
+
+    server = FakeServer(options, HANDLERS[options.service])
+    print("Fake %s API listening on port %d" % (options.service, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
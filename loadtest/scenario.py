@@ -0,0 +1,178 @@
+"""
+A load test of the site as a whole, running behind gunicorn, e.g.
+
+    gunicorn chamber_mates.wsgi:application --workers 4 --bind 127.0.0.1:8000
+    python loadtest/scenario.py http://127.0.0.1:8000 --users 20 --iterations 10
+
+(with the site pointed at the stand-ins in fake_services.py for Google Maps and Stripe, and
+populated with the generate_population management command, whose users all share one password).
+Of the two, only Stripe is called by the pages visited here: Google is only called by the
+refresh_geocodes management command, which can be run alongside to load the maps stand-in too.
+
+Each simulated user logs in as one of the synthetic users and repeatedly goes through a visit
+to the site: browsing their matches and the profiles of some of the players found, posting in a
+thread of one of their groups, and making a donation. Every request is timed, and the 50th, 95th
+and 99th percentile times for each page are reported at the end (and written to --output as JSON).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import date
+import requests
+
+PREFIX = "synthetic_"
+PASSWORD = "synthetic"
+
+MATCH_LINKS = re.compile(r'href="(/matches/[a-zA-Z]+/[a-zA-Z]+/)"')
+PROFILE_LINKS = re.compile(r'href="(/profile/(?!edit/)[^/"]+/)"')
+GROUP_LINKS = re.compile(r'href="(/groups/\d+/)"')
+THREAD_LINKS = re.compile(r'href="(/groups/\d+/thread/\d+/)"')
+
+
+def percentile(times, fraction):
+    """
+    The nearest-rank percentile of a sorted list
+    """
+    return times[min(int(len(times) * fraction), len(times) - 1)]
+
+
+class Results(object):
+    """
+    The time taken by every request, by page name - shared between the simulated users
+    """
+    def __init__(self):
+        self.times = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, took, ok):
+        with self.lock:
+            self.times.setdefault(name, []).append(took * 1000)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self):
+        summary = {}
+        for name, times in self.times.items():
+            times = sorted(times)
+            summary[name] = {"requests": len(times), "errors": self.errors.get(name, 0),
+                             "p50_ms": percentile(times, 0.5), "p95_ms": percentile(times, 0.95),
+                             "p99_ms": percentile(times, 0.99), "max_ms": times[-1]}
+        return summary
+
+
+class SimulatedUser(threading.Thread):
+    def __init__(self, base_url, username, password, iterations, results, seed):
+        super(SimulatedUser, self).__init__()
+        self.daemon = True
+        self.base_url = base_url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.iterations = iterations
+        self.results = results
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+
+    def request(self, name, method, path, data=None, expect=200):
+        """
+        Makes a timed request, with the CSRF token for any form posted. Redirects are not
+        followed, so that each page is timed on its own.
+        """
+        if data is not None:
+            data = dict(data, csrfmiddlewaretoken=self.session.cookies.get("csrftoken", ""))
+        started = time.time()
+        try:
+            response = self.session.request(method, self.base_url + path, data=data,
+                                            allow_redirects=False, timeout=60)
+        except requests.RequestException:
+            self.results.record(name, time.time() - started, False)
+            return None
+        self.results.record(name, time.time() - started, response.status_code == expect)
+        return response.text if response.status_code == expect else None
+
+    def links(self, page, pattern, count=1):
+        found = sorted(set(pattern.findall(page or "")))
+        return self.rng.sample(found, min(count, len(found)))
+
+    def run(self):
+        self.request("login_page", "GET", "/login/")
+        if self.request("login", "POST", "/login/", expect=302,
+                        data={"username": self.username, "password": self.password}) is None:
+            return
+        for _ in range(self.iterations):
+            self.visit()
+        self.request("logout", "GET", "/logout/", expect=302)
+
+    def visit(self):
+        page = self.request("matches", "GET", "/matches/")
+        for path in self.links(page, MATCH_LINKS):
+            page = self.request("matches_detail", "GET", path)
+            for profile in self.links(page, PROFILE_LINKS, 2):
+                self.request("user_profile", "GET", profile)
+
+        page = self.request("my_groups", "GET", "/groups/")
+        for path in self.links(page, GROUP_LINKS):
+            page = self.request("group_detail", "GET", path)
+            for thread in self.links(page, THREAD_LINKS):
+                self.request("view_thread", "GET", thread)
+                self.request("post_message", "POST", thread, expect=302,
+                             data={"message": "A load test post at %s" % time.ctime()})
+
+        self.request("donate_page", "GET", "/donate/")
+        # the token would normally come from Stripe's own Javascript - the stand-in Stripe
+        # accepts anything
+        self.request("donate", "POST", "/donate/", expect=302, data={
+            "credit_card_number": "4242424242424242", "cvv": "123",
+            "expiry_month": 12, "expiry_year": date.today().year + 1,
+            "stripe_id": "tok_visa", "amount": "5.00"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the site, and report page timings")
+    parser.add_argument("base_url", help="Where the site is running, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=10,
+                        help="The number of users using the site at once")
+    parser.add_argument("--iterations", type=int, default=5,
+                        help="The number of visits each user makes")
+    parser.add_argument("--population", type=int, default=1000,
+                        help="The number of synthetic users to choose the users from")
+    parser.add_argument("--password", default=PASSWORD)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="A file to write the results to, as JSON")
+    options = parser.parse_args()
+
+    rng = random.Random(options.seed)
+    results = Results()
+    users = [SimulatedUser(options.base_url,
+                           "%s%07d" % (PREFIX, num), options.password, options.iterations,
+                           results, rng.random())
+             for num in rng.sample(range(options.population), options.users)]
+    started = time.time()
+    for user in users:
+        user.start()
+    for user in users:
+        # (joining with a timeout keeps the main thread able to receive Ctrl-C)
+        while user.is_alive():
+            user.join(1)
+    took = time.time() - started
+
+    summary = results.summary()
+    total = sum(page["requests"] for page in summary.values())
+    print("%d requests in %.1fs (%.1f requests/s)" % (total, took, total / took))
+    print("%-16s %8s %7s %9s %9s %9s %9s" % ("page", "requests", "errors",
+                                              "p50 ms", "p95 ms", "p99 ms", "max ms"))
+    for name, page in sorted(summary.items()):
+        print("%-16s %8d %7d %9.1f %9.1f %9.1f %9.1f"
+              % (name, page["requests"], page["errors"],
+                 page["p50_ms"], page["p95_ms"], page["p99_ms"], page["max_ms"]))
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump({"users": options.users, "iterations": options.iterations,
+                       "seconds": took, "pages": summary}, output, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
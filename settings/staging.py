@@ -17,6 +17,10 @@ LOGGING = {
             'handlers': ['console'],
             'level': os.getenv('DJANGO_LOG_LEVEL', 'DEBUG'),
         },
+        'chamber_mates': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
     },
 }
 
@@ -1,5 +1,7 @@
+from datetime import datetime, time
 from django.contrib.gis import forms
 from django.contrib.auth.models import User
+from django.utils import timezone
 from ajax_select.fields import AutoCompleteField
 from .models import Message
 
@@ -22,3 +24,37 @@ class MessageForm(forms.ModelForm):
             return User.objects.get(username=data)
         except User.DoesNotExist:
             raise forms.ValidationError("Please enter an existing username")
+
+
+class MessageIdsField(forms.Field):
+    """
+    A list of message ids, sent as repeated form values
+    """
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        try:
+            return [int(pk) for pk in value or []]
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Invalid message ids")
+
+
+class DeleteMessagesForm(forms.Form):
+    """
+    The messages to delete from the inbox or sent messages - either those picked out by id, or
+    all of them sent before a given date (or both together)
+    """
+    ids = MessageIdsField(required=False)
+    older_than = forms.DateField(required=False)
+
+    def clean_older_than(self):
+        # the start of the given day, so that it can be compared directly with sent_date
+        date = self.cleaned_data["older_than"]
+        if date is not None:
+            return timezone.make_aware(datetime.combine(date, time.min))
+
+    def clean(self):
+        cleaned_data = super(DeleteMessagesForm, self).clean()
+        if not cleaned_data.get("ids") and not cleaned_data.get("older_than"):
+            raise forms.ValidationError("Please choose which messages to delete")
+        return cleaned_data
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Django can't yet describe partial indexes on a model, so they are created directly.
+# Each only holds the messages still showing on its side, in the order the pages are read.
+INBOX_INDEX = """
+    CREATE INDEX user_messages_message_inbox
+    ON user_messages_message (user_to_id, sent_date DESC, id DESC)
+    WHERE NOT receiver_deleted
+"""
+
+OUTBOX_INDEX = """
+    CREATE INDEX user_messages_message_outbox
+    ON user_messages_message (user_from_id, sent_date DESC, id DESC)
+    WHERE NOT sender_deleted
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_messages', '0006_message_seen_date'),
+    ]
+
+    operations = [
+        migrations.RunSQL(INBOX_INDEX, "DROP INDEX user_messages_message_inbox"),
+        migrations.RunSQL(OUTBOX_INDEX, "DROP INDEX user_messages_message_outbox"),
+    ]
@@ -7,6 +7,11 @@ from django.utils import timezone
 
 # Create your models here.
 class Message(models.Model):
+    """
+    A private message between two users. The inbox and sent messages pages are served by
+    partial indexes on (user_to, sent_date, id) and (user_from, sent_date, id), covering only the
+    messages which haven't been deleted from that side - see migration 0007.
+    """
     user_from = models.ForeignKey(User, related_name="user_from")
     user_to = models.ForeignKey(User, related_name="user_to")
     title = models.CharField(max_length=100, blank=True, null=True)
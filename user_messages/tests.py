@@ -1,6 +1,61 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from datetime import timedelta
 from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from chamber_mates.query_budget import QueryBudgetMixin
+from models import Message
+from views import MESSAGES_PER_PAGE
 
 # Create your tests here.
+class InboxTest(QueryBudgetMixin, TestCase):
+    """
+    Tests the paging of the inbox, and deleting messages from it
+    """
+    def test_inbox_pages(self):
+        alice = User.objects.create_user(username="alice", password="secretpwd")
+        bob = User.objects.create_user(username="bob", password="secretpwd")
+        for num in range(MESSAGES_PER_PAGE + 3):
+            Message.objects.create(user_from=bob, user_to=alice, title="Message %d" % num,
+                                   message="Hello")
+        Message.objects.create(user_from=bob, user_to=alice, title="Deleted", message="Hello",
+                               receiver_deleted=True)
+        self.client.login(username="alice", password="secretpwd")
+
+        with self.assertQueryBudget("inbox"):
+            first = self.client.get(reverse("inbox")).context["usermessages"]
+        self.assertEqual(len(first), MESSAGES_PER_PAGE)
+        self.assertEqual(first.items[0].title, "Message %d" % (MESSAGES_PER_PAGE + 2))
+        self.assertIsNone(first.previous_cursor)
+        second = self.client.get(reverse("inbox"), {"after": first.next_cursor}).context["usermessages"]
+        self.assertEqual([msg.title for msg in second], ["Message 2", "Message 1", "Message 0"])
+        self.assertIsNone(second.next_cursor)
+
+    def test_bulk_delete(self):
+        alice = User.objects.create_user(username="alice", password="secretpwd")
+        bob = User.objects.create_user(username="bob", password="secretpwd")
+        old = Message.objects.create(user_from=bob, user_to=alice, title="Old", message="Hello",
+                                     sent_date=timezone.now() - timedelta(days=10))
+        new = Message.objects.create(user_from=bob, user_to=alice, title="New", message="Hello")
+        someone_elses = Message.objects.create(user_from=alice, user_to=bob, title="Bob's",
+                                               message="Hello")
+        self.client.login(username="alice", password="secretpwd")
+
+        older_than = (timezone.now() - timedelta(days=5)).date().isoformat()
+        self.client.post(reverse("delete", kwargs={"view": "inbox"}), {"older_than": older_than})
+        old.refresh_from_db()
+        self.assertTrue(old.receiver_deleted)
+        self.assertFalse(Message.objects.get(pk=new.pk).receiver_deleted)
+
+        self.client.post(reverse("delete", kwargs={"view": "inbox"}),
+                         {"ids": [new.pk, someone_elses.pk]})
+        self.assertTrue(Message.objects.get(pk=new.pk).receiver_deleted)
+        self.assertFalse(Message.objects.get(pk=someone_elses.pk).receiver_deleted)
+
+        # once the sender has deleted them too, they are gone for good
+        self.client.login(username="bob", password="secretpwd")
+        self.client.post(reverse("delete", kwargs={"view": "sent"}), {"ids": [old.pk, new.pk]})
+        self.assertEqual(list(Message.objects.all()), [someone_elses])
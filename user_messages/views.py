@@ -7,19 +7,27 @@ from django.core.exceptions import PermissionDenied
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
+from django.db import connection, transaction
 from django.http import Http404
 from django.template.context_processors import csrf
 from django.utils import timezone
+from django.views.decorators.http import require_POST
+from accounts import notifications
+from chamber_mates.pagination import KeysetPaginator
 from .models import Message
-from .forms import MessageForm
+from .forms import MessageForm, DeleteMessagesForm
+
+MESSAGES_PER_PAGE = 10
 
 # Create your views here.
 @login_required(login_url=reverse_lazy("login"))
 def inbox(request):
     """
-    A view for displaying the user's message inbox
+    A view for displaying the user's message inbox, a page at a time (newest first)
     """
-    user_messages = Message.objects.filter(user_to=request.user, receiver_deleted=False).order_by("-sent_date")
+    user_messages = KeysetPaginator(Message.objects.filter(user_to=request.user, receiver_deleted=False)
+                                                   .select_related("user_from"),
+                                    "sent_date", MESSAGES_PER_PAGE, descending=True).page_for_request(request)
     return render(request, "user_messages/messages.html", {"active": "dashboard", "view": "inbox",
                                                   "usermessages": user_messages})
 
@@ -27,65 +35,78 @@ def inbox(request):
 @login_required(login_url=reverse_lazy("login"))
 def outbox(request):
     """
-    A view for displaying the user's sent messages
+    A view for displaying the user's sent messages, a page at a time (newest first)
     """
-    user_messages = Message.objects.filter(user_from=request.user, sender_deleted=False).order_by("-sent_date")
+    user_messages = KeysetPaginator(Message.objects.filter(user_from=request.user, sender_deleted=False)
+                                                   .select_related("user_to"),
+                                    "sent_date", MESSAGES_PER_PAGE, descending=True).page_for_request(request)
     return render(request, "user_messages/messages.html", {"active": "dashboard", "view": "sent",
                                                            "usermessages": user_messages})
 
 
+def delete_messages(user, view, ids=None, older_than=None):
+    """
+    Deletes the given user's messages from their inbox or sent messages (as "view" says), returning
+    how many were deleted. Note that deletion is "one-sided" - a user can delete a message from
+    their inbox without it disappearing from the sender's outbox. This is what the sender_deleted
+    and receiver_deleted fields are for. The message is only actually deleted when both these fields
+    are set to True.
+    The messages to delete are those with the given ids, and/or sent before "older_than". However
+    many there are, this is one UPDATE and one DELETE, in a single transaction.
+    """
+    if view == "inbox":
+        side, deleted, other_deleted = "user_to", "receiver_deleted", "sender_deleted"
+    else:
+        side, deleted, other_deleted = "user_from", "sender_deleted", "receiver_deleted"
+    to_delete = Message.objects.filter(**{side: user, deleted: False})
+    if ids:
+        to_delete = to_delete.filter(pk__in=ids)
+    if older_than is not None:
+        to_delete = to_delete.filter(sent_date__lt=older_than)
+
+    with transaction.atomic():
+        num_deleted = to_delete.update(**{deleted: True})
+        if num_deleted:
+            # messages deleted by both users can go for good. Message.objects.filter().delete()
+            # would fetch them first to send post_delete for each - which isn't needed here, as a
+            # message deleted by its receiver no longer counts towards any notifications, and
+            # nothing refers to a Message - so they are deleted with a single statement, which
+            # deliberately sends no signals
+            gone, params = Message.objects.filter(**{side: user, deleted: True,
+                                                     other_deleted: True}) \
+                                          .values("pk").query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM %s WHERE id IN (%s)" % (Message._meta.db_table, gone),
+                               params)
+    if num_deleted and view == "inbox":
+        # the update above doesn't send post_save either
+        notifications.refresh(user.pk, "unread_messages")
+    return num_deleted
+
+
 @login_required(login_url=reverse_lazy("login"))
-def delete(request, to_delete, view):
+@require_POST
+def delete(request, view):
     """
-    view to handle the deleting of messages. Note that deletion is "one-sided" - a user can delete a message
-    from their inbox without it disappearing from the receiver's outbox. This is what the sender_deleted and
-    receiver_deleted fields are for. The message is only actually deleted when both these fields are set to
-    True.
+    View to handle the deleting of messages, posted from the inbox/outbox or a single message.
+    Only the current user's messages can be deleted - any other ids are ignored.
     """
     if view not in ["inbox", "sent"]:
         raise Http404("Page not found")
 
-    if view == "inbox":
-        user_messages = Message.objects.filter(user_to=request.user, receiver_deleted=False).order_by("-sent_date")
-    else:
-        user_messages = Message.objects.filter(user_from=request.user, sender_deleted=False).order_by("-sent_date")
-    
-    ids_to_delete = map(int, to_delete.split("-"))
-    msgs = []
-
-    for key in ids_to_delete:
-        try:
-            msg = user_messages.get(pk=key)
-            msgs.append(msg)
-        except Message.DoesNotExist:
-            # this exception should not arise during "normal" use - but if for some reason a user
-            # enters one of the "delete" URLs manually, we need to handle the case where the messages
-            # does not exist.
-            # This also serves the very important purpose of preventing maliciously deleting another
-            # user's messages by typing the URL to delet it directly. (Since the messages have already
-            # been filtered into the "legal" ones, any such attempt will raise this DoesNotExist error.)
-            messages.error(request, "Unable to delete the specified messages")
-            return redirect(reverse(view))
-
-        
-    for msg in msgs:
-        if view=="inbox":
-            msg.receiver_deleted=True
-            if msg.sender_deleted:
-                msg.delete()
-            else:
-                msg.save()
-        else:
-            msg.sender_deleted=True
-            if msg.receiver_deleted:
-                msg.delete()
-            else:
-                msg.save()
-
-    if len(msgs)>1:
-        success_str = "Messages successfully deleted!"
-    else:
+    form = DeleteMessagesForm(request.POST)
+    if not form.is_valid():
+        messages.error(request, "Unable to delete the specified messages")
+        return redirect(reverse(view))
+
+    num_deleted = delete_messages(request.user, view, form.cleaned_data["ids"],
+                                  form.cleaned_data["older_than"])
+    if num_deleted > 1:
+        success_str = "%d messages successfully deleted!" % num_deleted
+    elif num_deleted == 1:
         success_str = "Message successfully deleted!"
+    else:
+        success_str = "There were no messages to delete"
     messages.success(request, success_str)
     return redirect(reverse(view))
 